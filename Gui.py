@@ -1,5 +1,6 @@
 import patch_subprocess
-from form_transformation import extract_audio_from_video, convert_audio_format, convert_video_format 
+from form_transformation import convert_file, plan_conversion, BatchConversion
+from media_remux import probe as probe_media
 import multiprocessing
 import sys
 from PIL import Image
@@ -11,53 +12,100 @@ import time
 import unicodedata 
 import base64
 from editor import AudioProcessor
+from waveform_peaks import PeakCache
 import aiohttp
 import time 
 import asyncio
 import threading
-from flask import Flask, send_from_directory
+from flask import Flask, send_from_directory, send_file, abort, request, jsonify
 from flask_cors import CORS 
-import shutil
+from urllib.parse import quote
 import io
 import re
 from http.server import SimpleHTTPRequestHandler, HTTPServer
-from pydub import AudioSegment
 from configs import config_manager
 from pathlib import Path # Added for UPLOADS_DIR
 
 # from spleeter_part import spleeter_part
 from research_videos import BiliVideoDownloader, YoutubeDownloader
-if sys.platform == 'darwin':
-    ctx = multiprocessing.get_context('spawn')
-    Process = ctx.Process
-    Queue = ctx.Queue
-else:
-    Process = multiprocessing.Process
-    Queue = multiprocessing.Queue
+from spleeter_service import SpleeterService
+from job_scheduler import JobScheduler, JobCancelled
+from download_queue import DownloadQueue
+from http_pool import HttpPool, DEFAULT_POOL_LIMIT, DEFAULT_PER_HOST_LIMIT
+from thumbnail_cache import ThumbnailCache, DEFAULT_CACHE_BYTES as DEFAULT_THUMBNAIL_BYTES
+from file_registry import FileRegistry
+from chunked_upload import (
+    UploadStore, UploadError, DEFAULT_CHUNK_SIZE as DEFAULT_UPLOAD_CHUNK_SIZE, DEFAULT_MAX_UPLOAD_SIZE
+)
+# webview 子进程在 macOS 上必须使用 spawn 启动
+Process = multiprocessing.get_context('spawn').Process if sys.platform == 'darwin' else multiprocessing.Process
 
 # Define UPLOADS_DIR globally
 UPLOADS_DIR = Path(__file__).parent / "uploads"
 UPLOADS_DIR.mkdir(parents=True, exist_ok=True) # Ensure the directory exists
 
 webview_process = None
+# Flask 服务只监听本机；可写入的 /upload/ 路由只接受 webview 页面（本地静态服务器或 Vite 开发服务器）的跨域请求
+FLASK_HOST = '127.0.0.1'
+WEBVIEW_ORIGINS = [
+    'http://localhost:8000', 'http://127.0.0.1:8000',
+    'http://localhost:3000', 'http://127.0.0.1:3000',
+]
+# 分离任务轮询常驻分离服务进度的间隔（秒）
+SEPARATION_POLL_INTERVAL = 0.2
+# 下载封面时使用的请求头（B 站图床校验 Referer）
+COVER_HEADERS = {
+    'Referer': 'https://www.bilibili.com/',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
 
 
 class Api:
     def __init__(self):
-        self.Bili_downloader = BiliVideoDownloader()
+        # 共享的长连接池：搜索、视频信息、封面和下载复用连接，退出时关闭
+        self.http = HttpPool(
+            config_manager.get('httpPoolLimit', DEFAULT_POOL_LIMIT),
+            config_manager.get('httpPerHostLimit', DEFAULT_PER_HOST_LIMIT)
+        )
+        self.Bili_downloader = BiliVideoDownloader(http=self.http)
         self.youtube_downloader = YoutubeDownloader()
         # self.spl = spleeter_part()
         self.upload_dir = os.path.join(os.path.dirname(__file__), 'uploads')
         if not os.path.exists(self.upload_dir):
             os.makedirs(self.upload_dir)
         self.preview_cache = {}
-        # 用于追踪spl进程
-        self.spl_process = None
-        self.spl_queue = Queue()  # 新增进程通信队列
+        # 封面缩略图缓存，经由 Flask 的 /thumbs/ 路由提供，代替 base64 内联图片
+        self.thumbnails = ThumbnailCache(
+            os.path.join(self.upload_dir, '.thumbs'),
+            self._fetch_cover,
+            config_manager.get('thumbnailCacheBytes', DEFAULT_THUMBNAIL_BYTES)
+        )
+        # 本地文件登记表：Flask 的 /files/ 路由按令牌直接读取原文件，不再复制到 uploads
+        self.files = FileRegistry()
+        # 分块上传：前端经由 Flask 的 /upload/ 路由直接发送二进制分块，代替整个文件的 base64
+        self.uploads = UploadStore(
+            self.upload_dir,
+            config_manager.get('uploadChunkBytes', DEFAULT_UPLOAD_CHUNK_SIZE),
+            finalize_name=self._sanitize_filename,
+            max_size=config_manager.get('uploadMaxBytes', DEFAULT_MAX_UPLOAD_SIZE)
+        )
+        # 常驻的人声分离服务，模型在多次任务之间保持加载
+        self.spleeter_service = SpleeterService(cache_dir=os.path.join(self.upload_dir, '.stems'))
+        # 长耗时操作的后台调度器，各类任务有独立的线程池与并发上限
+        self.jobs = JobScheduler(config_manager.get('jobLimits'))
+        # 持久化下载队列：按平台限制同时下载数，重启后继续未完成的下载
+        self.downloads = DownloadQueue(
+            os.path.join(self.upload_dir, '.downloads.sqlite3'),
+            {
+                'bilibili': {'video': self._download_bili_video},
+                'youtube': {'video': self._download_youtube_video, 'playlist': self._download_playlist},
+            },
+            config_manager.get('downloadLimits')
+        )
         # 新增黑暗模式追踪
         self.dark_mode = False
         # 初始化音频处理器
-        self.audio_processor = AudioProcessor()
+        self.audio_processor = AudioProcessor(peak_cache=PeakCache(os.path.join(self.upload_dir, '.peaks')))
         self.temp_audio_dir = os.path.join(os.path.dirname(__file__), 'temp_audio')
         os.makedirs(self.temp_audio_dir, exist_ok=True)
         logging.info("Api class initialized.")
@@ -144,8 +192,7 @@ class Api:
             self.audio_processor.export(temp_path)
             
             # 返回由Flask服务器提供的URL
-            url_filename = temp_filename.replace('\\', '/')
-            return {'success': True, 'url': f'http://localhost:5000/audio/{url_filename}'}
+            return {'success': True, 'url': self._file_url(temp_path)}
         except Exception as e:
             logging.error(f"获取当前音频URL失败: {str(e)}", exc_info=True)
             return {"success": False, "error": str(e)}
@@ -167,32 +214,36 @@ class Api:
             return {"success": False, "error": str(e)}
 
     def save_recorded_audio(self, data):
+        """
+        保存录音。data 中有 path 时表示录音已经通过分块上传（/upload/）保存，只补充时长；
+        否则按旧方式解码 base64_data 写入
+        """
         try:
             base64_data = data.get('base64_data')
             file_name = data.get('file_name')
             frontend_duration = data.get('duration', 0)  # 获取前端传递的时长
 
-            # 确保上传目录存在
-            os.makedirs(self.upload_dir, exist_ok=True)
-            save_path = os.path.join(self.upload_dir, file_name)
-            
-            # 保存文件
-            file_bytes = base64.b64decode(base64_data)
-            with open(save_path, 'wb') as f:
-                f.write(file_bytes)
+            if data.get('path'):
+                save_path = data['path']
+                if os.path.dirname(os.path.abspath(save_path)) != os.path.abspath(self.upload_dir):
+                    return {"success": False, "error": "录音文件不在上传目录中"}
+                file_name = file_name or os.path.basename(save_path)
+            else:
+                # 确保上传目录存在
+                os.makedirs(self.upload_dir, exist_ok=True)
+                save_path = os.path.join(self.upload_dir, file_name)
+
+                # 保存文件
+                file_bytes = base64.b64decode(base64_data)
+                with open(save_path, 'wb') as f:
+                    f.write(file_bytes)
 
             # 使用前端提供的时长（如果有效）
             duration = frontend_duration if frontend_duration > 0 else 0
             
-            # 如果前端没提供时长，尝试用pydub获取
+            # 如果前端没提供时长，从探测结果中读取（不解码音频，结果缓存供随后的 load_audio 使用）
             if duration <= 0:
-                try:
-                    from pydub import AudioSegment
-                    audio = AudioSegment.from_file(save_path)
-                    duration = len(audio) / 1000.0  # 毫秒转秒
-                except Exception as e:
-                    logging.error(f"Pydub failed to read audio file {save_path}: {e}", exc_info=True)
-                    duration = 0
+                duration = self._probe_duration(save_path) or 0
             
                 
             return {
@@ -208,6 +259,8 @@ class Api:
         """
         Receives a File object from the frontend and saves it to the uploads directory.
         This function will now block until the file is saved.
+        整个文件以 base64 经过 JS 桥接并在内存中解码，只适合小文件；
+        前端上传文件应使用分块上传（utils/upload.js 与 Flask 的 /upload/ 路由）
         """
         try:
             logging.debug(f"Received file_object type: {type(file_object)}")
@@ -249,21 +302,56 @@ class Api:
     #                 break
     #             f.write(chunk)
 
-    def generate_waveform(self, file_path, resolution=800): # Adjusted default resolution to match editor.py
-        """生成波形数据"""
+    def generate_waveform(self, file_path, resolution=800, start_ms=None, end_ms=None): # Adjusted default resolution to match editor.py
+        """生成波形数据，可选只返回 [start_ms, end_ms] 可见范围"""
         try:
-            # Use the updated generate_waveform that loads from path directly
-            waveform = self.audio_processor.generate_waveform(audio_path=file_path, width=resolution)
+            # Peaks are served from the cached pyramid, so zooming does not decode again
+            waveform = self.audio_processor.generate_waveform(
+                audio_path=file_path, width=resolution, start_ms=start_ms, end_ms=end_ms
+            )
             if "error" in waveform:
                  return {"success": False, "error": waveform["error"]}
             return {
                 "success": True,
                 "data": waveform["waveform"],
-                "duration": waveform["duration"]
+                "min": waveform["min"],
+                "max": waveform["max"],
+                "duration": waveform["duration"] or self._probe_duration(file_path) or 0.0
             }
         except Exception as e:
             logging.error(f"生成波形失败: {str(e)}", exc_info=True)
             return {"success": False, "error": str(e)}
+    def start_waveform_stream(self, file_path):
+        """开始在后台流式生成波形，立即返回"""
+        try:
+            self.audio_processor.start_waveform_stream(file_path)
+            return {"success": True}
+        except Exception as e:
+            logging.error(f"启动流式波形失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def poll_waveform(self, file_path, resolution=800, duration=None):
+        """
+        获取流式波形的部分或最终结果，不阻塞 JS 桥接线程
+        :param duration: 可选，音频总时长；未提供时使用缓存的探测结果，部分结果仍可按比例绘制
+        """
+        try:
+            duration = duration or self._probe_duration(file_path)
+            waveform = self.audio_processor.poll_waveform(file_path, width=resolution, duration=duration)
+            if "error" in waveform:
+                return {"success": False, "error": waveform["error"]}
+            return {
+                "success": True,
+                "done": waveform["done"],
+                "data": waveform["waveform"],
+                "min": waveform["min"],
+                "max": waveform["max"],
+                "duration": waveform["duration"]
+            }
+        except Exception as e:
+            logging.error(f"获取流式波形失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
     def get_audio_url(self, filename):
         """获取正确的音频文件 URL"""
         # 确保文件名是安全的
@@ -277,65 +365,59 @@ class Api:
         # 返回相对路径（前端会通过代理访问）
         return {'success': True, 'url': f'/audio/{safe_filename}'}
     def get_local_file_url(self, file_path):
-        """获取本地文件的正确 URL（由 Flask 服务器提供）"""
+        """
+        获取本地文件的 URL（由 Flask 服务器的 /files/ 路由直接读取原文件，不复制）
+        """
         try:
-            # Get absolute and normalized paths for both source and upload directory
-            source_abs_path = os.path.normpath(os.path.abspath(file_path))
-            upload_abs_dir = os.path.normpath(os.path.abspath(self.upload_dir))
-
-            # Get the target path within the upload directory
-            target_abs_path = os.path.join(upload_abs_dir, os.path.basename(source_abs_path))
-            target_abs_path = os.path.normpath(target_abs_path)
-
-            # Check if the source file is the same as the target file in the upload directory
-            # Use os.path.samefile for a robust check across different path representations
-            is_same_file = False
-            logging.debug(f"Comparing source: {source_abs_path} (exists: {os.path.exists(source_abs_path)})")
-            logging.debug(f"Comparing target: {target_abs_path} (exists: {os.path.exists(target_abs_path)})")
-            try:
-                # Check if both paths exist before calling samefile
-                if os.path.exists(source_abs_path) and os.path.exists(target_abs_path):
-                     is_same_file = os.path.samefile(source_abs_path, target_abs_path)
-                # If target_abs_path doesn't exist, they can't be the same file, is_same_file remains False
-            except Exception as e:
-                # Handle other potential exceptions from os.path.samefile
-                logging.warning(f"Error checking if files are the same using os.path.samefile: {e}")
-                is_same_file = False # Assume not the same file on error
-
-            final_file_path_to_use = target_abs_path # Assume the file should end up here
-
-            if not is_same_file:
-                logging.info(f"File {source_abs_path} is not the same as target {target_abs_path}. Copying.")
-                # 复制文件
-                shutil.copy2(source_abs_path, target_abs_path)
-                logging.info(f"File copied to {final_file_path_to_use}")
-            else:
-                logging.info(f"File {source_abs_path} is already the same as target {target_abs_path}. Skipping copy.")
-                # final_file_path_to_use is already set to target_abs_path
-
-            # Check if the final file exists at the expected location
-            if not os.path.exists(final_file_path_to_use):
-                logging.error(f"File does not exist at final path: {final_file_path_to_use}")
-                return {'success': False, 'error': '文件不存在'}
-
-            filename = os.path.basename(final_file_path_to_use)
-
-            # 返回URL
-            url_filename = filename.replace('\\', '/')
-            return {'success': True, 'url': f'http://localhost:5000/audio/{url_filename}'}
-
+            return {'success': True, 'url': self._file_url(file_path)}
+        except FileNotFoundError:
+            logging.error(f"File does not exist: {file_path}")
+            return {'success': False, 'error': '文件不存在'}
         except Exception as e:
             logging.exception(f"获取本地文件URL失败: {str(e)}")
             return {'success': False, 'error': str(e)}
+
+    def _file_url(self, file_path):
+        """登记本地文件并返回其 URL；末尾的文件名只用于浏览器识别类型，读取时以令牌为准"""
+        token = self.files.register(file_path)
+        return f'http://localhost:5000/files/{token}/{quote(os.path.basename(file_path))}'
     # 音频处理功能
     def load_audio(self, file_path):
+        """
+        加载音频到编辑器
+        :return: {"success", "info", "duration", "media"}；duration / media 来自缓存的探测结果，
+                 之后的波形请求直接使用同一份数据
+        """
         try:
             self.audio_processor.load_from_file(file_path)
             logging.debug(f"加载音频成功: {file_path}")
-            return {"success": True, "info": self.audio_processor.get_current_info()}
+            info = self.audio_processor.get_current_info()
+            media = self._probe_summary(file_path)
+            duration = (media or {}).get('duration') or info['duration']
+            return {"success": True, "info": info, "duration": duration, "media": media}
         except Exception as e:
             return {"success": False, "error": str(e)}
 
+    def _probe_summary(self, file_path):
+        """返回文件的时长、码率和第一路音频流的编码 / 采样率 / 声道（带缓存），探测失败时返回 None"""
+        try:
+            info = probe_media(file_path)
+        except Exception as e:
+            logging.warning(f"探测媒体信息失败 {file_path}: {e}")
+            return None
+        audio = next((stream for stream in info['streams'] if stream['codec_type'] == 'audio'), {})
+        return {
+            "duration": info['duration'],
+            "bit_rate": info['bit_rate'],
+            "format_name": info['format_name'],
+            "codec_name": audio.get('codec_name'),
+            "sample_rate": audio.get('sample_rate'),
+            "channels": audio.get('channels'),
+        }
+
+    def _probe_duration(self, file_path):
+        return (self._probe_summary(file_path) or {}).get('duration')
+
     # def clip_audio(self, start, end):
     #     try:
     #         self.audio_processor.clip(start, end)
@@ -419,7 +501,7 @@ class Api:
         :param split_times: 分割时间点列表 (秒)
         :param deleted_regions: 删除区域列表 [{start: 秒, end: 秒}]
         :param output_filename: 导出文件名 (可选)。如果未提供，将打开保存文件对话框。
-        :return: 成功/失败状态和导出路径
+        :return: 任务句柄；编辑立即生效并计入历史，编码导出在后台执行，任务结果中包含导出路径
         """
         try:
             if not self.audio_processor.audio:
@@ -443,109 +525,65 @@ class Api:
             # Ensure the output directory exists for the chosen path
             os.makedirs(output_dir, exist_ok=True)
 
-            # Store current state before processing for history
-            self.audio_processor._add_to_history() # Add current state before modification
-
-            original_audio = self.audio_processor.audio # Work on the current audio state
-
-            # 1. Combine all significant time points
-            time_points = [0] + split_times + [original_audio.duration_seconds]
-            
-            # Add start and end points of deleted regions
-            for region in deleted_regions:
-                time_points.append(region['start'])
-                time_points.append(region['end'])
-
-            # Sort and remove duplicates
-            time_points = sorted(list(set(time_points)))
-            
-            logging.debug(f"处理时间点: {time_points}")
+            # Split lines only mark positions; what gets removed is the union of the
+            # deleted regions, which is merged once and complemented into keep-spans.
+            logging.debug(f"分割时间点: {split_times}")
             logging.debug(f"删除区域: {deleted_regions}")
-
-            processed_audio = AudioSegment.empty()
-
-            # 2. Iterate through segments defined by time points
-            for i in range(len(time_points) - 1):
-                start_time = time_points[i]
-                end_time = time_points[i+1]
-
-                # Convert to milliseconds
-                start_ms = int(start_time * 1000)
-                end_ms = int(end_time * 1000)
-
-                # Check if this segment overlaps with any deleted region
-                is_deleted = False
-                for region in deleted_regions:
-                    region_start_ms = int(region['start'] * 1000)
-                    region_end_ms = int(region['end'] * 1000)
-                    
-                    # Check for overlap: max(seg_start, reg_start) < min(seg_end, reg_end)
-                    if max(start_ms, region_start_ms) < min(end_ms, region_end_ms):
-                        is_deleted = True
-                        logging.debug(f"Segment [{start_time:.2f}s - {end_time:.2f}s] overlaps with deleted region [{region['start']:.2f}s - {region['end']:.2f}s]. Skipping.")
-                        break # No need to check other deleted regions for this segment
-
-                # If the segment is not deleted, append it to the processed audio
-                if not is_deleted:
-                    segment = original_audio[start_ms:end_ms]
-                    processed_audio += segment
-                    logging.debug(f"Segment [{start_time:.2f}s - {end_time:.2f}s] kept.")
-
-            # 3. Update the audio processor's current audio
-            self.audio_processor.audio = processed_audio
-            self.audio_processor._update_original_info() # Update info based on new audio
-            logging.debug(f"Attempting to export to: {final_output_path}")
-            self.audio_processor.export(final_output_path)
-
-            logging.info(f"音频处理和导出成功: {final_output_path}")
-            return {
-                "success": True,
-                "path": final_output_path,
-                "info": self.audio_processor.get_current_info(), # Return info of the processed audio
-                "state": self.audio_processor.get_history_state() # Return updated history state
-            }
+            deleted_ranges_ms = [
+                (int(region['start'] * 1000), int(region['end'] * 1000))
+                for region in deleted_regions
+            ]
+
+            # Record the edit in history and gather the kept spans in one pass
+            self.audio_processor.remove_ranges(deleted_ranges_ms)
+            # The edit is cheap; encoding is not. Export a snapshot of the result in
+            # the background so later undo/redo calls don't race with the encoder.
+            job = self.jobs.submit(
+                'cpu', self._run_export_audio, final_output_path, self.audio_processor.audio,
+                self.audio_processor.get_current_info(), self.audio_processor.get_history_state(),
+                kind='export_audio'
+            )
+            return {"success": True, "job_id": job.id, "path": final_output_path}
 
         except Exception as e:
             logging.error(f"音频处理和导出失败: {str(e)}", exc_info=True)
             return {"success": False, "error": str(e)}
 
+    def _run_export_audio(self, job, output_path, audio, info, state):
+        logging.debug(f"Attempting to export to: {output_path}")
+        self.audio_processor.export(output_path, audio=audio)
+        logging.info(f"音频处理和导出成功: {output_path}")
+        return {
+            "success": True,
+            "path": output_path,
+            "info": info, # Info of the processed audio
+            "state": state # History state after the edit
+        }
+
     def search_videos(self, keyword, platform, page=1, per_page=20):
-        # Run the asynchronous search function
-        return asyncio.run(self._search_videos_sync(keyword, platform, page, per_page))
+        # 在共享事件循环中执行，复用其中的 aiohttp 连接池
+        return self.jobs.run_coroutine(self._search_videos_sync(keyword, platform, page, per_page))
     
     async def _search_videos_sync(self, keyword, platform, page=1, per_page=20):
         start_time = time.time()
         if platform == 'bilibili':
             logging.debug(f"Searching videos with keyword: {keyword}")
-            # Bili_downloader.search_videos is still synchronous, so run it in a thread pool
-            loop = asyncio.get_running_loop()
-            bvids, titles, total = await loop.run_in_executor(
-                None, self.Bili_downloader.search_videos, keyword, page, per_page
-            )
+            # 搜索结果页有缓存，未命中时在线程池中执行同步的搜索请求
+            bvids, titles, total = await self.Bili_downloader.search_videos_cached(keyword, page, per_page)
             
-            # Prepare tasks for fetching video info and cover images concurrently
-            video_info_tasks = [self._get_video_info(bvid) for bvid in bvids]
-            video_infos = await asyncio.gather(*video_info_tasks)
-            
-            image_proxy_tasks = []
-            for video_info in video_infos:
-                if video_info and video_info.get('pic'):
-                    image_proxy_tasks.append(self.get_image_proxy(video_info['pic']))
-                else:
-                    image_proxy_tasks.append(asyncio.sleep(0, result='')) # Placeholder for missing pic or failed video_info
-
-            cover_datas = await asyncio.gather(*image_proxy_tasks)
+            # 批量获取视频信息，已缓存的 bvid（翻页返回、预览过的）不再请求
+            video_infos = await self.Bili_downloader.get_video_views(bvids)
 
             results = []
             for idx, bvid in enumerate(bvids):
                 video_info = video_infos[idx]
-                cover_data = cover_datas[idx]
                 
                 results.append({
                     'bvid': bvid,
                     'title': video_info.get('title', titles[idx]) if video_info else titles[idx],
                     'url': f"https://www.bilibili.com/video/{bvid}",
-                    'pic': f"data:image/jpeg;base64,{cover_data}" if cover_data else '',
+                    # 封面由本地缩略图缓存提供，首次被页面请求时才下载
+                    'pic': self._thumbnail_url(video_info.get('pic')) if video_info else '',
                     'author': video_info.get('owner', {}).get('name', '未知UP主') if video_info else '未知UP主',
                     'duration': video_info.get('duration', '未知时长') if video_info else '未知时长',
                 })
@@ -577,7 +615,7 @@ class Api:
                     'bvid': video['id'],
                     'title': video['title'],
                     'url': f"https://www.youtube.com/watch?v={video['id']}",
-                    'pic':f"https://img.youtube.com/vi/{video['id']}/mqdefault.jpg",
+                    'pic': self._thumbnail_url(f"https://img.youtube.com/vi/{video['id']}/mqdefault.jpg"),
                     'author': video.get('author', '未知UP主'),
                     'duration': video.get('duration', '未知时长'),
                 })
@@ -624,7 +662,7 @@ class Api:
                     'title': detail_info.get('title', '无标题'),
                     'direct_url': direct_url,  # 直接播放的URL
                     'author': detail_info.get('owner', {}).get('name', '未知UP主'),
-                    'cover': detail_info.get('pic', ''),
+                    'cover': self._thumbnail_url(detail_info.get('pic')),
                     'embed_url': f"https://player.bilibili.com/player.html?bvid={bvid}"
                 }
             return self.preview_cache[bvid]
@@ -633,82 +671,65 @@ class Api:
             return {'error': '解析视频地址失败'}
 
     def get_video_preview(self, bvid):
-        return asyncio.run(self._get_video_preview_async(bvid))
+        return self.jobs.run_coroutine(self._get_video_preview_async(bvid))
 
-    def download_video(self, bvid, title):
-        """同步方法：下载B站视频"""
-        async def _download_task():
-            try:
-                # 获取视频信息
-                video_info = await self._get_video_info(bvid)
-                if not video_info:
-                    logging.error(f"无法获取视频信息: {bvid}")
-                    return
-                    
-                # 获取播放信息
-                loop = asyncio.get_running_loop()
-                play_info = await loop.run_in_executor(
-                    None, 
-                    self.Bili_downloader.get_playinfo, 
-                    f"https://www.bilibili.com/video/{bvid}"
-                )
-                
-                if play_info:
-                    # 下载视频
-                    await loop.run_in_executor(
-                        None, 
-                        self.Bili_downloader.download_video, 
-                        play_info, 
-                        title
-                    )
-                    return {"success": True,"title": title}
-                return {"success": False, "error": "无法获取播放信息"}
-            except Exception as e:
-                logging.exception(f"下载失败: {str(e)}")
-                return {"success": False, "error": str(e)}
-
-        # 在事件循环中运行异步任务
+    def download_video(self, bvid, title, priority=0, audio_only=False):
+        """
+        下载B站视频：加入持久化下载队列，立即返回条目ID，通过 get_download_status 轮询
+        :param audio_only: 只下载音频流（不下载视频轨），保存为 .m4a
+        """
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                # 如果事件循环已在运行，创建新任务
-                task = loop.create_task(_download_task())
-                return {"status": "started", "bvid": bvid}
-            else:
-                # 直接运行异步任务
-                result = loop.run_until_complete(_download_task())
-                return result
-        except RuntimeError as e:
-            # 处理没有事件循环的情况
-            result = asyncio.run(_download_task())
+            params = {"bvid": bvid, "title": title, "audio_only": bool(audio_only)}
+            download_id = self.downloads.enqueue('bilibili', 'video', params, title, priority)
+            return {"success": True, "download_id": download_id, "bvid": bvid}
+        except Exception as e:
+            logging.error(f"加入下载队列失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def _download_bili_video(self, params, control):
+        """下载队列的B站视频处理函数"""
+        bvid, title = params['bvid'], params['title']
+        # 获取视频信息
+        video_info = self.jobs.run_coroutine(self._get_video_info(bvid))
+        if not video_info:
+            logging.error(f"无法获取视频信息: {bvid}")
+            return {"success": False, "error": "无法获取视频信息"}
+
+        # 获取播放信息（流地址带时效签名，每次下载都重新获取）
+        play_info = self.Bili_downloader.get_playinfo(f"https://www.bilibili.com/video/{bvid}")
+        if not play_info:
+            return {"success": False, "error": "无法获取播放信息"}
+
+        # 下载视频，进度写入队列条目
+        result = self.Bili_downloader.download_video(
+            play_info, title,
+            on_progress=lambda downloaded, total: control.report(downloaded=downloaded, total=total),
+            should_stop=control.should_stop,
+            audio_only=params.get('audio_only', False)
+        )
+        if result and not result.get('success'):
             return result
-    def download_youtube_video(self, video_url,video_title):
-        """异步下载YouTube视频"""
-        async def _download_task():
-            try:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(
-                    None, 
-                    self.youtube_downloader.download_video, 
-                    video_url
-                )
-                return {"success": True,"title":video_title}
-            except Exception as e:
-                logging.exception(f"YouTube下载失败: {str(e)}")
-                return {"success": False, "error": str(e)}
-        
-        # 在事件循环中运行异步任务
+        return {"success": True, "title": title, "path": result.get('path'), "streams": result.get('streams')}
+
+    def download_youtube_video(self, video_url, video_title, priority=0):
+        """下载YouTube视频：加入持久化下载队列，立即返回条目ID"""
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.create_task(_download_task())
-                return {"status": "started", "video_url": video_url}
-            else:
-                result = loop.run_until_complete(_download_task())
-                return result
-        except RuntimeError:
-            result = asyncio.run(_download_task())
+            download_id = self.downloads.enqueue(
+                'youtube', 'video', {"url": video_url, "title": video_title}, video_title, priority
+            )
+            return {"success": True, "download_id": download_id, "video_url": video_url}
+        except Exception as e:
+            logging.error(f"加入下载队列失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def _download_youtube_video(self, params, control):
+        """下载队列的YouTube视频处理函数"""
+        result = self.youtube_downloader.download_video(
+            params['url'], on_progress=lambda progress: control.report(**progress), should_stop=control.should_stop
+        )
+        if result and not result.get('success'):
             return result
+        return {"success": True, "title": params.get('title')}
 
     def check_if_playlist(self, url):
         """检查YouTube链接是否为播放列表"""
@@ -720,60 +741,135 @@ class Api:
             logging.error(f"检查播放列表失败: {e}", exc_info=True)
             return False, None, None
 
-    def download_playlist(self, playlist_url):
-        """异步下载YouTube播放列表"""
-        async def _download_task():
-            try:
-                loop = asyncio.get_running_loop()
-                await loop.run_in_executor(
-                    None,
-                    self.youtube_downloader.download_playlist,
-                    playlist_url
-                )
-                return {"success": True}
-            except Exception as e:
-                logging.exception(f"YouTube播放列表下载失败: {str(e)}")
-                return {"success": False, "error": str(e)}
+    def download_playlist(self, playlist_url, priority=0):
+        """下载YouTube播放列表：加入持久化下载队列，立即返回条目ID"""
+        try:
+            download_id = self.downloads.enqueue('youtube', 'playlist', {"url": playlist_url}, playlist_url, priority)
+            return {"success": True, "download_id": download_id, "playlist_url": playlist_url}
+        except Exception as e:
+            logging.error(f"加入下载队列失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
 
+    def _download_playlist(self, params, control):
+        """下载队列的YouTube播放列表处理函数"""
+        return self.youtube_downloader.download_playlist(
+            params['url'], on_progress=lambda progress: control.report(**progress), should_stop=control.should_stop
+        )
+
+    def download_bili_videos(self, videos, priority=0, audio_only=False):
+        """
+        批量加入B站视频（如整个合集）到下载队列，实际同时下载数受 downloadLimits 限制
+        :param videos: [{'bvid', 'title'}, ...]
+        :param audio_only: 只下载音频流
+        :return: 条目ID列表
+        """
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.create_task(_download_task())
-                return {"status": "started", "playlist_url": playlist_url}
-            else:
-                result = loop.run_until_complete(_download_task())
-                return result
-        except RuntimeError:
-            result = asyncio.run(_download_task())
-            return result
-            
+            download_ids = self.downloads.enqueue_many([
+                {
+                    "platform": "bilibili", "kind": "video",
+                    "params": {"bvid": video['bvid'], "title": video['title'], "audio_only": bool(audio_only)},
+                    "title": video['title'], "priority": priority
+                }
+                for video in videos
+            ])
+            return {"success": True, "download_ids": download_ids}
+        except Exception as e:
+            logging.error(f"加入下载队列失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def get_download_status(self, download_id):
+        """获取下载条目的状态、进度（downloaded / total 字节）和结果"""
+        try:
+            return {"success": True, **self.downloads.get(download_id)}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    def list_downloads(self, status=None, platform=None):
+        """列出下载队列中的条目，以及各平台、各状态的数量"""
+        try:
+            return {
+                "success": True,
+                "items": self.downloads.list(status, platform),
+                "summary": self.downloads.summary()
+            }
+        except Exception as e:
+            logging.error(f"获取下载队列失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def pause_download(self, download_id):
+        return self._control_download(self.downloads.pause, download_id)
+
+    def resume_download(self, download_id):
+        return self._control_download(self.downloads.resume, download_id)
+
+    def cancel_download(self, download_id):
+        return self._control_download(self.downloads.cancel, download_id)
+
+    def set_download_priority(self, download_id, priority):
+        return self._control_download(self.downloads.set_priority, download_id, priority)
+
+    def _control_download(self, action, download_id, *args):
+        try:
+            status = action(download_id, *args)
+            return {"success": True, "status": status or self.downloads.get(download_id)['status']}
+        except Exception as e:
+            logging.error(f"操作下载条目失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
     def get_collection_videos(self, mid, season_id):
-        data = self.Bili_downloader.get_collection_videos(mid, season_id, page_num=1, page_size=50)
-        if not data or not data.get('success'):
-            return {'success': False, 'error': data.get('error', '无法获取收藏夹视频信息')}
-        results = []
-        for video in data.get('items', []):
-            results.append({
-                'bvid': video.get('bvid'),
-                'title': video.get('title'),
-                'cover': video.get('cover'),
-                'duration': video.get('duration'),
-                'author': video.get('author')
-            })
-    
-        return {'success': True, 'items': results}
+        """
+        提交合集列表任务，立即返回任务句柄；各页并发获取，已取得的条目按页码顺序
+        实时放在任务进度的 items 中（loaded / total），前端可以边加载边展示。
+        任务结果为 {'success', 'items', 'meta', 'total'}
+        """
+        try:
+            job = self.jobs.submit('io', self._run_collection_listing, mid, season_id, kind='collection')
+            return {"success": True, "job_id": job.id}
+        except Exception as e:
+            logging.error(f"获取合集视频失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def _format_collection_item(self, video):
+        return {
+            'bvid': video.get('bvid'),
+            'title': video.get('title'),
+            'cover': self._thumbnail_url(video.get('cover')),
+            'duration': video.get('duration'),
+            'author': video.get('author')
+        }
+
+    async def _run_collection_listing(self, job, mid, season_id):
+        pages = {}
+        meta, total = {}, 0
+        async for page in self.Bili_downloader.iter_collection_videos(mid, season_id):
+            job.check_cancelled()
+            meta, total = page['meta'], page['total']
+            pages[page['page_num']] = [self._format_collection_item(video) for video in page['items']]
+            items = [item for page_num in sorted(pages) for item in pages[page_num]]
+            job.update(items=items, loaded=len(items), total=total, meta=meta)
+        items = [item for page_num in sorted(pages) for item in pages[page_num]]
+        return {'success': True, 'items': items, 'meta': meta, 'total': total}
         
+    def _fetch_cover(self, url):
+        response = self.http.get(url, headers=COVER_HEADERS)
+        response.raise_for_status()
+        return response.content
+
+    def _thumbnail_url(self, url):
+        """把远端封面地址换成本地缩略图缓存的 URL"""
+        if not url:
+            return ''
+        if url.startswith('//'):
+            url = 'https:' + url
+        return f'http://localhost:5000/thumbs/{self.thumbnails.register(url)}.jpg'
+
     async def _get_image_proxy_sync(self, url):
         try:
-            headers = {
-                'Referer': 'https://www.bilibili.com/',
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            async with aiohttp.ClientSession(headers=headers) as session:
-                async with session.get(url, timeout=10) as response:
-                    response.raise_for_status()
-                    content = await response.read()
-                    return base64.b64encode(content).decode('utf-8')
+            session = self.http.aio_session()
+            async with session.get(url, headers=COVER_HEADERS) as response:
+                response.raise_for_status()
+                content = await response.read()
+                return base64.b64encode(content).decode('utf-8')
         except aiohttp.ClientError as e:
             logging.error(f"图片代理失败: {str(e)}")
             return None
@@ -784,53 +880,19 @@ class Api:
     def get_image_proxy(self, url):
         # This function is now a simple wrapper for the async function
         return self._get_image_proxy_sync(url)
-    def process_audio(self, number, input_filename, output_directory, codec, bitrate):
-        """使用子进程处理音频"""
+    def process_audio(self, number, input_filename, output_directory, codec, bitrate, window_seconds=None):
+        """
+        提交人声分离任务，立即返回任务句柄；通过 get_job_status 轮询阶段进度和结果
+        :param window_seconds: 可选，分段分离窗口长度（秒），用内存换速度；默认读取配置 spleeterWindowSeconds
+        :return: {"success": True, "job_id": ...}，任务结果与原先同步返回的内容一致
+        """
         try:
-            # 验证输入参数
-            if number not in [2, 4, 5]:
-                raise ValueError("无效的分离模型类型")
-
-            # Extract basename, sanitize it, and construct the full path within the upload directory
-            base_filename = os.path.basename(input_filename)
-            sanitized_base_filename = self._sanitize_filename(base_filename)
-            input_path = os.path.join(self.upload_dir, sanitized_base_filename)
-            if not os.path.exists(input_path):
-                raise FileNotFoundError("音频文件不存在")
-
-            # 创建并启动子进程
-            self.spl_process = Process(
-                target=self._run_spleeter_in_subprocess,
-                args=(number, input_path, output_directory, codec, bitrate)
+            input_path = self._separation_input_path(number, input_filename)
+            job = self.jobs.submit(
+                'inference', self._run_separation, number, input_path, output_directory, codec, bitrate, window_seconds,
+                kind='separation'
             )
-            self.spl_process.start()
-            self.spl_process.join()  # 等待子进程完成
-
-            # 获取处理结果
-            if not self.spl_queue.empty():
-                result = self.spl_queue.get()
-                if result.get('error'):
-                    raise Exception(result['error'])
-
-                # Extract output files from result
-                output_files = []
-                output_dir = result.get('output_dir')
-                if output_dir:
-                    stems = self._get_output_stems(number)
-                    for stem in stems:
-                        file_path = os.path.join(output_dir, f"{stem}.{codec}")
-                        if os.path.exists(file_path):
-                            output_files.append({
-                                "name": f"{stem}.{codec}",
-                                "path": file_path,
-                                "size": os.path.getsize(file_path)
-                            })
-
-                return {
-                    "success": True,
-                    "output_files": output_files
-                }
-
+            return {"success": True, "job_id": job.id}
         except Exception as e:
             logging.error(f"音频处理失败: {str(e)}", exc_info=True)
             return {
@@ -838,73 +900,145 @@ class Api:
                 "error": str(e),
                 "error_type": type(e).__name__
             }
-        finally:
-            # 确保清理进程
-            if self.spl_process and self.spl_process.is_alive():
-                self.spl_process.terminate()
-            self.spl_process = None
-    def _run_spleeter_in_subprocess(self, number, input_path, output_dir, codec, bitrate):
-        """子进程执行函数"""
+
+    def _separation_input_path(self, number, input_filename):
+        """校验分离参数，返回上传目录中的输入文件路径"""
+        if number not in [2, 4, 5]:
+            raise ValueError("无效的分离模型类型")
+
+        # Extract basename, sanitize it, and construct the full path within the upload directory
+        base_filename = os.path.basename(input_filename)
+        sanitized_base_filename = self._sanitize_filename(base_filename)
+        input_path = os.path.join(self.upload_dir, sanitized_base_filename)
+        if not os.path.exists(input_path):
+            raise FileNotFoundError("音频文件不存在")
+        return input_path
+
+    def _wait_for_separation(self, job, service_job_id, on_update=None):
+        """
+        轮询分离服务，把阶段进度转发到调度任务上，直到分离结束
+        :param on_update: 可选，批量任务每完成一个文件时以结果条目调用
+        """
+        while True:
+            progress = self.spleeter_service.poll(service_job_id)
+            if progress['progress']:
+                job.update(**progress['progress'])
+            for item in progress['updates']:
+                if on_update:
+                    on_update(item)
+            if progress['done']:
+                return progress['result']
+            if job.cancelled:
+                self.spleeter_service.discard(service_job_id)
+                raise JobCancelled()
+            time.sleep(SEPARATION_POLL_INTERVAL)
+
+    def _run_separation(self, job, number, input_path, output_directory, codec, bitrate, window_seconds):
+        # 提交到常驻分离服务，已加载的模型会被直接复用
+        service_job_id = self.spleeter_service.submit(number, input_path, output_directory, codec, bitrate, window_seconds)
+        result = self._wait_for_separation(job, service_job_id)
+        if not result.get('success'):
+            return {"success": False, "error": result.get('error', '未知错误'), "error_type": result.get('error_type')}
+        logging.info(
+            f"分离完成，用时 {result['processing_time']}s "
+            f"(模型已预热: {result['warm']}, 缓存命中: {result.get('cache_hit')})"
+        )
+        return {
+            "success": True,
+            "output_files": self._describe_output_files(result.get('output_files', [])),
+            "processing_time": result['processing_time'],
+            "cache_hit": result.get('cache_hit'),
+            "progress": result.get('progress')
+        }
+
+    def process_audio_batch(self, files, stems, codec, bitrate, output_directory=None):
+        """
+        批量人声分离：模型只加载一次，后续文件在推理当前文件时提前解码。
+        立即返回任务ID，通过 get_job_status 轮询：progress.items 为已完成文件的结果，结束后 result 为吞吐量汇总
+        :param files: 文件路径列表（或包含 path 字段的字典列表）
+        """
         try:
-            ffmpeg_dir = resource_path(os.path.join("ffmpeg"))
-            if os.path.isdir(ffmpeg_dir):
-                print(f"[Spleeter Subprocess] Found bundled FFmpeg directory: {ffmpeg_dir}")
-                original_path = os.environ.get("PATH", "")
-                os.environ["PATH"] = ffmpeg_dir + os.pathsep + original_path
-                
-                print(f"[Spleeter Subprocess] Temporarily prepended FFmpeg dir to PATH.")
-                # logging.debug(f"New PATH for subprocess: {os.environ['PATH']}") # for debugging
-            else:
-                print("[Spleeter Subprocess] WARNING! Bundled FFmpeg directory not found.")
-                print("                     Spleeter will rely on the system's global PATH.")
-          
-            from spleeter_part import SpleeterPart  # 在子进程内导入
-            start_time = time.time()
+            if stems not in [2, 4, 5]:
+                raise ValueError("无效的分离模型类型")
+            input_paths = [f['path'] if isinstance(f, dict) else f for f in files]
+            missing = [path for path in input_paths if not os.path.exists(path)]
+            if missing:
+                raise FileNotFoundError(f"音频文件不存在: {', '.join(missing)}")
+            if not input_paths:
+                raise ValueError("没有需要处理的文件")
+
+            output_dir = output_directory or config_manager.get('defaultOutput', os.path.join(os.getcwd(), 'output'))
+            os.makedirs(output_dir, exist_ok=True)
+            job = self.jobs.submit(
+                'inference', self._run_separation_batch, stems, input_paths, output_dir, codec, bitrate,
+                kind='separation_batch'
+            )
+            return {"success": True, "job_id": job.id, "total": len(input_paths)}
+        except Exception as e:
+            logging.error(f"批量音频处理失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e), "error_type": type(e).__name__}
+
+    def _run_separation_batch(self, job, stems, input_paths, output_dir, codec, bitrate):
+        items = []
+
+        def on_update(item):
+            item = dict(item)
+            if item.get('success'):
+                item['output_files'] = self._describe_output_files(item['output_files'])
+            items.append(item)
+            job.update(items=list(items), completed=len(items), total=len(input_paths))
+
+        job.update(items=[], completed=0, total=len(input_paths))
+        prefetch = config_manager.get('spleeterDecodeThreads', 2)
+        service_job_id = self.spleeter_service.submit_batch(stems, input_paths, output_dir, codec, bitrate, prefetch=prefetch)
+        result = self._wait_for_separation(job, service_job_id, on_update)
+        if not result.get('success'):
+            return {"success": False, "error": result.get('error', '未知错误'), "items": items}
+        return {"success": True, "items": items, "summary": result.get('summary')}
+
+    def get_job_status(self, job_id):
+        """
+        非阻塞获取后台任务的状态：status 为 queued / running / succeeded / failed / cancelled，
+        progress 为任务汇报的进度，结束后 result 为原先同步接口的返回值
+        """
+        try:
+            return {"success": True, **self.jobs.get(job_id).to_dict()}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
 
-            # 初始化新的spleeter实例
-            spl = SpleeterPart()
-            
-            # 根据类型调用处理
-            if number == 2:
-                spl.spleeter_2stems(input_path, output_dir, codec, bitrate)
-            elif number == 4:
-                spl.spleeter_4stems(input_path, output_dir, codec, bitrate)
-            elif number == 5:
-                spl.spleeter_5stems(input_path, output_dir, codec, bitrate)
-
-            # 强制释放资源
-            spl.release()
-            # del spl
-
-            # 返回结果到队列
-            self.spl_queue.put({
-                "success": True,
-                "processing_time": round(time.time() - start_time, 1)
-            })
-            
+    def cancel_job(self, job_id):
+        """请求取消后台任务，返回取消后的状态"""
+        try:
+            return {"success": True, "status": self.jobs.cancel(job_id)}
         except Exception as e:
-            self.spl_queue.put({
-                "success": False,
-                "error": str(e),
-                "error_type": type(e).__name__
-            })
-        finally:
-            # 子进程自动退出时会释放所有资源
-            import gc
-            gc.collect()
-    def _get_output_stems(self, number):
-        """获取输出音轨描述"""
-        stems_map = {
-            2: ["人声", "伴奏"],
-            4: ["人声", "鼓", "贝斯", "其他"],
-            5: ["人声", "鼓", "贝斯", "钢琴", "其他"]
-        }
-        return stems_map.get(number, [])
-        
+            logging.error(f"取消任务失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": str(e)}
+
+    def list_jobs(self, pool=None):
+        """列出后台任务（可按 cpu / io / inference 过滤）"""
+        return {"success": True, "jobs": self.jobs.list(pool)}
+
+    def get_http_stats(self, reset=False):
+        """共享连接池的请求数、新建连接数、复用率与平均/最大延迟（sync: requests，async: aiohttp）"""
+        stats = self.http.stats()
+        if reset:
+            self.http.reset_stats()
+        return {"success": True, **stats}
+
+    def _describe_output_files(self, file_paths):
+        """将输出路径转换为前端展示所需的名称/路径/大小"""
+        output_files = []
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                output_files.append({
+                    "name": os.path.basename(file_path),
+                    "path": file_path,
+                    "size": os.path.getsize(file_path)
+                })
+        return output_files
+
     async def _get_video_info_sync(self, bvid):
-        url = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
-        data = await self.Bili_downloader.get_api_data(url)
-        return data.get('data', {}) if data else {}
+        return await self.Bili_downloader.get_video_view(bvid) or {}
 
     def _get_video_info(self, bvid):
         # This function is now a simple wrapper for the async function
@@ -915,7 +1049,7 @@ class Api:
             return f"{round(num/10000, 1)}万"
         return str(num)
     def whether_collection(self, bvid):
-        return asyncio.run(self.Bili_downloader.whether_collection(bvid))
+        return self.jobs.run_coroutine(self.Bili_downloader.whether_collection(bvid))
     
     def get_cwd(self):
         """获取当前工作目录"""
@@ -1058,28 +1192,71 @@ class Api:
             if not os.path.exists(input_path):
                 return {"success": False, "error": f"输入文件不存在: {input_path}"}
 
-            # Determine if it's an audio or video conversion
-            is_video = input_path.lower().endswith(('.mp4', '.avi', '.mkv'))
-            is_audio_output = output_format.lower() in ['mp3', 'wav', 'ogg']
-
-            if is_video and is_audio_output:
-                # Video to audio conversion
-                extract_audio_from_video(input_path, output_path)
-                if not os.path.exists(output_path):
-                    return {"success": False, "error": "视频提取音频失败"}
-                return {"success": True, "message": f"视频已成功提取音频并转换为 {output_format.upper()}", "path": output_path}
-            elif not is_video and is_audio_output:
-                # Audio to audio conversion
-                convert_audio_format(input_path, output_path)
-                return {"success": True, "message": f"音频已成功转换为 {output_format.upper()}", "path": output_path}
-            elif is_video and not is_audio_output:
-                # Video to video conversion
-                convert_video_format(input_path, output_path)
-                return {"success": True, "message": f"视频已成功转换为 {output_format.upper()}", "path": output_path}
+            # 按探测到的流选择复制文件、只换封装、提取音频或重新编码（探测结果有缓存）
+            try:
+                plan = plan_conversion(input_path, output_path)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}
+
+            # 转换在后台执行，立即返回任务句柄；copy / remux / audio_copy 不需要 CPU 编码，放到 io 池
+            pool = 'cpu' if plan['action'] == 'transcode' else 'io'
+            job = self.jobs.submit(
+                pool, self._run_form_transformation, input_path, output_path, output_format, plan,
+                kind='form_transformation'
+            )
+            return {"success": True, "job_id": job.id, "path": output_path, "action": plan['action']}
+
+        except Exception as e:
+            logging.error(f"格式转换失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": f"转换失败: {str(e)}"}
+
+    def form_transformation_batch(self, sources, output_format, output_dir=None):
+        """
+        批量格式转换：sources 为文件路径列表或一个目录（递归查找音视频文件），
+        在后台任务中由多个 ffmpeg 进程并行转换，输出已是最新的文件跳过
+        :param output_dir: 输出目录，默认为配置的 defaultOutput；目录中的子目录结构保持不变
+        :return: {"success": True, "job_id": ...}；进度中 files 为每个文件的状态和百分比，
+                 并包含 files_per_second / mb_per_second 吞吐量
+        """
+        try:
+            output_dir = output_dir or config_manager.get('defaultOutput', os.path.join(os.getcwd(), 'output'))
+            batch = BatchConversion(sources, output_dir, output_format)
+            if not batch.files:
+                return {"success": False, "error": "没有找到可转换的文件"}
+            job = self.jobs.submit('cpu', self._run_form_transformation_batch, batch, kind='form_transformation_batch')
+            return {"success": True, "job_id": job.id, "total": len(batch.files)}
+        except Exception as e:
+            logging.error(f"批量格式转换失败: {str(e)}", exc_info=True)
+            return {"success": False, "error": f"转换失败: {str(e)}"}
+
+    def _run_form_transformation_batch(self, job, batch):
+        batch.on_progress = lambda summary: job.update(**summary)
+        batch.should_stop = lambda: job.cancelled
+        summary = batch.run()
+        job.check_cancelled()
+        if summary['failed']:
+            return {"success": False, "error": f"{summary['failed']} 个文件转换失败", "summary": summary}
+        return {"success": True, "summary": summary}
+
+    def _run_form_transformation(self, job, input_path, output_path, output_format, plan):
+        try:
+            result = convert_file(
+                input_path, output_path, plan=plan,
+                on_progress=lambda progress: job.update(percent=progress['percent'], speed=progress['speed']),
+                should_stop=lambda: job.cancelled
+            )
+            if plan['is_video'] and len(plan['stream_types']) == 1:
+                message = f"视频已成功提取音频并转换为 {output_format.upper()}"
+            elif plan['is_video']:
+                message = f"视频已成功转换为 {output_format.upper()}"
             else:
-                return {"success": False, "error": "不支持的转换类型"}
+                message = f"音频已成功转换为 {output_format.upper()}"
+            # action 为转换方式，streams 说明每路流是直接复制（copy）还是重新编码（encode）
+            return {"success": True, "message": message, "path": result['path'], "action": result['action'],
+                    "streams": result['streams']}
 
         except Exception as e:
+            job.check_cancelled()
             logging.error(f"格式转换失败: {str(e)}", exc_info=True)
             return {"success": False, "error": f"转换失败: {str(e)}"}
 
@@ -1147,11 +1324,70 @@ def run_webview():
     def get_uploads(filename):
         """兼容旧的或错误的 /uploads/ 前缀"""
         return send_from_directory(app_flask.config['UPLOAD_FOLDER'], filename)
-    CORS(app_flask)
+
+    @app_flask.route('/thumbs/<key>.jpg')
+    def get_thumbnail(key):
+        """封面缩略图：命中磁盘缓存直接返回，否则下载、缩放后缓存"""
+        path = api.thumbnails.get_path(key) if re.fullmatch(r'[0-9a-f]{40}', key) else None
+        if path is None:
+            abort(404)
+        return send_file(path, mimetype='image/jpeg', cache_timeout=7 * 24 * 3600)
+
+    @app_flask.route('/files/<token>/<path:filename>')
+    def get_registered_file(token, filename):
+        """已登记的本地文件：直接读取原文件，支持 Range 请求（播放器拖动进度）"""
+        path = api.files.resolve(token) if re.fullmatch(r'[0-9a-f]{32}', token) else None
+        if path is None:
+            abort(404)
+        return send_file(path, conditional=True)
+
+    # 分块上传：begin 开始或恢复上传，PUT 写入 offset 处的分块，finish 校验后移动到上传目录
+    def _upload_response(call):
+        try:
+            return jsonify({"success": True, **call()})
+        except UploadError as e:
+            body = {"success": False, "error": str(e)}
+            if e.received is not None:
+                body["received"] = e.received
+            return jsonify(body), e.status
+        except Exception as e:
+            logging.error(f"分块上传失败: {str(e)}", exc_info=True)
+            return jsonify({"success": False, "error": str(e)}), 500
+
+    @app_flask.route('/upload/begin', methods=['POST'])
+    def upload_begin():
+        data = request.get_json(silent=True) or {}
+        return _upload_response(lambda: api.uploads.begin(
+            data.get('name'), data.get('size', -1), data.get('fingerprint'), data.get('sha256')
+        ))
+
+    @app_flask.route('/upload/<upload_id>', methods=['GET'])
+    def upload_status(upload_id):
+        return _upload_response(lambda: api.uploads.status(upload_id))
+
+    @app_flask.route('/upload/<upload_id>', methods=['PUT'])
+    def upload_chunk(upload_id):
+        # request.stream 按需读取请求体，分块不会整个读入内存
+        return _upload_response(lambda: api.uploads.write_chunk(
+            upload_id, request.args.get('offset', 0), request.stream,
+            request.content_length or 0, request.headers.get('X-Chunk-SHA256')
+        ))
+
+    @app_flask.route('/upload/<upload_id>/finish', methods=['POST'])
+    def upload_finish(upload_id):
+        return _upload_response(lambda: api.uploads.finish(upload_id))
+
+    @app_flask.route('/upload/<upload_id>', methods=['DELETE'])
+    def upload_abort(upload_id):
+        return _upload_response(lambda: api.uploads.abort(upload_id) or {})
+    CORS(app_flask, resources={
+        r"/upload/*": {"origins": WEBVIEW_ORIGINS},
+        r"/*": {"origins": "*"},
+    })
 
     # 定义一个本地函数来运行 Flask
     def _run_flask_local():
-        app_flask.run(host='0.0.0.0', port=5000, threaded=True, debug=False, use_reloader=False)
+        app_flask.run(host=FLASK_HOST, port=5000, threaded=True, debug=False, use_reloader=False)
 
     # 在当前进程中启动 Flask 服务器线程
     flask_local_thread = threading.Thread(target=_run_flask_local)
@@ -1180,6 +1416,11 @@ def run_webview():
     logging.info("Webview 窗口已创建，正在启动事件循环...")
     webview.start(debug=False) # debug=True in dev, debug=False in production
     logging.info("Webview 事件循环已退出。")
+    api.downloads.shutdown()
+    # aiohttp 会话需要在共享事件循环停止前关闭
+    api.http.close()
+    api.jobs.shutdown()
+    api.spleeter_service.shutdown()
 
 
 def start_webview_process():
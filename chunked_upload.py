@@ -0,0 +1,255 @@
+# chunked_upload.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# 建议的分块大小（字节，可通过配置 uploadChunkBytes 修改），单个分块的上限，以及写盘时的缓冲区大小
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+# 单个上传文件的大小上限（字节，可通过配置 uploadMaxBytes 修改）
+DEFAULT_MAX_UPLOAD_SIZE = 8 * 1024 * 1024 * 1024
+COPY_BUFFER_SIZE = 1024 * 1024
+# 超过该时间（秒）未继续的未完成上传在启动时清理
+STALE_SECONDS = 24 * 3600
+
+
+class UploadError(Exception):
+    """上传请求无效：status 为对应的 HTTP 状态码，received 为服务端已确认的字节数（如果有）"""
+
+    def __init__(self, message, status=400, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(COPY_BUFFER_SIZE)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadStore:
+    """
+    分块上传：文件按偏移量分块顺序写入 <upload_dir>/.partial/<upload_id>.part，
+    每块以固定大小的缓冲区直接写盘，内存占用与文件大小无关。
+    每块可附带 SHA-256，校验失败时截断回该块之前的位置；完成时计算整个文件的 SHA-256
+    （与调用方提供的值比较），再移动到 upload_dir。
+    进度保存在同目录的 .json 中：begin() 传入相同的 fingerprint 时返回原有的上传和已接收的字节数，
+    中断（包括程序重启）后从该位置继续
+    :param finalize_name: finalize_name(原始文件名) -> 保存时使用的文件名（例如清理非法字符）
+    :param max_size: 单个文件的大小上限，begin() 超过时拒绝
+    """
+
+    def __init__(self, upload_dir, chunk_size=DEFAULT_CHUNK_SIZE, finalize_name=None,
+                 max_size=DEFAULT_MAX_UPLOAD_SIZE):
+        self.upload_dir = upload_dir
+        self.partial_dir = os.path.join(upload_dir, '.partial')
+        self.chunk_size = max(64 * 1024, min(int(chunk_size), MAX_CHUNK_SIZE))
+        self.max_size = int(max_size)
+        self.finalize_name = finalize_name or os.path.basename
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self._locks = {}  # upload_id -> 该上传的写入锁
+        self._lock = threading.Lock()
+        self.cleanup()
+
+    def _paths(self, upload_id):
+        return (os.path.join(self.partial_dir, f"{upload_id}.part"),
+                os.path.join(self.partial_dir, f"{upload_id}.json"))
+
+    def _upload_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _load(self, upload_id):
+        if not upload_id or not all(c in '0123456789abcdef' for c in upload_id):
+            raise UploadError("无效的上传 ID", status=404)
+        part_path, state_path = self._paths(upload_id)
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            raise UploadError("上传不存在或已过期", status=404)
+        # 以磁盘上的实际长度为准（写入过程中程序退出时 .json 可能落后）
+        actual = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        state['received'] = min(state['received'], actual)
+        return state
+
+    def _save(self, state):
+        _, state_path = self._paths(state['upload_id'])
+        temp_path = f"{state_path}.tmp"
+        state['updated_at'] = time.time()
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, state_path)
+
+    @staticmethod
+    def _public(state):
+        return {
+            "upload_id": state['upload_id'],
+            "name": state['name'],
+            "size": state['size'],
+            "received": state['received'],
+            "chunk_size": state['chunk_size'],
+        }
+
+    def begin(self, name, size, fingerprint=None, sha256=None):
+        """
+        开始或恢复上传
+        :param fingerprint: 可选，标识同一个源文件（例如 名称:大小:修改时间），相同时恢复之前的上传
+        :param sha256: 可选，整个文件的 SHA-256，完成时校验
+        :return: {'upload_id', 'name', 'size', 'received', 'chunk_size'}
+        """
+        if not name:
+            raise UploadError("缺少文件名")
+        size = int(size)
+        if size < 0:
+            raise UploadError("文件大小无效")
+        if size > self.max_size:
+            raise UploadError(f"文件超过大小上限: {size} > {self.max_size}", status=413)
+        if fingerprint:
+            upload_id = hashlib.sha1(f"{fingerprint}\0{name}\0{size}".encode('utf-8')).hexdigest()
+            try:
+                state = self._load(upload_id)
+                if sha256:
+                    state['sha256'] = sha256.lower()
+                    self._save(state)
+                return self._public(state)
+            except UploadError:
+                pass
+        else:
+            upload_id = uuid.uuid4().hex
+        part_path, _ = self._paths(upload_id)
+        open(part_path, 'wb').close()
+        state = {
+            "upload_id": upload_id,
+            "name": name,
+            "size": size,
+            "received": 0,
+            "chunk_size": self.chunk_size,
+            "sha256": sha256.lower() if sha256 else None,
+            "created_at": time.time(),
+        }
+        self._save(state)
+        return self._public(state)
+
+    def status(self, upload_id):
+        return self._public(self._load(upload_id))
+
+    def write_chunk(self, upload_id, offset, stream, length, sha256=None):
+        """
+        从 stream 读取 length 字节写入 offset 处。offset 必须等于已接收的字节数；
+        小于时说明是重传，已写入的部分被跳过；大于时返回 409 和正确的位置
+        :param sha256: 可选，本块数据的 SHA-256，不一致时丢弃本块
+        :return: 同 status()
+        """
+        offset, length = int(offset), int(length)
+        if length < 0 or length > MAX_CHUNK_SIZE:
+            raise UploadError(f"分块大小无效: {length}", status=413)
+        with self._upload_lock(upload_id):
+            state = self._load(upload_id)
+            received = state['received']
+            if offset > received:
+                raise UploadError("分块偏移量超出已接收的位置", status=409, received=received)
+            if offset + length > state['size']:
+                raise UploadError("分块超出文件大小", status=400, received=received)
+            part_path, _ = self._paths(upload_id)
+            digest = hashlib.sha256()
+            skip = received - offset  # 重传时已写入磁盘的部分
+            remaining = length
+            with open(part_path, 'r+b') as f:
+                f.seek(max(offset, received))
+                while remaining > 0:
+                    block = stream.read(min(COPY_BUFFER_SIZE, remaining))
+                    if not block:
+                        break
+                    remaining -= len(block)
+                    digest.update(block)
+                    if skip >= len(block):
+                        skip -= len(block)
+                        continue
+                    f.write(block[skip:])
+                    skip = 0
+                if remaining > 0 or (sha256 and digest.hexdigest() != sha256.lower()):
+                    # 数据不完整或校验失败：截断回本块之前的位置
+                    f.truncate(received)
+                    reason = "分块数据不完整" if remaining > 0 else "分块校验失败"
+                    raise UploadError(reason, status=422, received=received)
+                f.truncate(max(received, offset + length))
+            state['received'] = max(received, offset + length)
+            self._save(state)
+            return self._public(state)
+
+    def finish(self, upload_id):
+        """
+        校验大小和 SHA-256 后把文件移动到 upload_dir
+        :return: {'path', 'name', 'size', 'sha256'}
+        """
+        with self._upload_lock(upload_id):
+            state = self._load(upload_id)
+            if state['received'] != state['size']:
+                raise UploadError("文件尚未上传完成", status=409, received=state['received'])
+            part_path, state_path = self._paths(upload_id)
+            sha256 = _sha256_file(part_path)
+            if state.get('sha256') and state['sha256'] != sha256:
+                self._remove(upload_id)
+                raise UploadError("文件校验失败，请重新上传", status=422, received=0)
+            name, path = self._claim_path(self.finalize_name(state['name']))
+            try:
+                os.replace(part_path, path)
+            except OSError:
+                os.remove(path)
+                raise
+            os.remove(state_path)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+        return {"path": path, "name": name, "size": state['size'], "sha256": sha256}
+
+    def _claim_path(self, name):
+        """
+        在 upload_dir 中占用一个不存在的文件名：同名文件已存在时依次尝试 name (1).ext、name (2).ext ……
+        以 O_EXCL 创建占位文件，并发完成的两个上传不会得到同一路径
+        :return: (文件名, 路径)
+        """
+        stem, ext = os.path.splitext(name)
+        candidate, index = name, 0
+        while True:
+            path = os.path.join(self.upload_dir, candidate)
+            try:
+                os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return candidate, path
+            except FileExistsError:
+                index += 1
+                candidate = f"{stem} ({index}){ext}"
+
+    def abort(self, upload_id):
+        with self._upload_lock(upload_id):
+            self._remove(upload_id)
+        with self._lock:
+            self._locks.pop(upload_id, None)
+
+    def _remove(self, upload_id):
+        for path in self._paths(upload_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def cleanup(self, max_age=STALE_SECONDS):
+        """删除超过 max_age 秒没有继续的未完成上传"""
+        now = time.time()
+        for name in os.listdir(self.partial_dir):
+            path = os.path.join(self.partial_dir, name)
+            try:
+                if now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError as e:
+                logging.warning(f"清理未完成的上传失败 {path}: {e}")
@@ -0,0 +1,338 @@
+# download_queue.py
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from range_downloader import DownloadInterrupted
+
+# 各平台默认的同时下载数（可通过配置 downloadLimits 覆盖，如 {"bilibili": 3}）
+DEFAULT_LIMITS = {
+    'bilibili': 2,
+    'youtube': 1,
+}
+# 进度写入数据库的最小间隔（秒），内存中的进度实时更新
+PROGRESS_FLUSH_INTERVAL = 1.0
+# 调度线程在没有事件时重新检查队列的间隔（秒）
+DISPATCH_INTERVAL = 2.0
+
+QUEUED = 'queued'
+RUNNING = 'running'
+PAUSED = 'paused'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS downloads (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT UNIQUE NOT NULL,
+    platform TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    title TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    progress TEXT,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS downloads_pending ON downloads (status, platform, priority DESC, seq);
+"""
+
+
+class _Control:
+    """传给下载处理函数：汇报进度、检查是否需要中止（暂停/取消/退出）"""
+
+    def __init__(self, queue, item_id):
+        self._queue = queue
+        self.item_id = item_id
+        self.stop_reason = None  # None / PAUSED / CANCELLED / QUEUED（退出时重新排队）
+        self._last_flush = 0.0
+
+    def should_stop(self):
+        return self.stop_reason is not None
+
+    def report(self, **progress):
+        now = time.time()
+        flush = now - self._last_flush >= PROGRESS_FLUSH_INTERVAL
+        if flush:
+            self._last_flush = now
+        self._queue._set_progress(self.item_id, progress, flush)
+
+
+class DownloadQueue:
+    """
+    持久化的下载队列（SQLite）：条目按优先级和入队顺序调度，每个平台有独立的同时下载上限。
+    支持暂停、恢复、取消和调整优先级；程序重启后，未完成的条目重新排队，
+    分段下载会从 .part 日志续传
+    :param handlers: {platform: {kind: handler}}，handler(params, control) 返回结果字典，
+                     被中止时抛出 DownloadInterrupted
+    """
+
+    def __init__(self, db_path, handlers, limits=None):
+        self.handlers = handlers
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._running = {}  # item_id -> _Control
+        self._progress = {}  # item_id -> 最新进度（尚未写入数据库的部分也在这里）
+        self._stopped = False
+        self._closed = False  # 数据库已关闭：之后迟到的状态更新直接忽略（下次启动时重新排队）
+        self._workers = {}  # item_id -> 执行该条目的线程
+        with self._lock:
+            self._db.executescript(_SCHEMA)
+            # 上次退出时仍在下载的条目重新排队
+            self._db.execute(
+                "UPDATE downloads SET status = ?, updated_at = ? WHERE status = ?",
+                (QUEUED, time.time(), RUNNING)
+            )
+            self._db.commit()
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="download-queue", daemon=True)
+        self._dispatcher.start()
+
+    # ---- 入队与控制 ----
+
+    def enqueue(self, platform, kind, params, title=None, priority=0):
+        """加入一个下载条目，返回条目ID"""
+        return self.enqueue_many([
+            {"platform": platform, "kind": kind, "params": params, "title": title, "priority": priority}
+        ])[0]
+
+    def enqueue_many(self, items):
+        """
+        在一个事务中批量加入下载条目（如整个合集），实际并发仍受平台上限约束
+        :param items: [{'platform', 'kind', 'params', 'title'?, 'priority'?}, ...]
+        :return: 条目ID列表
+        """
+        now = time.time()
+        rows = []
+        for item in items:
+            if item['kind'] not in self.handlers.get(item['platform'], {}):
+                raise ValueError(f"不支持的下载类型: {item['platform']}/{item['kind']}")
+            rows.append((
+                uuid.uuid4().hex, item['platform'], item['kind'], json.dumps(item['params'], ensure_ascii=False),
+                item.get('title'), int(item.get('priority', 0)), QUEUED, now, now
+            ))
+        with self._wakeup:
+            self._db.executemany(
+                "INSERT INTO downloads (id, platform, kind, params, title, priority, status, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            self._db.commit()
+            self._wakeup.notify()
+        return [row[0] for row in rows]
+
+    def pause(self, item_id):
+        """暂停排队中或正在下载的条目"""
+        return self._stop(item_id, PAUSED)
+
+    def cancel(self, item_id):
+        """取消条目；已下载的部分保留在 .part 文件中"""
+        return self._stop(item_id, CANCELLED)
+
+    def _stop(self, item_id, status):
+        with self._wakeup:
+            row = self._get_row(item_id)
+            if row['status'] in FINISHED_STATES:
+                return row['status']
+            control = self._running.get(item_id)
+            if control:
+                # 正在下载：由处理函数在下一个数据块后中止，结束时写入状态
+                control.stop_reason = status
+                return row['status']
+            self._update(item_id, status=status)
+            return status
+
+    def resume(self, item_id):
+        """恢复已暂停（或失败、取消）的条目，重新排队"""
+        with self._wakeup:
+            row = self._get_row(item_id)
+            if row['status'] in (PAUSED, FAILED, CANCELLED):
+                self._update(item_id, status=QUEUED, error=None)
+                self._wakeup.notify()
+                return QUEUED
+            control = self._running.get(item_id)
+            if control and control.stop_reason == PAUSED:
+                control.stop_reason = None
+            return row['status']
+
+    def set_priority(self, item_id, priority):
+        with self._wakeup:
+            self._get_row(item_id)
+            self._update(item_id, priority=int(priority))
+            self._wakeup.notify()
+
+    def clear_finished(self):
+        """删除已结束的条目，返回删除的数量"""
+        with self._lock:
+            cursor = self._db.execute(
+                f"DELETE FROM downloads WHERE status IN ({','.join('?' * len(FINISHED_STATES))})",
+                FINISHED_STATES
+            )
+            self._db.commit()
+            return cursor.rowcount
+
+    # ---- 查询 ----
+
+    def get(self, item_id):
+        with self._lock:
+            return self._to_dict(self._get_row(item_id))
+
+    def list(self, status=None, platform=None):
+        query = "SELECT * FROM downloads"
+        conditions, args = [], []
+        if status:
+            conditions.append("status = ?")
+            args.append(status)
+        if platform:
+            conditions.append("platform = ?")
+            args.append(platform)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY priority DESC, seq"
+        with self._lock:
+            return [self._to_dict(row) for row in self._db.execute(query, args).fetchall()]
+
+    def summary(self):
+        """各平台、各状态的条目数"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT platform, status, COUNT(*) AS count FROM downloads GROUP BY platform, status"
+            ).fetchall()
+        summary = {}
+        for row in rows:
+            summary.setdefault(row['platform'], {})[row['status']] = row['count']
+        return summary
+
+    # ---- 调度 ----
+
+    def _dispatch_loop(self):
+        while True:
+            with self._wakeup:
+                if self._stopped:
+                    return
+                for row in self._next_items():
+                    control = _Control(self, row['id'])
+                    self._running[row['id']] = control
+                    self._update(row['id'], status=RUNNING, attempts=row['attempts'] + 1)
+                    worker = threading.Thread(
+                        target=self._run_item, args=(dict(row), control),
+                        name=f"download-{row['platform']}", daemon=True
+                    )
+                    self._workers[row['id']] = worker
+                    worker.start()
+                self._wakeup.wait(DISPATCH_INTERVAL)
+
+    def _next_items(self):
+        """按平台的空闲名额挑选优先级最高、入队最早的条目（调用方持有锁）"""
+        busy = {}
+        for item_id in self._running:
+            platform = self._get_row(item_id)['platform']
+            busy[platform] = busy.get(platform, 0) + 1
+        selected = []
+        for platform in self.handlers:
+            free = int(self.limits.get(platform, 1)) - busy.get(platform, 0)
+            if free <= 0:
+                continue
+            selected += self._db.execute(
+                "SELECT * FROM downloads WHERE status = ? AND platform = ? ORDER BY priority DESC, seq LIMIT ?",
+                (QUEUED, platform, free)
+            ).fetchall()
+        return selected
+
+    def _run_item(self, row, control):
+        item_id = row['id']
+        handler = self.handlers[row['platform']][row['kind']]
+        status, result, error = FAILED, None, None
+        try:
+            result = handler(json.loads(row['params']), control)
+            if isinstance(result, dict) and result.get('success') is False:
+                error = result.get('error')
+            else:
+                status = SUCCEEDED
+        except DownloadInterrupted:
+            status = control.stop_reason or QUEUED
+        except Exception as e:
+            logging.error(f"下载 {row['platform']}/{row['kind']} ({item_id}) 失败: {e}", exc_info=True)
+            error = str(e)
+        with self._wakeup:
+            self._running.pop(item_id, None)
+            self._workers.pop(item_id, None)
+            fields = {"status": status, "error": error}
+            if result is not None:
+                fields["result"] = json.dumps(result, ensure_ascii=False, default=str)
+            if item_id in self._progress:
+                fields["progress"] = json.dumps(self._progress.pop(item_id), ensure_ascii=False)
+            self._update(item_id, **fields)
+            self._wakeup.notify()
+
+    def _set_progress(self, item_id, progress, flush):
+        with self._lock:
+            merged = {**self._progress.get(item_id, {}), **progress}
+            self._progress[item_id] = merged
+            if flush:
+                self._update(item_id, progress=json.dumps(merged, ensure_ascii=False))
+
+    # ---- 数据库 ----
+
+    def _get_row(self, item_id):
+        row = self._db.execute("SELECT * FROM downloads WHERE id = ?", (item_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"未知的下载条目: {item_id}")
+        return row
+
+    def _update(self, item_id, **fields):
+        """更新条目（调用方持有锁）"""
+        if self._closed:
+            return
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._db.execute(f"UPDATE downloads SET {assignments} WHERE id = ?", (*fields.values(), item_id))
+        self._db.commit()
+
+    def _to_dict(self, row):
+        progress = self._progress.get(row['id'])
+        if progress is None and row['progress']:
+            progress = json.loads(row['progress'])
+        return {
+            "download_id": row['id'],
+            "platform": row['platform'],
+            "kind": row['kind'],
+            "params": json.loads(row['params']),
+            "title": row['title'],
+            "priority": row['priority'],
+            "status": row['status'],
+            "done": row['status'] in FINISHED_STATES,
+            "progress": progress or {},
+            "result": json.loads(row['result']) if row['result'] else None,
+            "error": row['error'],
+            "attempts": row['attempts'],
+            "created_at": row['created_at'],
+            "updated_at": row['updated_at'],
+        }
+
+    def shutdown(self, timeout=5):
+        """中止正在进行的下载（下次启动时重新排队）并停止调度"""
+        with self._wakeup:
+            self._stopped = True
+            for control in self._running.values():
+                control.stop_reason = control.stop_reason or QUEUED
+            self._wakeup.notify()
+            workers = list(self._workers.values())
+        # 等待调度线程和各下载线程写回最终状态后再关闭数据库；
+        # 超时仍未退出的处理函数之后的更新被忽略，条目保持 RUNNING，下次启动时重新排队
+        deadline = time.time() + timeout
+        for thread in [self._dispatcher, *workers]:
+            thread.join(max(0.0, deadline - time.time()))
+        with self._lock:
+            self._closed = True
+            self._db.close()
@@ -3,42 +3,205 @@ from pydub.playback import play
 import librosa
 import numpy as np
 import os 
+import sys
+import subprocess
 import logging
+import threading
+from configs import config_manager
+from utils import find_ffmpeg
+from waveform_peaks import PeakPyramid, stream_peak_pyramid
 # logging.basicConfig(level=logging.DEBUG, 
 #                     format='%(asctime)s - %(levelname)s - %(message)s',
 #                     handlers=[logging.StreamHandler()])
+
+# 历史记录默认字节预算（不含当前音频本身引用的缓冲区）
+DEFAULT_HISTORY_BUDGET_BYTES = 256 * 1024 * 1024
+# 每个片段描述 (source, start_ms, end_ms) 的估算开销
+_PIECE_COST_BYTES = 64
+
+
+def _raw_slice(source, start_ms, end_ms):
+    """返回 source 在 [start_ms, end_ms) 范围内原始 PCM 数据的 memoryview（不复制）"""
+    frame_width = source.frame_width
+    start = int(start_ms * source.frame_rate / 1000.0) * frame_width
+    end = int(end_ms * source.frame_rate / 1000.0) * frame_width
+    return memoryview(source.raw_data)[start:end]
+
+
+def _same_format(a, b):
+    return (a.frame_rate, a.channels, a.sample_width) == (b.frame_rate, b.channels, b.sample_width)
+
+
+def slice_pieces(pieces, start_ms, end_ms):
+    """
+    截取片段表中时间轴 [start_ms, end_ms) 对应的部分
+    :param pieces: 片段列表 [(source, src_start_ms, src_end_ms), ...]
+    :return: 新的片段列表（只引用原缓冲区，不复制音频数据）
+    """
+    result = []
+    offset = 0
+    for source, src_start, src_end in pieces:
+        length = src_end - src_start
+        piece_start = max(start_ms, offset)
+        piece_end = min(end_ms, offset + length)
+        if piece_start < piece_end:
+            result.append((source,
+                           src_start + piece_start - offset,
+                           src_start + piece_end - offset))
+        offset += length
+        if offset >= end_ms:
+            break
+    return result
+
+
+def merge_intervals(intervals):
+    """排序并合并重叠或相邻的区间 [(start, end), ...]，忽略空区间"""
+    merged = []
+    for start, end in sorted(i for i in intervals if i[1] > i[0]):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def compute_keep_spans(duration_ms, deleted_ranges_ms):
+    """
+    由删除区域计算需要保留的区间（删除区域并集在 [0, duration_ms) 内的补集）
+    :param duration_ms: 音频总时长（毫秒）
+    :param deleted_ranges_ms: 删除区域列表 [(start_ms, end_ms), ...]，可无序、可重叠
+    :return: 有序且互不重叠的保留区间列表
+    """
+    keep = []
+    cursor = 0
+    for start, end in merge_intervals(deleted_ranges_ms):
+        start, end = max(start, 0), min(end, duration_ms)
+        if start > cursor:
+            keep.append((cursor, start))
+        cursor = max(cursor, end)
+    if cursor < duration_ms:
+        keep.append((cursor, duration_ms))
+    return keep
+
+
+def select_pieces(pieces, ranges_ms):
+    """
+    单次遍历从片段表中取出多个有序、互不重叠的时间区间
+    相邻且在源缓冲区中连续的片段会被合并
+    """
+    result = []
+    offsets = []
+    offset = 0
+    for _, src_start, src_end in pieces:
+        offsets.append(offset)
+        offset += src_end - src_start
+
+    i = 0
+    for start_ms, end_ms in ranges_ms:
+        # 区间有序，片段指针只前进不回退
+        while i < len(pieces) and offsets[i] + pieces[i][2] - pieces[i][1] <= start_ms:
+            i += 1
+        j = i
+        while j < len(pieces) and offsets[j] < end_ms:
+            source, src_start, src_end = pieces[j]
+            piece_start = max(start_ms, offsets[j])
+            piece_end = min(end_ms, offsets[j] + src_end - src_start)
+            if piece_start < piece_end:
+                new_start = src_start + piece_start - offsets[j]
+                new_end = src_start + piece_end - offsets[j]
+                if result and result[-1][0] is source and result[-1][2] == new_start:
+                    result[-1] = (source, result[-1][1], new_end)
+                else:
+                    result.append((source, new_start, new_end))
+            j += 1
+    return result
+
+
+def pieces_duration_ms(pieces):
+    return sum(src_end - src_start for _, src_start, src_end in pieces)
+
+
+def render_pieces(pieces):
+    """
+    将片段表一次性拼接为 AudioSegment
+    格式一致时直接拼接原始字节，只复制一次；格式不一致时交给 pydub 同步格式
+    """
+    if not pieces:
+        return AudioSegment.empty()
+    reference = pieces[0][0]
+    if all(_same_format(source, reference) for source, _, _ in pieces):
+        data = b''.join(_raw_slice(source, start, end) for source, start, end in pieces)
+        return reference._spawn(data)
+    audio = AudioSegment.empty()
+    for source, start, end in pieces:
+        audio += source[start:end]
+    return audio
+
+
 class AudioProcessor:
-    def __init__(self, input_path=None):
+    def __init__(self, input_path=None, history_budget_bytes=None, peak_cache=None):
         """
         初始化音频处理器
         :param input_path: 可选，可直接加载音频文件路径
+        :param history_budget_bytes: 可选，撤销历史的字节预算，默认读取配置 historyBudgetBytes
+        :param peak_cache: 可选，波形峰值金字塔的磁盘缓存 (waveform_peaks.PeakCache)
         """
         self.audio = AudioSegment.empty()  # 初始化为空音频
         self.original_info = {}
-        self.history = []  # 存储音频操作历史
+        # 历史记录只保存片段表 [(source, start_ms, end_ms), ...]，
+        # source 是加载时得到的不可变 AudioSegment，各步骤共享同一缓冲区
+        self.history = []
         self.history_index = -1
-        self.clipboard = None # 剪贴板
+        self.pieces = []  # 当前音频对应的片段表
+        self.clipboard = None # 剪贴板（同样是片段表）
+        if history_budget_bytes is None:
+            history_budget_bytes = config_manager.get('historyBudgetBytes', DEFAULT_HISTORY_BUDGET_BYTES)
+        self.history_budget_bytes = history_budget_bytes
+        self.peak_cache = peak_cache
+        # 后台流式生成波形的状态: 绝对路径 -> {'builder', 'pyramid', 'error', 'done'}
+        self._waveform_streams = {}
+        self._waveform_lock = threading.Lock()
 
         if input_path:
             self.load_from_file(input_path)
 
+    def _history_bytes(self):
+        """估算历史记录额外占用的内存：片段描述开销 + 当前音频和剪贴板不再引用的源缓冲区"""
+        live = {id(source) for source, _, _ in self.pieces + (self.clipboard or [])}
+        retained = {}
+        cost = 0
+        for pieces in self.history:
+            cost += len(pieces) * _PIECE_COST_BYTES
+            for source, _, _ in pieces:
+                if id(source) not in live:
+                    retained[id(source)] = len(source.raw_data)
+        return cost + sum(retained.values())
+
     def _add_to_history(self):
-        """将当前音频状态添加到历史记录"""
-        if self.audio:
-            # 如果当前不是最新状态，则截断历史
-            if self.history_index < len(self.history) - 1:
-                self.history = self.history[:self.history_index + 1]
-            self.history.append(self.audio[:]) # 存储深拷贝
-            self.history_index = len(self.history) - 1
-            # 限制历史记录大小，例如10步
-            if len(self.history) > 10:
-                self.history.pop(0)
-                self.history_index -= 1
+        """将当前片段表添加到历史记录（删除全部内容后的空片段表也是有效状态）"""
+        # 如果当前不是最新状态，则截断历史
+        if self.history_index < len(self.history) - 1:
+            self.history = self.history[:self.history_index + 1]
+        self.history.append(list(self.pieces))
+        self.history_index = len(self.history) - 1
+        # 超出字节预算时丢弃最早的记录，至少保留当前状态
+        while self.history_index > 0 and self._history_bytes() > self.history_budget_bytes:
+            self.history.pop(0)
+            self.history_index -= 1
+
+    def _apply_pieces(self, pieces):
+        """以新的片段表作为当前状态，重建音频并记录历史"""
+        self.pieces = pieces
+        self.audio = render_pieces(pieces)
+        self._update_original_info()
+        self._add_to_history()
 
     def _restore_from_history(self):
         """从历史记录恢复音频状态"""
         if 0 <= self.history_index < len(self.history):
-            self.audio = self.history[self.history_index][:]
+            self.pieces = list(self.history[self.history_index])
+            self.audio = render_pieces(self.pieces)
             self._update_original_info()
             return True
         return False
@@ -63,9 +226,8 @@ class AudioProcessor:
         :param input_path: 音频文件路径
         """
         try:
-            self.audio = AudioSegment.from_file(input_path)
-            self._update_original_info()
-            self._add_to_history() # 加载时也加入历史
+            source = AudioSegment.from_file(input_path)
+            self._apply_pieces([(source, 0, len(source))]) # 加载时也加入历史
             print(f"已加载音频成功: {input_path} | 时长: {self.original_info['duration']}秒 | 采样率: {self.original_info['frame_rate']}Hz")
             return self
         except Exception as e:
@@ -116,11 +278,10 @@ class AudioProcessor:
         if split_time_ms < 0 or split_time_ms > len(self.audio):
             raise ValueError("分割时间点超出音频范围")
 
-        part1 = self.audio[:split_time_ms]
         part2 = self.audio[split_time_ms:]
-        self.audio = part1 # For split, we keep the first part as current audio
-        self._update_original_info()
-        self._add_to_history()
+        # For split, we keep the first part as current audio
+        self._apply_pieces(slice_pieces(self.pieces, 0, split_time_ms))
+        part1 = self.audio
         print(f"音频已在 {split_time_sec} 秒处分割")
         return part1, part2 # Return both parts, but only part1 is current
 
@@ -133,7 +294,7 @@ class AudioProcessor:
         self._check_loaded()
         start_ms = int(start_sec * 1000)
         end_ms = int(end_sec * 1000)
-        self.clipboard = self.audio[start_ms:end_ms][:]
+        self.clipboard = slice_pieces(self.pieces, start_ms, end_ms)
         print(f"已复制选区: {start_sec}-{end_sec}秒")
         return self
 
@@ -148,17 +309,30 @@ class AudioProcessor:
 
         target_ms = int(target_sec * 1000)
         
-        # 分割当前音频
-        before = self.audio[:target_ms]
-        after = self.audio[target_ms:]
-        
-        # 拼接音频
-        self.audio = before + self.clipboard + after
-        self._update_original_info()
-        self._add_to_history()
+        # 分割当前片段表并插入剪贴板片段
+        before = slice_pieces(self.pieces, 0, target_ms)
+        after = slice_pieces(self.pieces, target_ms, pieces_duration_ms(self.pieces))
+        self._apply_pieces(before + self.clipboard + after)
         print(f"已粘贴音频到: {target_sec}秒")
         return self
 
+    def keep_ranges(self, ranges_ms):
+        """
+        只保留指定的时间区间并按顺序拼接（用于删除区域后导出）
+        :param ranges_ms: 有序且互不重叠的保留区间列表 [(start_ms, end_ms), ...]
+        """
+        self._check_loaded()
+        self._apply_pieces(select_pieces(self.pieces, ranges_ms))
+        return self
+
+    def remove_ranges(self, deleted_ranges_ms):
+        """
+        删除指定的时间区间，区间会先排序合并，再一次性拼接剩余部分
+        :param deleted_ranges_ms: 删除区域列表 [(start_ms, end_ms), ...]
+        """
+        self._check_loaded()
+        return self.keep_ranges(compute_keep_spans(len(self.audio), deleted_ranges_ms))
+
     def open_file_explorer(self, path):
         """打开文件资源管理器到指定路径"""
         # 确保路径存在
@@ -175,11 +349,14 @@ class AudioProcessor:
                 subprocess.run(['xdg-open', path])
         else:
             print(f"无法在您的系统上打开文件资源管理器: {sys.platform}")
-    def export(self, output_path, format="mp3", bitrate="192k"):
+    def export(self, output_path, format="mp3", bitrate="192k", audio=None):
         """
         导出音频文件并在导出后打开所在文件夹
+        :param audio: 可选，导出指定的 AudioSegment 快照（默认为当前音频），供后台导出使用
         """
         self._check_loaded()
+        if audio is None:
+            audio = self.audio
         
         # 确保输出目录存在
         output_dir = os.path.dirname(output_path)
@@ -188,7 +365,7 @@ class AudioProcessor:
         
         # 导出音频文件
         # pydub export handles format and bitrate
-        self.audio.export(output_path, format=format, bitrate=bitrate)
+        audio.export(output_path, format=format, bitrate=bitrate)
         print(f"文件已导出至: {output_path} (格式: {format}, 比特率: {bitrate})")
         
         # 打开文件所在目录
@@ -199,7 +376,11 @@ class AudioProcessor:
             # In that case, use the current working directory.
             if not export_dir:
                 export_dir = "."
-            self.open_file_explorer(export_dir)
+            # 文件已写入，打不开资源管理器不应让导出失败
+            try:
+                self.open_file_explorer(export_dir)
+            except Exception as e:
+                logging.warning(f"无法打开导出目录 {export_dir}: {e}")
         else:
             print("警告: 文件导出成功但无法定位")
         
@@ -225,66 +406,77 @@ class AudioProcessor:
         }
 
     # 添加可视化支持
-    def generate_waveform(self, audio_path, width=800):
+    def _build_peak_pyramid(self, audio_path, on_progress=None):
         """
-        使用 pydub 加载音频，然后使用 librosa 生成波形数据。
+        构建峰值金字塔。ffmpeg 可用时通过管道流式解码，内存占用与文件长度无关；
+        否则回退到 pydub 整体加载。
+        :param on_progress: 可选回调，流式解码时每处理完一个块以 PeakBuilder 调用
+        """
+        if find_ffmpeg():
+            logging.info(f"开始生成波形，使用ffmpeg管道流式解码: {audio_path}")
+            return stream_peak_pyramid(audio_path, on_progress=on_progress)
+        return self._build_peak_pyramid_with_pydub(audio_path)
+
+    def _build_peak_pyramid_with_pydub(self, audio_path):
+        """
+        使用 pydub 加载音频，转换为标准化单声道样本后一次性构建峰值金字塔。
         这个方法在打包后的无控制台环境下更健壮。
+        """
+        logging.info(f"开始生成波形，使用pydub加载: {audio_path}")
+
+        # 步骤 1: 使用我们已经配置好的 pydub 来加载文件，这会正确处理 ffmpeg
+        audio_segment = AudioSegment.from_file_using_temporary_files(audio_path)
+
+        # 获取采样率和通道数
+        sr = audio_segment.frame_rate
+        channels = audio_segment.channels
+
+        logging.debug(f"Pydub加载成功. 采样率: {sr}, 通道数: {channels}")
+
+        # 步骤 2: 从 pydub 获取原始样本数据，并转换为 numpy 数组
+        y = np.array(audio_segment.get_array_of_samples()).astype(np.float32)
+
+        # 步骤 3: 如果是多声道，转换为单声道
+        if channels > 1:
+            # pydub 的样本是交错的 [L, R, L, R, ...]
+            y = y.reshape((-1, channels)).mean(axis=1)
+
+        # 步骤 4: 标准化样本数据到 [-1.0, 1.0] 范围
+        # audio_segment.sample_width 是字节数 (1, 2, 4) -> 对应 8, 16, 32 bit
+        max_val = 2**(audio_segment.sample_width * 8 - 1)
+        y /= max_val
+
+        logging.debug(f"已将样本转换为标准化的单声道 numpy 数组. 样本数: {len(y)}")
+
+        # 步骤 5: 单次向量化计算 min/max/RMS 峰值金字塔
+        return PeakPyramid.from_samples(y, sr)
+
+    def generate_waveform(self, audio_path, width=800, start_ms=None, end_ms=None):
+        """
+        生成波形数据。峰值金字塔按文件哈希和修改时间缓存在磁盘上，
+        任意宽度或可见时间范围的请求都不需要重新解码音频。
 
         :param audio_path: 音频文件路径
         :param width: 波形图宽度（像素点数）
+        :param start_ms: 可选，可见区域起点（毫秒）
+        :param end_ms: 可选，可见区域终点（毫秒）
         :return: 包含波形数据和时长的字典
         """
         try:
-            logging.info(f"开始生成波形，使用pydub加载: {audio_path}")
-            
-            # 步骤 1: 使用我们已经配置好的 pydub 来加载文件，这会正确处理 ffmpeg
-            audio_segment = AudioSegment.from_file_using_temporary_files(audio_path)
-            
-            # 获取采样率和通道数
-            sr = audio_segment.frame_rate
-            channels = audio_segment.channels
-            
-            logging.debug(f"Pydub加载成功. 采样率: {sr}, 通道数: {channels}")
-
-            # 步骤 2: 从 pydub 获取原始样本数据，并转换为 numpy 数组
-            # get_array_of_samples() 返回一个 array.array 对象
-            samples_array = audio_segment.get_array_of_samples()
-            
-            # 将其转换为 numpy 数组
-            y = np.array(samples_array).astype(np.float32)
-
-            # 步骤 3: 如果是立体声，转换为单声道
-            if channels == 2:
-                # pydub 的样本是交错的 [L, R, L, R, ...]
-                # 我们需要将其重塑为 (n_samples, 2) 然后取平均
-                y = y.reshape((-1, 2)).mean(axis=1)
-
-            # 步骤 4: 标准化样本数据到 [-1.0, 1.0] 范围，这是 librosa 的标准输入格式
-            # audio_segment.sample_width 是字节数 (1, 2, 4) -> 对应 8, 16, 32 bit
-            # 2**(bits - 1) 是有符号整数的最大值
-            max_val = 2**(audio_segment.sample_width * 8 - 1)
-            y /= max_val
-            
-            logging.debug(f"已将样本转换为标准化的单声道 numpy 数组. 样本数: {len(y)}")
-
-            # 步骤 5: 使用 librosa 进行后续处理（主要是下采样以匹配宽度）
-            # 注意：此时的 y 已经是 librosa 喜欢的格式了，无需再次 normalize
-            step = max(1, len(y) // width)
-            waveform_data = []
-            for i in range(0, len(y), step):
-                chunk = y[i:i+step]
-                if len(chunk) > 0:
-                    waveform_data.append(float(np.mean(np.abs(chunk))))
-                else:
-                    waveform_data.append(0.0)
+            if self.peak_cache:
+                pyramid = self.peak_cache.get_or_build(audio_path, self._build_peak_pyramid)
+            else:
+                pyramid = self._build_peak_pyramid(audio_path)
+
+            peaks = pyramid.query(width, start_ms, end_ms)
+            duration = pyramid.duration
 
-            # 计算时长
-            duration = audio_segment.duration_seconds
+            logging.info(f"成功生成波形数据: {len(peaks['rms'])} 点, 时长: {duration} 秒")
 
-            logging.info(f"成功生成波形数据: {len(waveform_data)} 点, 时长: {duration} 秒")
-            
             return {
-                "waveform": waveform_data,
+                "waveform": peaks["rms"],
+                "min": peaks["min"],
+                "max": peaks["max"],
                 "duration": float(duration)
             }
         except Exception as e:
@@ -295,6 +487,85 @@ class AudioProcessor:
                 "error": f"加载音频元数据失败: {e}" # 返回更具体的错误信息
             }
 
+    def start_waveform_stream(self, audio_path):
+        """
+        在后台线程中流式生成波形，生成过程中可通过 poll_waveform 获取部分结果
+        :param audio_path: 音频文件路径
+        """
+        key = os.path.abspath(audio_path)
+        with self._waveform_lock:
+            state = self._waveform_streams.get(key)
+            if state and not state['done']:
+                return state
+            state = {'builder': None, 'pyramid': None, 'error': None, 'done': False}
+            self._waveform_streams[key] = state
+
+        # state 的各字段只在 _waveform_lock 下读写，poll_waveform 取到的是一致的快照
+        def on_progress(builder):
+            with self._waveform_lock:
+                state['builder'] = builder
+
+        def build(path):
+            return self._build_peak_pyramid(path, on_progress=on_progress)
+
+        def run():
+            pyramid, error = None, None
+            try:
+                if self.peak_cache:
+                    pyramid = self.peak_cache.get_or_build(audio_path, build)
+                else:
+                    pyramid = build(audio_path)
+            except Exception as e:
+                logging.error(f"流式生成波形失败: {e}", exc_info=True)
+                error = str(e)
+            finally:
+                with self._waveform_lock:
+                    state['pyramid'] = pyramid
+                    state['error'] = error
+                    state['done'] = True
+
+        threading.Thread(target=run, daemon=True).start()
+        return state
+
+    def poll_waveform(self, audio_path, width=800, duration=None, start_ms=None, end_ms=None):
+        """
+        获取流式波形的当前结果
+        :param duration: 可选，音频总时长（秒）。提供时部分结果的点数按已解码比例缩放，
+                         便于界面从左到右逐步绘制
+        :return: 与 generate_waveform 相同的字典，另含 done 标志
+        """
+        key = os.path.abspath(audio_path)
+        with self._waveform_lock:
+            state = self._waveform_streams.get(key)
+            if state is None:
+                return {"waveform": [], "duration": 0.0, "done": True, "error": "波形生成尚未开始"}
+            state = dict(state)
+            if state['done']:
+                self._waveform_streams.pop(key, None)
+        if state['error']:
+            return {"waveform": [], "duration": 0.0, "done": True, "error": state['error']}
+
+        if state['done']:
+            pyramid = state['pyramid']
+            points = width
+        else:
+            builder = state['builder']
+            if builder is None:
+                return {"waveform": [], "min": [], "max": [], "duration": 0.0, "done": False}
+            pyramid = builder.snapshot()
+            points = width
+            if duration:
+                points = max(1, int(width * min(1.0, pyramid.duration / duration)))
+
+        peaks = pyramid.query(points, start_ms, end_ms)
+        return {
+            "waveform": peaks["rms"],
+            "min": peaks["min"],
+            "max": peaks["max"],
+            "duration": float(pyramid.duration),
+            "done": state['done']
+        }
+
     def get_current_info(self):
         """
         获取当前音频信息
@@ -0,0 +1,94 @@
+# file_registry.py
+import ctypes
+import ctypes.util
+import hashlib
+import hmac
+import os
+import secrets
+import shutil
+import sys
+import threading
+from collections import OrderedDict
+
+# 最多保留的登记文件数，超过时淘汰最久未使用的令牌
+DEFAULT_MAX_ENTRIES = 1000
+# Linux 的 FICLONE ioctl（btrfs、XFS 等支持写时复制的文件系统）
+_FICLONE = 0x40049409
+
+
+class FileRegistry:
+    """
+    本地文件登记表：把绝对路径映射为不透明的令牌，Flask 路由按令牌直接读取原文件，
+    不再把文件复制到 uploads。令牌是以进程内随机密钥计算的 HMAC，同一路径得到同一令牌，
+    无法由路径推算；只有登记过的文件可以被访问
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max(1, int(max_entries))
+        self._secret = secrets.token_bytes(16)
+        self._paths = OrderedDict()  # token -> 绝对路径
+        self._lock = threading.Lock()
+
+    def register(self, path):
+        """登记文件并返回令牌，文件不存在时抛出 FileNotFoundError"""
+        abs_path = os.path.normpath(os.path.abspath(path))
+        if not os.path.isfile(abs_path):
+            raise FileNotFoundError(f"文件不存在: {path}")
+        token = hmac.new(self._secret, os.path.normcase(abs_path).encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+        with self._lock:
+            self._paths[token] = abs_path
+            self._paths.move_to_end(token)
+            while len(self._paths) > self.max_entries:
+                self._paths.popitem(last=False)
+        return token
+
+    def resolve(self, token):
+        """返回令牌对应的文件路径；未登记或文件已被删除时返回 None"""
+        with self._lock:
+            path = self._paths.get(token)
+            if path is not None:
+                self._paths.move_to_end(token)
+        if path is None or not os.path.isfile(path):
+            return None
+        return path
+
+    def unregister(self, token):
+        with self._lock:
+            self._paths.pop(token, None)
+
+
+def _reflink(source, target):
+    """尝试创建写时复制的克隆（不复制数据块），不支持时返回 False"""
+    if sys.platform.startswith('linux'):
+        import fcntl
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            try:
+                os.remove(target)
+            except OSError:
+                pass
+            return False
+    if sys.platform == 'darwin':
+        libc_path = ctypes.util.find_library('c')
+        clonefile = getattr(ctypes.CDLL(libc_path, use_errno=True), 'clonefile', None) if libc_path else None
+        if clonefile is None:
+            return False
+        return clonefile(os.fsencode(source), os.fsencode(target), 0) == 0
+    return False
+
+
+def clone_file(source, target):
+    """
+    复制文件内容：文件系统支持时创建写时复制的克隆（APFS / btrfs / XFS，瞬间完成且不额外占用空间），
+    否则普通复制。不使用硬链接，因为目标文件可能被用户就地修改，硬链接会让修改同时出现在源文件中
+    :return: 'reflink' 或 'copy'
+    """
+    if os.path.exists(target):
+        os.remove(target)
+    if _reflink(source, target):
+        return 'reflink'
+    shutil.copyfile(source, target)
+    return 'copy'
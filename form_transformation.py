@@ -1,7 +1,12 @@
 import os
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from utils import get_ffmpeg_path, get_ffprobe_path
 from configs import config_manager
+from file_registry import clone_file
+from media_remux import remux, probe, media_streams, can_copy, container_of, MUXERS, DEFAULT_AUDIO_BITRATE
 
 # --- 全局标志，防止重复初始化 ---
 _FFMPEG_INITIALIZED = False
@@ -55,80 +60,282 @@ def initialize_ffmpeg():
 initialize_ffmpeg()
 
 
-from moviepy import VideoFileClip
-from pydub import AudioSegment
+# 可转换的输入扩展名，以及作为纯音频输出的格式
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov', '.flv', '.webm', '.m4v')
+AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg', '.m4a', '.flac', '.opus', '.aac', '.wma')
+AUDIO_OUTPUT_FORMATS = ('mp3', 'wav', 'ogg', 'm4a', 'flac', 'opus')
+# 批量转换默认同时运行的 ffmpeg 进程数（可通过配置 conversionWorkers 修改）
+DEFAULT_CONVERSION_WORKERS = max(1, min(4, os.cpu_count() or 1))
 
+# 转换直接调用 ffmpeg：整个任务是一条命令，编码允许时流复制，提取音频时不解码视频，
+# 数据不经过 Python，内存占用与文件长度无关。失败时抛出异常
 
-# 你的功能函数保持不变，无需修改
-def extract_audio_from_video(video_path: str, output_audio_path: str):
+
+def _require_input(path, kind):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{kind} file not found at '{path}'")
+
+
+def _report(label, result):
+    modes = ", ".join(f"{stream['codec_type']}={stream['codec_name']}:{stream['mode']}" for stream in result['streams'])
+    print(f"SUCCESS: {label} -> {result['path']} ({modes})")
+    return result
+
+
+def extract_audio_from_video(video_path: str, output_audio_path: str, audio_bitrate: str = DEFAULT_AUDIO_BITRATE):
     """
-    功能 1: 从视频文件中提取音频。
+    功能 1: 从视频文件中提取音频（-vn，不解码视频；音频编码与目标格式兼容时直接复制）。
+    :return: {'path', 'streams'}
     """
-    if not os.path.exists(video_path):
-        print(f"ERROR: Video file not found at '{video_path}'")
-        return
-    
-    video_clip = None
-    audio_clip = None
+    _require_input(video_path, 'Video')
+    print(f"\n[Extracting Audio] {video_path} -> {output_audio_path}...")
+    result = remux([video_path], output_audio_path, stream_types=('audio',), audio_bitrate=audio_bitrate)
+    return _report("Audio extracted", result)
+
+
+def convert_audio_format(input_audio_path: str, output_audio_path: str, audio_bitrate: str = DEFAULT_AUDIO_BITRATE):
+    """
+    功能 2: 转换音频文件的格式（流式转码，不把整个文件读入内存）。
+    :return: {'path', 'streams'}
+    """
+    _require_input(input_audio_path, 'Audio')
+    print(f"\n[Converting Audio] {input_audio_path} -> {output_audio_path}...")
+    result = remux([input_audio_path], output_audio_path, stream_types=('audio',), audio_bitrate=audio_bitrate)
+    return _report("Audio format converted", result)
+
+
+def convert_video_format(input_video_path: str, output_video_path: str, audio_bitrate: str = DEFAULT_AUDIO_BITRATE):
+    """
+    功能 3: 转换视频文件的格式（目标容器支持原编码时只换封装，不重新编码）。
+    :return: {'path', 'streams'}
+    """
+    _require_input(input_video_path, 'Video')
+    print(f"\n[Converting Video] {input_video_path} -> {output_video_path}...")
+    result = remux([input_video_path], output_video_path, stream_types=('video', 'audio'), audio_bitrate=audio_bitrate)
+    return _report("Video format converted", result)
+
+def plan_conversion(input_path: str, output_path: str):
+    """
+    根据探测到的流（而不是扩展名）选择转换方式：
+      copy       输入与输出容器相同且流无需改动，直接复制文件，不运行 ffmpeg
+      remux      所有流都可复制，只换封装
+      audio_copy 只取音频流且音频可直接复制（例如 MP4 中的 AAC 提取为 M4A）
+      transcode  至少一路流需要重新编码
+    输出为音频格式时只取音频流（视频输入即为提取音频），否则保留视频和音频
+    :return: {'action', 'stream_types', 'streams': [{'codec_type', 'codec_name', 'mode'}], 'duration',
+              'is_video', 'media'}；不支持的转换抛出 ValueError
+    """
+    container = container_of(output_path)
+    if container not in MUXERS:
+        raise ValueError(f"不支持的输出格式: {container}")
+    info = probe(input_path)
+    is_video = bool(media_streams(info, 'video'))
+    is_audio_output = container in AUDIO_OUTPUT_FORMATS
+    if not is_video and not is_audio_output:
+        raise ValueError(f"不支持的转换类型: {os.path.basename(input_path)} 不包含视频流，不能转换为 {container}")
+    stream_types = ('audio',) if is_audio_output else ('video', 'audio')
+
+    streams = []
+    for codec_type in stream_types:
+        selected = media_streams(info, codec_type)
+        if selected:
+            # 与 build_command 一致：每类流只取第一路
+            stream = selected[0]
+            mode = 'copy' if can_copy(container, codec_type, stream['codec_name']) else 'encode'
+            streams.append({"codec_type": codec_type, "codec_name": stream['codec_name'], "mode": mode})
+    if not streams:
+        raise ValueError(f"{os.path.basename(input_path)} 中没有可用的{'音频' if is_audio_output else ''}流")
+
+    if any(stream['mode'] == 'encode' for stream in streams):
+        action = 'transcode'
+    elif container_of(input_path) == container and len(streams) == len(info['streams']):
+        action = 'copy'
+    elif is_audio_output:
+        action = 'audio_copy'
+    else:
+        action = 'remux'
+    return {
+        "action": action,
+        "stream_types": stream_types,
+        "streams": streams,
+        "duration": info['duration'],
+        "is_video": is_video,
+        "media": info,
+    }
+
+
+def _copy_file(input_path, output_path):
+    """输出与输入格式相同时直接复制文件（支持时为写时复制的克隆；先写入临时文件，成功后再重命名）"""
+    temp_path = output_path + '.part'
     try:
-        print(f"\n[Extracting Audio] Loading video: {video_path}...")
-        video_clip = VideoFileClip(video_path)
-        audio_clip = video_clip.audio
-        
-        print(f"[Extracting Audio] Writing audio to: {output_audio_path}...")
-        audio_clip.write_audiofile(output_audio_path, logger=None)
-        
-        print("SUCCESS: Audio extracted successfully!")
-    except Exception as e:
-        print(f"ERROR: Audio extraction failed: {e}")
+        clone_file(input_path, temp_path)
+        os.replace(temp_path, output_path)
     finally:
-        if audio_clip:
-            audio_clip.close()
-        if video_clip:
-            video_clip.close()
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 
-def convert_audio_format(input_audio_path: str, output_audio_path: str):
+def convert_file(input_path: str, output_path: str, audio_bitrate: str = DEFAULT_AUDIO_BITRATE, threads: int = 0,
+                 on_progress=None, should_stop=None, plan=None):
     """
-    功能 2: 转换音频文件的格式。
+    按 plan_conversion 的结果转换：copy 直接复制文件，其余为一条 ffmpeg 命令（remux / audio_copy 不重新编码）。
+    on_progress / should_stop 见 media_remux.run_ffmpeg
+    :param plan: 可选，调用方已经得到的 plan_conversion 结果
+    :return: {'path', 'streams', 'duration', 'action'}
     """
-    if not os.path.exists(input_audio_path):
-        print(f"ERROR: Audio file not found at '{input_audio_path}'")
-        return
-    
-    try:
-        print(f"\n[Converting Audio] Loading audio: {input_audio_path}...")
-        audio = AudioSegment.from_file(input_audio_path)
-        
-        output_format = os.path.splitext(output_audio_path)[1][1:].lower()
-        print(f"[Converting Audio] Exporting as '{output_format}' to: {output_audio_path}...")
-        
-        audio.export(output_audio_path, format=output_format, bitrate="192k")
-        print("SUCCESS: Audio format converted successfully!")
-    except Exception as e:
-        print(f"ERROR: Audio conversion failed: {e}")
+    _require_input(input_path, 'Input')
+    plan = plan or plan_conversion(input_path, output_path)
+    if plan['action'] == 'copy':
+        _copy_file(input_path, output_path)
+        result = {"path": output_path, "streams": plan['streams'], "duration": plan['duration']}
+    else:
+        result = remux([input_path], output_path, stream_types=plan['stream_types'], audio_bitrate=audio_bitrate,
+                       threads=threads, on_progress=on_progress, should_stop=should_stop)
+    result["action"] = plan['action']
+    return result
+
 
-def convert_video_format(input_video_path: str, output_video_path: str):
+def collect_inputs(sources):
     """
-    功能 3: 转换视频文件的格式。
+    展开文件和目录（递归）为可转换的输入文件列表
+    :return: [(输入文件, 相对于所在来源目录的子目录)]
     """
-    if not os.path.exists(input_video_path):
-        print(f"ERROR: Video file not found at '{input_video_path}'")
-        return
-        
-    video_clip = None
+    if isinstance(sources, str):
+        sources = [sources]
+    inputs = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, names in os.walk(source):
+                dirs.sort()
+                for name in sorted(names):
+                    if name.lower().endswith(VIDEO_EXTENSIONS + AUDIO_EXTENSIONS):
+                        inputs.append((os.path.join(root, name), os.path.relpath(root, source)))
+        elif os.path.isfile(source):
+            inputs.append((source, '.'))
+    return inputs
+
+
+def is_up_to_date(input_path, output_path):
+    """输出文件存在、非空且不早于输入文件时视为已是最新"""
     try:
-        print(f"\n[Converting Video] Loading video: {input_video_path}...")
-        video_clip = VideoFileClip(input_video_path)
-        
-        print(f"[Converting Video] Exporting to: {output_video_path}...")
-        video_clip.write_videofile(output_video_path, codec='libx264', audio_codec='aac', logger=None)
-        
-        print("SUCCESS: Video format converted successfully!")
-    except Exception as e:
-        print(f"ERROR: Video conversion failed: {e}")
-    finally:
-        if video_clip:
-            video_clip.close()
+        output_stat = os.stat(output_path)
+    except FileNotFoundError:
+        return False
+    return output_stat.st_size > 0 and output_stat.st_mtime >= os.stat(input_path).st_mtime
+
+
+class BatchConversion:
+    """
+    批量格式转换：每个文件一条 ffmpeg 命令，最多 workers 个 ffmpeg 进程同时运行
+    （每个进程的编码线程数按 CPU 核数均分）。输出已是最新的文件跳过。
+    汇总进度包括每个文件的百分比和整体吞吐量（文件/秒、MB/秒，按输入大小计）
+    """
+
+    def __init__(self, sources, output_dir, output_format, workers=None, audio_bitrate=DEFAULT_AUDIO_BITRATE,
+                 suffix='_converted', on_progress=None, should_stop=None):
+        self.output_dir = output_dir
+        self.output_format = output_format.lower().lstrip('.')
+        self.workers = max(1, int(workers or config_manager.get('conversionWorkers', DEFAULT_CONVERSION_WORKERS)))
+        self.audio_bitrate = audio_bitrate
+        self.suffix = suffix
+        self.on_progress = on_progress
+        self.should_stop = should_stop
+        self.files = []
+        for input_path, relative_dir in collect_inputs(sources):
+            base_name = os.path.splitext(os.path.basename(input_path))[0]
+            output_path = os.path.normpath(os.path.join(
+                output_dir, relative_dir, f"{base_name}{suffix}.{self.output_format}"
+            ))
+            self.files.append({
+                "input": input_path,
+                "output": output_path,
+                "size": os.path.getsize(input_path),
+                "status": "pending",
+                "percent": 0.0,
+                "speed": None,
+                "streams": None,
+                "error": None,
+            })
+        self._lock = threading.Lock()
+        self._last_report = 0.0
+        self.start_time = None
+
+    def _report(self, force=False):
+        if not self.on_progress:
+            return
+        now = time.time()
+        # 进度回调节流，避免多个 ffmpeg 进程同时刷新
+        if not force and now - self._last_report < 0.25:
+            return
+        self._last_report = now
+        self.on_progress(self.summary())
+
+    def summary(self):
+        with self._lock:
+            files = [dict(item) for item in self.files]
+        elapsed = max(time.time() - (self.start_time or time.time()), 1e-6)
+        counts = {status: sum(1 for item in files if item['status'] == status)
+                  for status in ("pending", "running", "done", "skipped", "failed", "cancelled")}
+        converted_bytes = sum(item['size'] for item in files if item['status'] == 'done')
+        return {
+            "files": files,
+            "total": len(files),
+            **counts,
+            "elapsed": round(elapsed, 2),
+            "files_per_second": round(counts['done'] / elapsed, 3),
+            "mb_per_second": round(converted_bytes / 1024 / 1024 / elapsed, 2),
+            "workers": self.workers,
+        }
+
+    def _update(self, item, **fields):
+        with self._lock:
+            item.update(fields)
+
+    def _convert(self, item, threads):
+        if self.should_stop and self.should_stop():
+            self._update(item, status="cancelled")
+            return
+        self._update(item, status="running")
+        self._report(force=True)
+
+        def on_progress(progress):
+            self._update(item, percent=progress['percent'] or item['percent'], speed=progress['speed'])
+            self._report()
+
+        try:
+            os.makedirs(os.path.dirname(item['output']), exist_ok=True)
+            result = convert_file(item['input'], item['output'], self.audio_bitrate, threads,
+                                  on_progress=on_progress, should_stop=self.should_stop)
+            self._update(item, status="done", percent=100.0, streams=result['streams'])
+        except Exception as e:
+            if self.should_stop and self.should_stop():
+                self._update(item, status="cancelled")
+            else:
+                print(f"ERROR: Conversion failed for {item['input']}: {e}")
+                self._update(item, status="failed", error=str(e))
+        self._report(force=True)
+
+    def run(self):
+        self.start_time = time.time()
+        pending = []
+        for item in self.files:
+            if is_up_to_date(item['input'], item['output']):
+                item['status'] = "skipped"
+                item['percent'] = 100.0
+            else:
+                pending.append(item)
+        self._report(force=True)
+        if pending:
+            workers = min(self.workers, len(pending))
+            threads = max(1, (os.cpu_count() or 1) // workers)
+            # 转换由 ffmpeg 子进程完成，线程只负责启动进程和读取进度
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="convert") as pool:
+                list(pool.map(lambda item: self._convert(item, threads), pending))
+        summary = self.summary()
+        print(f"Batch conversion: {summary['done']} converted, {summary['skipped']} skipped, "
+              f"{summary['failed']} failed, {summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s")
+        return summary
+
 
 if __name__ == "__main__":
     print("\n--- Running form_transformation.py as a standalone script for testing ---")
@@ -0,0 +1,200 @@
+# http_pool.py
+import asyncio
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 连接池默认参数（可通过配置 httpPoolLimit / httpPerHostLimit 修改）
+#   总连接数上限，以及每个主机的保活连接数上限
+DEFAULT_POOL_LIMIT = 64
+DEFAULT_PER_HOST_LIMIT = 16
+# 空闲的保活连接保留时间（秒，仅 aiohttp；urllib3 由服务器决定何时关闭）
+KEEPALIVE_SECONDS = 30
+REQUEST_TIMEOUT = 10
+
+
+class _Counter:
+    """一类客户端的请求数、新建连接数与响应延迟（收到响应头为止）"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self._lock = threading.Lock()
+
+    def add_connection(self):
+        with self._lock:
+            self.connections += 1
+
+    def add_request(self, latency, error=False):
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(0, self.requests - self.connections)
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "reused": reused,
+                "reuse_ratio": round(reused / self.requests, 3) if self.requests else 0.0,
+                "errors": self.errors,
+                "latency_avg_ms": round(self.latency_total / self.requests * 1000, 1) if self.requests else 0.0,
+                "latency_max_ms": round(self.latency_max * 1000, 1),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.connections = self.errors = 0
+            self.latency_total = self.latency_max = 0.0
+
+
+class _CountingAdapter(HTTPAdapter):
+    """统计请求延迟和新建连接数的 HTTPAdapter；未计入新建连接的请求即复用了保活连接"""
+
+    def __init__(self, counter, **kwargs):
+        self.counter = counter
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        counter = self.counter
+
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    counter.add_connection()
+                    return super()._new_conn()
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': counting(HTTPConnectionPool),
+            'https': counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = super().send(request, *args, **kwargs)
+        except Exception:
+            self.counter.add_request(time.perf_counter() - start, error=True)
+            raise
+        self.counter.add_request(time.perf_counter() - start)
+        return response
+
+
+class HttpPool:
+    """
+    应用内共享的 HTTP 连接池：一个 requests.Session 供同步代码（搜索、播放信息、分段下载）使用，
+    每个事件循环一个 aiohttp.ClientSession 供异步代码（视频信息、封面）使用。
+    两者都保持长连接并限制每个主机的连接数，避免每次请求重新建立 TCP/TLS 连接。
+    由 Api 创建并在退出时 close()；stats() 返回连接复用率与延迟，便于对比优化效果
+    """
+
+    def __init__(self, pool_limit=DEFAULT_POOL_LIMIT, per_host_limit=DEFAULT_PER_HOST_LIMIT):
+        self.pool_limit = max(1, int(pool_limit))
+        self.per_host_limit = max(1, int(per_host_limit))
+        self._sync_counter = _Counter()
+        self._async_counter = _Counter()
+        self.session = requests.Session()
+        # pool_connections 是缓存的主机连接池数量，pool_maxsize 是每个主机保留的连接数
+        adapter = _CountingAdapter(
+            self._sync_counter,
+            pool_connections=max(1, self.pool_limit // self.per_host_limit),
+            pool_maxsize=self.per_host_limit
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._aio_sessions = weakref.WeakKeyDictionary()  # loop -> aiohttp.ClientSession
+        self._lock = threading.Lock()
+
+    # ---- 同步 ----
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+        return self.session.get(url, **kwargs)
+
+    # ---- 异步 ----
+
+    def aio_session(self):
+        """返回当前事件循环对应的 aiohttp 会话（必须在协程中调用），首次使用时创建"""
+        import aiohttp
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._aio_sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.pool_limit,
+                    limit_per_host=self.per_host_limit,
+                    keepalive_timeout=KEEPALIVE_SECONDS,
+                    ttl_dns_cache=300
+                )
+                session = aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                    trace_configs=[self._trace_config()]
+                )
+                self._aio_sessions[loop] = session
+            return session
+
+    def _trace_config(self):
+        import aiohttp
+        counter = self._async_counter
+
+        async def on_request_start(session, context, params):
+            context.start = time.perf_counter()
+
+        async def on_request_end(session, context, params):
+            counter.add_request(time.perf_counter() - context.start)
+
+        async def on_request_exception(session, context, params):
+            counter.add_request(time.perf_counter() - context.start, error=True)
+
+        async def on_connection_create_end(session, context, params):
+            counter.add_connection()
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_request_end.append(on_request_end)
+        trace_config.on_request_exception.append(on_request_exception)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+    # ---- 统计与生命周期 ----
+
+    def stats(self):
+        return {
+            "sync": self._sync_counter.snapshot(),
+            "async": self._async_counter.snapshot(),
+            "pool_limit": self.pool_limit,
+            "per_host_limit": self.per_host_limit,
+        }
+
+    def reset_stats(self):
+        self._sync_counter.reset()
+        self._async_counter.reset()
+
+    def close(self, timeout=5):
+        """关闭同步会话和各事件循环中的 aiohttp 会话（在对应事件循环停止前调用）"""
+        self.session.close()
+        with self._lock:
+            sessions = list(self._aio_sessions.items())
+            self._aio_sessions.clear()
+        for loop, session in sessions:
+            if session.closed or loop.is_closed():
+                continue
+            if loop.is_running():
+                try:
+                    asyncio.run_coroutine_threadsafe(session.close(), loop).result(timeout)
+                except Exception:
+                    pass
+            else:
+                loop.run_until_complete(session.close())
@@ -0,0 +1,222 @@
+# job_scheduler.py
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+# 各类任务的默认并发上限（可通过配置 jobLimits 覆盖，如 {"cpu": 2, "io": 6}）
+#   cpu: 音频编辑、格式转换等本地计算/编码任务
+#   io: 下载等网络任务
+#   inference: 人声分离（实际推理在常驻的 Spleeter 工作进程中串行执行）
+DEFAULT_LIMITS = {
+    'cpu': max(1, (os.cpu_count() or 2) // 2),
+    'io': 4,
+    'inference': 1,
+}
+# 最多保留的已结束任务数，超出后最早结束的任务被丢弃
+MAX_FINISHED_JOBS = 200
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """任务函数在检测到取消请求时抛出，任务状态记为 cancelled"""
+
+
+class Job:
+    """一个后台任务的状态；任务函数通过它汇报进度、检查取消请求"""
+
+    def __init__(self, kind, pool):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.pool = pool
+        self.status = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self._cancel_event = threading.Event()
+        self._cancel_callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def update(self, **progress):
+        """合并进度字段，供 get_job_status 轮询"""
+        with self._lock:
+            self.progress = {**self.progress, **progress}
+
+    def on_cancel(self, callback):
+        """注册取消时的回调（例如终止子进程）；已取消时立即调用"""
+        with self._lock:
+            self._cancel_callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def request_cancel(self):
+        self._cancel_event.set()
+        with self._lock:
+            callbacks = list(self._cancel_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logging.warning(f"任务 {self.id} 的取消回调失败: {e}")
+
+    def to_dict(self):
+        with self._lock:
+            progress = dict(self.progress)
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "pool": self.pool,
+            "status": self.status,
+            "done": self.status in FINISHED_STATES,
+            "progress": progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """
+    长耗时操作的调度器：按任务类型（cpu / io / inference）分配到独立的线程池，
+    每类有自己的并发上限，提交后立即返回 Job，调用方通过 job_id 轮询状态或取消。
+    协程任务在共享的后台事件循环中执行，并占用所属线程池的一个并发名额
+    """
+
+    def __init__(self, limits=None):
+        self.limits = {**DEFAULT_LIMITS, **(limits or {})}
+        self._pools = {
+            name: ThreadPoolExecutor(max_workers=max(1, int(limit)), thread_name_prefix=f"job-{name}")
+            for name, limit in self.limits.items()
+        }
+        self._jobs = OrderedDict()  # job_id -> Job
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    @property
+    def loop(self):
+        """共享的后台事件循环，首次使用时启动"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="job-asyncio", daemon=True).start()
+            return self._loop
+
+    def run_coroutine(self, coro, timeout=None):
+        """在共享事件循环中执行协程并阻塞等待结果（不能在该事件循环线程内调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def submit(self, pool, fn, *args, kind=None, **kwargs):
+        """
+        提交任务，立即返回 Job
+        :param pool: 'cpu' / 'io' / 'inference'
+        :param fn: 以 fn(job, *args, **kwargs) 调用；可以是协程函数
+        :param kind: 任务类型名，仅用于展示，默认取函数名
+        """
+        if pool not in self._pools:
+            raise ValueError(f"未知的任务池: {pool}")
+        job = Job(kind or getattr(fn, '__name__', 'job'), pool)
+        with self._lock:
+            self._jobs[job.id] = job
+        job.future = self._pools[pool].submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job, fn, args, kwargs):
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                future = asyncio.run_coroutine_threadsafe(fn(job, *args, **kwargs), self.loop)
+                job.on_cancel(future.cancel)
+                result = future.result()
+            else:
+                result = fn(job, *args, **kwargs)
+        except (JobCancelled, CancelledError, asyncio.CancelledError):
+            self._finish(job, CANCELLED)
+            return
+        except Exception as e:
+            logging.error(f"任务 {job.kind} ({job.id}) 失败: {e}", exc_info=True)
+            job.error = str(e)
+            self._finish(job, FAILED)
+            return
+        job.result = result
+        if job.cancelled:
+            self._finish(job, CANCELLED)
+        elif isinstance(result, dict) and result.get('success') is False:
+            # 沿用 Api 的 {"success": False, "error": ...} 约定
+            job.error = result.get('error')
+            self._finish(job, FAILED)
+        else:
+            self._finish(job, SUCCEEDED)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        with self._lock:
+            finished = [j for j in self._jobs.values() if j.status in FINISHED_STATES]
+            for old in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+                self._jobs.pop(old.id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"未知的任务: {job_id}")
+        return job
+
+    def cancel(self, job_id):
+        """
+        请求取消任务：排队中的任务直接取消；运行中的任务由其取消回调或 check_cancelled() 协作结束
+        :return: 任务当前状态
+        """
+        job = self.get(job_id)
+        if job.status in FINISHED_STATES:
+            return job.status
+        job.request_cancel()
+        if job.future and job.future.cancel():
+            self._finish(job, CANCELLED)
+        return job.status
+
+    def list(self, pool=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job.to_dict() for job in jobs if pool is None or job.pool == pool]
+
+    def shutdown(self):
+        """取消所有未结束的任务并关闭线程池"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status not in FINISHED_STATES:
+                job.request_cancel()
+        for pool in self._pools.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
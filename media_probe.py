@@ -0,0 +1,77 @@
+# media_probe.py
+import os
+import threading
+from collections import OrderedDict
+
+# 内存中最多保留的探测结果数（可通过配置 probeCacheEntries 修改）
+DEFAULT_MAX_ENTRIES = 512
+
+
+class ProbeCache:
+    """
+    媒体探测结果的内存缓存：以规范化的绝对路径为键，文件大小和修改时间（纳秒）
+    未变时直接返回上次的结果，变化后重新探测；同一文件的并发探测只运行一次。
+    超出 max_entries 时淘汰最久未使用的条目
+    :param load: load(path) -> 探测结果（dict），失败时抛出异常，失败结果不缓存
+    """
+
+    def __init__(self, load, max_entries=DEFAULT_MAX_ENTRIES):
+        self.load = load
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()  # key -> (size, mtime_ns, info)
+        self._key_locks = {}  # key -> 正在探测时的锁
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _lookup(self, key, stat):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            self._entries.move_to_end(key)
+            return entry[2]
+        return None
+
+    def get(self, path):
+        """返回文件的探测结果，文件不存在时抛出 FileNotFoundError"""
+        key = self._key(path)
+        stat = os.stat(path)
+        with self._lock:
+            info = self._lookup(key, stat)
+            if info is not None:
+                self.hits += 1
+                return info
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                # 等待期间其它线程可能已经探测完成
+                info = self._lookup(key, stat)
+                if info is not None:
+                    self.hits += 1
+                    return info
+                self.misses += 1
+            try:
+                info = self.load(path)
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+            with self._lock:
+                self._entries[key] = (stat.st_size, stat.st_mtime_ns, info)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return info
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(path), None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
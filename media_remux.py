@@ -0,0 +1,354 @@
+# media_remux.py
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+from utils import get_ffmpeg_path, find_ffmpeg, find_ffprobe
+from configs import config_manager
+from media_probe import ProbeCache, DEFAULT_MAX_ENTRIES as DEFAULT_PROBE_CACHE_ENTRIES
+
+# 各容器可以直接封装（流复制）的编码；不在表中的流才重新编码
+COPY_COMPATIBLE = {
+    'mp4': {
+        'video': {'h264', 'hevc', 'av1', 'mpeg4', 'vp9'},
+        'audio': {'aac', 'mp3', 'alac', 'ac3', 'eac3', 'opus'},
+    },
+    'm4a': {'audio': {'aac', 'alac', 'ac3', 'eac3'}},
+    'mkv': None,  # None 表示任意编码都可以复制
+    'avi': {'video': {'h264', 'mpeg4', 'mjpeg', 'msmpeg4v3'}, 'audio': {'mp3', 'ac3', 'pcm_s16le'}},
+    'mp3': {'audio': {'mp3'}},
+    'wav': {'audio': {'pcm_s16le', 'pcm_s24le', 'pcm_s32le', 'pcm_f32le', 'pcm_u8'}},
+    'flac': {'audio': {'flac'}},
+    'opus': {'audio': {'opus'}},
+    'ogg': {'audio': {'vorbis', 'opus', 'flac'}},
+    'webm': {'video': {'vp8', 'vp9', 'av1'}, 'audio': {'vorbis', 'opus'}},
+}
+# 无法复制时的编码参数，{index} 为输出流序号，{bitrate} 为音频码率
+_AAC = ['-c:{index}', 'aac', '-b:{index}', '{bitrate}']
+_X264 = ['-c:{index}', 'libx264', '-preset', 'veryfast', '-crf', '20', '-pix_fmt', 'yuv420p']
+FALLBACK_ENCODERS = {
+    'mp4': {'video': _X264, 'audio': _AAC},
+    'm4a': {'audio': _AAC},
+    'mkv': {'video': _X264, 'audio': _AAC},
+    'avi': {'video': ['-c:{index}', 'mpeg4', '-q:{index}', '3'], 'audio': ['-c:{index}', 'libmp3lame', '-b:{index}', '{bitrate}']},
+    'mp3': {'audio': ['-c:{index}', 'libmp3lame', '-b:{index}', '{bitrate}']},
+    'wav': {'audio': ['-c:{index}', 'pcm_s16le']},
+    'flac': {'audio': ['-c:{index}', 'flac']},
+    'opus': {'audio': ['-c:{index}', 'libopus', '-b:{index}', '{bitrate}']},
+    'ogg': {'audio': ['-c:{index}', 'libvorbis', '-b:{index}', '{bitrate}']},
+    'webm': {'video': ['-c:{index}', 'libvpx-vp9', '-b:{index}', '0', '-crf', '32'], 'audio': ['-c:{index}', 'libopus', '-b:{index}', '{bitrate}']},
+}
+# 扩展名对应的 ffmpeg 封装器（输出先写入临时文件，需要显式指定）
+MUXERS = {
+    'mp4': 'mp4',
+    'm4a': 'mp4',  # ipod 封装器不接受 AC-3 / E-AC-3
+    'mkv': 'matroska',
+    'avi': 'avi',
+    'mp3': 'mp3',
+    'wav': 'wav',
+    'flac': 'flac',
+    'opus': 'opus',
+    'ogg': 'ogg',
+    'webm': 'webm',
+}
+DEFAULT_AUDIO_BITRATE = '192k'
+# 纯音频按编码选择的扩展名（容器）
+AUDIO_EXTENSIONS = {
+    'aac': 'm4a',
+    'alac': 'm4a',
+    'ac3': 'm4a',
+    'eac3': 'm4a',
+    'mp3': 'mp3',
+    'flac': 'flac',
+    'opus': 'opus',
+    'vorbis': 'ogg',
+}
+
+_STREAM_LINE = re.compile(r'Stream #\d+:(\d+)(?:\[[^\]]*\])?(?:\([^)]*\))?: (Video|Audio|Subtitle|Data): (\w+)(.*)')
+_DURATION_LINE = re.compile(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)(?:.*?bitrate: (\d+) kb/s)?')
+_SAMPLE_RATE = re.compile(r'(\d+) Hz')
+_CHANNEL_LAYOUTS = {'mono': 1, 'stereo': 2, '2.1': 3, 'quad': 4, '5.0': 5, '5.1': 6, '7.1': 8}
+_RESOLUTION = re.compile(r'\b(\d{2,5})x(\d{2,5})\b')
+_STREAM_BITRATE = re.compile(r'(\d+) kb/s')
+
+
+def _creationflags():
+    return subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float_or_none(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_ffmpeg_stream(index, kind, codec, details):
+    """解析 ffmpeg -i 输出中一条流的描述（采样率、声道、分辨率、码率、是否为封面图）"""
+    stream = {
+        "index": int(index),
+        "codec_type": kind.lower(),
+        "codec_name": codec,
+        "bit_rate": None,
+        "attached_pic": '(attached pic)' in details,
+    }
+    bit_rate = _STREAM_BITRATE.search(details)
+    if bit_rate:
+        stream["bit_rate"] = int(bit_rate.group(1)) * 1000
+    if stream["codec_type"] == 'audio':
+        sample_rate = _SAMPLE_RATE.search(details)
+        stream["sample_rate"] = int(sample_rate.group(1)) if sample_rate else None
+        layout = next((name for name in _CHANNEL_LAYOUTS if f", {name}" in details), None)
+        stream["channels"] = _CHANNEL_LAYOUTS.get(layout)
+    elif stream["codec_type"] == 'video':
+        resolution = _RESOLUTION.search(details)
+        stream["width"] = int(resolution.group(1)) if resolution else None
+        stream["height"] = int(resolution.group(2)) if resolution else None
+    return stream
+
+
+def probe_uncached(path):
+    """
+    运行 ffprobe 探测媒体文件（每次都启动进程，一般应使用带缓存的 probe）
+    :return: {'streams': [{'index', 'codec_type', 'codec_name', 'bit_rate', 'attached_pic',
+              音频另含 'sample_rate' / 'channels'，视频另含 'width' / 'height'}, ...],
+              'duration': 秒或 None, 'bit_rate': bit/s 或 None, 'format_name', 'size'}
+    没有 ffprobe 时解析 ffmpeg -i 的输出（format_name 为 None，其余字段尽量从文本中取得）
+    """
+    ffprobe = find_ffprobe()
+    if ffprobe:
+        completed = subprocess.run(
+            [ffprobe, '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path],
+            capture_output=True, creationflags=_creationflags()
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"ffprobe 失败: {completed.stderr.decode('utf-8', errors='replace').strip()}")
+        data = json.loads(completed.stdout or b'{}')
+        streams = []
+        for raw in data.get('streams', []):
+            stream = {
+                "index": raw.get('index'),
+                "codec_type": raw.get('codec_type'),
+                "codec_name": raw.get('codec_name'),
+                "bit_rate": _int_or_none(raw.get('bit_rate')),
+                "attached_pic": bool(raw.get('disposition', {}).get('attached_pic')),
+            }
+            if stream["codec_type"] == 'audio':
+                stream["sample_rate"] = _int_or_none(raw.get('sample_rate'))
+                stream["channels"] = _int_or_none(raw.get('channels'))
+            elif stream["codec_type"] == 'video':
+                stream["width"] = _int_or_none(raw.get('width'))
+                stream["height"] = _int_or_none(raw.get('height'))
+            streams.append(stream)
+        media_format = data.get('format', {})
+        return {
+            "streams": streams,
+            "duration": _float_or_none(media_format.get('duration')),
+            "bit_rate": _int_or_none(media_format.get('bit_rate')),
+            "format_name": media_format.get('format_name'),
+            "size": os.path.getsize(path),
+        }
+
+    ffmpeg = find_ffmpeg() or get_ffmpeg_path()
+    completed = subprocess.run(
+        [ffmpeg, '-hide_banner', '-i', path], capture_output=True, creationflags=_creationflags()
+    )
+    output = completed.stderr.decode('utf-8', errors='replace')
+    streams = [_parse_ffmpeg_stream(*match) for match in _STREAM_LINE.findall(output)]
+    if not streams:
+        raise RuntimeError(f"无法识别媒体文件: {path}")
+    duration = _DURATION_LINE.search(output)
+    return {
+        "streams": streams,
+        "duration": int(duration.group(1)) * 3600 + int(duration.group(2)) * 60 + float(duration.group(3)) if duration else None,
+        "bit_rate": int(duration.group(4)) * 1000 if duration and duration.group(4) else None,
+        "format_name": None,
+        "size": os.path.getsize(path),
+    }
+
+
+# 进程内共享的探测缓存：同一文件（大小和修改时间不变）只运行一次 ffprobe
+PROBE_CACHE = ProbeCache(
+    probe_uncached, max_entries=config_manager.get('probeCacheEntries', DEFAULT_PROBE_CACHE_ENTRIES)
+)
+
+
+def probe(path):
+    """探测媒体文件的流信息（带缓存），返回值见 probe_uncached；调用方不应修改返回的字典"""
+    return PROBE_CACHE.get(path)
+
+
+def media_streams(info, codec_type):
+    """返回探测结果中某类流的列表；视频流不包括音频文件中作为封面图的图片流"""
+    return [stream for stream in info['streams']
+            if stream['codec_type'] == codec_type and not stream.get('attached_pic')]
+
+
+def container_of(path):
+    return os.path.splitext(path)[1].lstrip('.').lower()
+
+
+def can_copy(container, codec_type, codec_name):
+    allowed = COPY_COMPATIBLE.get(container, {})
+    if allowed is None:
+        return True
+    return codec_name in allowed.get(codec_type, set())
+
+
+def audio_extension(codec_name, default='m4a'):
+    """纯音频流应使用的扩展名，例如 B 站 DASH 的 AAC 音频为 m4a 而不是 mp3"""
+    return AUDIO_EXTENSIONS.get(codec_name, default)
+
+
+def build_command(inputs, output_path, container, stream_types=('video', 'audio'), audio_bitrate=DEFAULT_AUDIO_BITRATE,
+                  threads=0, extra_args=()):
+    """
+    生成一条 ffmpeg 命令：每类流从第一个含有它的输入中取一路，容器支持的编码直接复制，
+    其余按 FALLBACK_ENCODERS 编码。不需要视频时加 -vn，视频流既不解码也不读取
+    :param container: 目标容器（扩展名），决定可复制的编码、编码器和封装器
+    :param threads: 传给 -threads，0 表示由 ffmpeg 按 CPU 核数自动选择
+    :return: (命令列表, [{'codec_type', 'codec_name', 'mode': 'copy' / 'encode'}])
+    """
+    if container not in MUXERS:
+        raise ValueError(f"不支持的输出格式: {container}")
+    command = [find_ffmpeg() or get_ffmpeg_path(), '-y', '-hide_banner', '-loglevel', 'error']
+    for path in inputs:
+        command += ['-i', path]
+
+    mapped = []
+    codec_args = []
+    wanted = list(stream_types)
+    for input_index, path in enumerate(inputs):
+        for stream in probe(path)['streams']:
+            codec_type = stream['codec_type']
+            if codec_type not in wanted or stream.get('attached_pic'):
+                continue
+            wanted.remove(codec_type)
+            output_index = len(mapped)
+            command += ['-map', f"{input_index}:{stream['index']}"]
+            if can_copy(container, codec_type, stream['codec_name']):
+                mode = 'copy'
+                codec_args += [f'-c:{output_index}', 'copy']
+            else:
+                encoder = FALLBACK_ENCODERS.get(container, {}).get(codec_type)
+                if encoder is None:
+                    raise ValueError(f"{container} 容器不支持 {codec_type} 流 ({stream['codec_name']})")
+                mode = 'encode'
+                codec_args += [arg.format(index=output_index, bitrate=audio_bitrate) for arg in encoder]
+            mapped.append({"codec_type": codec_type, "codec_name": stream['codec_name'], "mode": mode})
+    if not mapped:
+        raise ValueError("输入文件中没有可用的流")
+
+    if 'video' not in stream_types:
+        command += ['-vn']
+    command += ['-sn', '-dn']
+    command += codec_args
+    command += ['-threads', str(threads)]
+    command += list(extra_args)
+    command += ['-f', MUXERS[container], output_path]
+    return command, mapped
+
+
+class ConversionCancelled(Exception):
+    """转换被调用方中止，ffmpeg 进程已终止"""
+
+
+def run_ffmpeg(command, duration=None, on_progress=None, should_stop=None):
+    """
+    执行 ffmpeg 命令，解析 -progress 输出（key=value 行）并回调进度
+    :param duration: 输入时长（秒），用于计算百分比
+    :param on_progress: 可选回调 on_progress({'out_time', 'percent', 'speed', 'total_size'})
+    :param should_stop: 可选，返回 True 时终止 ffmpeg 并抛出 ConversionCancelled
+    """
+    command = command[:-1] + ['-progress', 'pipe:1', '-nostats'] + command[-1:]
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, creationflags=_creationflags()
+    )
+    # stderr 在另一个线程中读取，避免管道写满后 ffmpeg 阻塞
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_reader.start()
+    block = {}
+    try:
+        for raw_line in process.stdout:
+            if should_stop and should_stop():
+                process.kill()
+                raise ConversionCancelled()
+            key, _, value = raw_line.decode('utf-8', errors='replace').strip().partition('=')
+            block[key] = value
+            if key != 'progress':
+                continue
+            # 每个进度块以 progress=continue / end 结尾
+            if on_progress:
+                on_progress(_parse_progress(block, duration))
+            block = {}
+        process.wait()
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        stderr_reader.join(timeout=5)
+    if should_stop and should_stop():
+        raise ConversionCancelled()
+    if process.returncode != 0:
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace').strip()
+        raise RuntimeError(f"ffmpeg 转换失败: {stderr}")
+
+
+def _parse_progress(block, duration):
+    out_time = None
+    # out_time_us 与 out_time_ms 的单位都是微秒（后者是 ffmpeg 的历史命名）
+    for key in ('out_time_us', 'out_time_ms'):
+        value = block.get(key, '')
+        if value.lstrip('-').isdigit():
+            out_time = max(0, int(value)) / 1_000_000
+            break
+    speed = block.get('speed', '').rstrip('x').strip()
+    total_size = block.get('total_size', '')
+    finished = block.get('progress') == 'end'
+    percent = None
+    if finished:
+        percent = 100.0
+    elif duration and out_time is not None:
+        percent = round(min(100.0, out_time / duration * 100), 1)
+    return {
+        "out_time": round(out_time, 2) if out_time is not None else None,
+        "percent": percent,
+        "speed": float(speed) if speed.replace('.', '', 1).isdigit() else None,
+        "total_size": int(total_size) if total_size.isdigit() else None,
+        "finished": finished,
+    }
+
+
+def remux(inputs, output, stream_types=('video', 'audio'), audio_bitrate=DEFAULT_AUDIO_BITRATE, threads=0,
+          on_progress=None, should_stop=None):
+    """
+    把输入文件中的流封装 / 转换到 output：容器支持的流直接复制（不解码，只受磁盘读写速度限制），
+    其余的流重新编码。整个转换是一条 ffmpeg 命令，先写入临时文件，成功后再重命名
+    :param inputs: 输入文件列表（例如 [视频流文件, 音频流文件]）
+    :param stream_types: 需要的流类型
+    :param on_progress: 可选，进度回调，见 run_ffmpeg
+    :param should_stop: 可选，返回 True 时中止并抛出 ConversionCancelled
+    :return: {'path', 'streams': [{'codec_type', 'codec_name', 'mode': 'copy' / 'encode'}], 'duration'}
+    """
+    temp_path = output + '.part'
+    duration = probe(inputs[0])['duration'] if on_progress else None
+    command, mapped = build_command(
+        inputs, temp_path, container_of(output), stream_types, audio_bitrate, threads
+    )
+    try:
+        run_ffmpeg(command, duration, on_progress, should_stop)
+        os.replace(temp_path, output)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return {"path": output, "streams": mapped, "duration": duration}
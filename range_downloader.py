@@ -0,0 +1,275 @@
+# range_downloader.py
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+
+# 每个分段的字节数与默认并发连接数（可通过配置 downloadSegmentBytes / downloadConnections 修改）
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+DEFAULT_CONNECTIONS = 8
+# 每次从响应中读取的字节数
+READ_CHUNK_BYTES = 256 * 1024
+# 单个分段失败后的重试次数
+SEGMENT_RETRIES = 3
+REQUEST_TIMEOUT = 15
+
+_CONTENT_RANGE = re.compile(r'bytes\s+(\d+)-(\d+)/(\d+|\*)')
+
+
+class DownloadInterrupted(Exception):
+    """下载被调用方中止（暂停、取消或退出）；分段下载的进度保留在日志中，可以续传"""
+
+
+def make_session(pool_size=DEFAULT_CONNECTIONS):
+    """创建连接池大小与并发数匹配的 requests.Session"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def split_ranges(total_size, segment_bytes):
+    """把 [0, total_size) 切分为闭区间字节范围列表 [(start, end), ...]"""
+    return [
+        (start, min(start + segment_bytes, total_size) - 1)
+        for start in range(0, total_size, segment_bytes)
+    ]
+
+
+class DownloadJournal:
+    """
+    断点续传日志：与 .part 文件放在一起（<path>.part.json），记录已完整写入的分段，
+    以及远端文件的大小和 ETag / Last-Modified，用于判断续传时远端内容是否变化
+    """
+
+    def __init__(self, path, size, validators, segment_bytes, done=None):
+        self.path = path
+        self.size = size
+        self.validators = validators
+        self.segment_bytes = segment_bytes
+        self.done = set(done or [])  # {(start, end)}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def validators_from(response_headers):
+        return {
+            "etag": response_headers.get('ETag'),
+            "last_modified": response_headers.get('Last-Modified')
+        }
+
+    @classmethod
+    def load(cls, path, size, validators, segment_bytes):
+        """
+        读取已有日志；日志缺失、损坏或与远端文件不一致时返回 None
+        大小必须相同；双方都提供 ETag（或 Last-Modified）时也必须相同
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('size') != size or data.get('segment_bytes') != segment_bytes:
+            return None
+        for key, value in validators.items():
+            recorded = data.get('validators', {}).get(key)
+            if value and recorded and value != recorded:
+                return None
+        return cls(path, size, validators, segment_bytes, [tuple(r) for r in data.get('done', [])])
+
+    def downloaded_bytes(self):
+        with self._lock:
+            return sum(end - start + 1 for start, end in self.done)
+
+    def mark_done(self, start, end):
+        with self._lock:
+            self.done.add((start, end))
+            self._save_locked()
+
+    def save(self):
+        with self._lock:
+            self._save_locked()
+
+    def _save_locked(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "size": self.size,
+                "validators": self.validators,
+                "segment_bytes": self.segment_bytes,
+                "done": sorted(self.done)
+            }, f)
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class RangeDownloader:
+    """
+    分段并发下载：探测服务器是否支持 Range，支持时预分配目标文件，
+    多个连接各自下载一个字节范围并按偏移写入；不支持时退回单连接流式下载。
+    分段下载会记录日志，中断后再次下载同一路径时只请求缺失的分段
+    """
+
+    def __init__(self, session=None, connections=DEFAULT_CONNECTIONS, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.connections = max(1, int(connections))
+        self.segment_bytes = max(64 * 1024, int(segment_bytes))
+        self.session = session or make_session(self.connections)
+
+    def probe(self, url, headers=None, cookies=None):
+        """
+        用 bytes=0-0 的 Range 请求探测文件大小与 Range 支持
+        :return: (total_size 或 None, 是否支持 Range, 响应头)
+        """
+        request_headers = {**(headers or {}), 'Range': 'bytes=0-0'}
+        with self.session.get(url, headers=request_headers, cookies=cookies, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            if response.status_code == 206:
+                match = _CONTENT_RANGE.match(response.headers.get('Content-Range', ''))
+                if match and match.group(3) != '*':
+                    return int(match.group(3)), True, response.headers
+            length = response.headers.get('Content-Length')
+            return (int(length) if length else None), False, response.headers
+
+    def download(self, url, path, headers=None, cookies=None, on_progress=None, should_stop=None):
+        """
+        下载 url 到 path；先写入 path + '.part'，完成后重命名。
+        同一 path 上次中断留下的 .part 与日志仍与远端一致时，只下载缺失的分段
+        （url 可以不同，B 站的流地址带有时效签名，每次获取都会变化）
+        :param on_progress: 可选回调 on_progress(downloaded_bytes, total_bytes)
+        :param should_stop: 可选，返回 True 时尽快中止并抛出 DownloadInterrupted
+        :return: {'path', 'size', 'elapsed', 'speed'（本次传输字节/秒）, 'segments', 'resumed_bytes'}
+        """
+        start_time = time.time()
+        total_size, ranged, response_headers = self.probe(url, headers, cookies)
+        part_path = path + '.part'
+        journal_path = part_path + '.json'
+        resumed_bytes = 0
+        if ranged and total_size:
+            segments = split_ranges(total_size, self.segment_bytes)
+            validators = DownloadJournal.validators_from(response_headers)
+            journal = None
+            if os.path.exists(part_path) and os.path.getsize(part_path) == total_size:
+                journal = DownloadJournal.load(journal_path, total_size, validators, self.segment_bytes)
+            if journal is None:
+                # 没有可用的日志：重新预分配文件，各分段直接写入自己的偏移位置
+                with open(part_path, 'wb') as f:
+                    f.truncate(total_size)
+                journal = DownloadJournal(journal_path, total_size, validators, self.segment_bytes)
+                journal.save()
+            resumed_bytes = journal.downloaded_bytes()
+            if resumed_bytes:
+                print(f"[RangeDownloader] 续传 {os.path.basename(path)}: 已有 {resumed_bytes}/{total_size} 字节")
+            missing = [segment for segment in segments if segment not in journal.done]
+            self._download_ranges(url, part_path, total_size, missing, journal, headers, cookies, on_progress, should_stop)
+            os.replace(part_path, path)
+            journal.remove()
+        else:
+            segments = []
+            # 不支持 Range 时无法续传，旧的日志作废
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            total_size = self._download_stream(url, part_path, total_size, headers, cookies, on_progress, should_stop)
+            os.replace(part_path, path)
+        elapsed = time.time() - start_time
+        return {
+            "path": path,
+            "size": total_size,
+            "elapsed": round(elapsed, 2),
+            "speed": round((total_size - resumed_bytes) / max(elapsed, 1e-6)),
+            "segments": len(segments),
+            "resumed_bytes": resumed_bytes
+        }
+
+    def _download_ranges(self, url, part_path, total_size, segments, journal, headers, cookies, on_progress, should_stop):
+        progress = _Progress(total_size, on_progress, journal.downloaded_bytes())
+        if not segments:
+            return
+        # 任一分段失败（或被中止）时通知其他分段尽快停止，尚未开始的分段直接取消
+        abort = threading.Event()
+
+        def stopped():
+            return abort.is_set() or bool(should_stop and should_stop())
+
+        with ThreadPoolExecutor(max_workers=min(self.connections, len(segments))) as pool:
+            futures = [
+                pool.submit(self._fetch_segment, url, part_path, start, end, journal, headers, cookies, progress, stopped)
+                for start, end in segments
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except BaseException:
+                abort.set()
+                for future in futures:
+                    future.cancel()
+                raise
+
+    def _fetch_segment(self, url, part_path, start, end, journal, headers, cookies, progress, should_stop):
+        request_headers = {**(headers or {}), 'Range': f'bytes={start}-{end}'}
+        for attempt in range(SEGMENT_RETRIES + 1):
+            written = 0
+            _check_stop(should_stop)
+            try:
+                with self.session.get(url, headers=request_headers, cookies=cookies, stream=True, timeout=REQUEST_TIMEOUT) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        raise IOError(f"服务器未返回分段内容 (HTTP {response.status_code})")
+                    # 每个线程使用独立的文件句柄，定位写入互不干扰
+                    with open(part_path, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+                            f.write(chunk)
+                            written += len(chunk)
+                            progress.add(len(chunk))
+                            _check_stop(should_stop)
+                if written != end - start + 1:
+                    raise IOError(f"分段 {start}-{end} 长度不符: {written}")
+                journal.mark_done(start, end)
+                return
+            except (requests.exceptions.RequestException, IOError):
+                progress.add(-written)
+                if attempt == SEGMENT_RETRIES:
+                    raise
+                time.sleep(0.5 * (attempt + 1))
+
+    def _download_stream(self, url, part_path, total_size, headers, cookies, on_progress, should_stop):
+        progress = _Progress(total_size, on_progress)
+        with self.session.get(url, headers=headers, cookies=cookies, stream=True, timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=READ_CHUNK_BYTES):
+                    f.write(chunk)
+                    progress.add(len(chunk))
+                    _check_stop(should_stop)
+        return progress.downloaded
+
+
+def _check_stop(should_stop):
+    if should_stop and should_stop():
+        raise DownloadInterrupted()
+
+
+class _Progress:
+    """多个分段线程共享的已下载字节计数"""
+
+    def __init__(self, total, callback, downloaded=0):
+        self.total = total
+        self.callback = callback
+        self.downloaded = downloaded
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.downloaded += count
+            downloaded = self.downloaded
+        if self.callback and count:
+            self.callback(downloaded, self.total)
@@ -5,14 +5,29 @@ import os
 import sys
 import subprocess
 from urllib3.connection import HTTPConnection
-from urllib.parse import quote
+from urllib.parse import quote, urlencode
 import yt_dlp
 import asyncio
 import aiohttp
 import time  
 import random
+import threading
 from configs import config_manager
 from utils import get_ffmpeg_path
+from concurrent.futures import ThreadPoolExecutor
+from media_remux import remux, probe, audio_extension
+from range_downloader import RangeDownloader, DownloadInterrupted, DEFAULT_CONNECTIONS, DEFAULT_SEGMENT_BYTES
+from http_pool import HttpPool
+from video_metadata import MetadataCache, DEFAULT_TTL, DEFAULT_MAX_ENTRIES
+from youtube_search import YoutubeSearchCursors, YtDlpSearchExtractor, DEFAULT_TTL as YOUTUBE_SEARCH_TTL
+
+# 播放列表并行下载的默认工作线程数与单个条目的重试次数
+# （可通过配置 youtubePlaylistWorkers / youtubePlaylistRetries 修改，遇到限流时调低并发）
+DEFAULT_PLAYLIST_WORKERS = 3
+DEFAULT_PLAYLIST_RETRIES = 2
+# B 站合集分页获取的每页条目数与同时请求的页数（可通过配置 collectionPageConcurrency 修改）
+COLLECTION_PAGE_SIZE = 50
+DEFAULT_COLLECTION_CONCURRENCY = 4
 
 # Global variable to store ffmpeg availability status
 _ffmpeg_available = None
@@ -49,7 +64,10 @@ cookies_dict = _parse_cookie_string(bilibili_cookies_str)
 youtube_cookies_str = config_manager.get('youtubeCookies', '')
 class BiliVideoDownloader:
      
-    def __init__(self):
+    def __init__(self, http=None):
+        """
+        :param http: 共享的 HttpPool；未提供时自行创建（独立使用时）
+        """
         self.video_url = None
         self.video_info = None
         self.output_dir = config_manager.get('defaultOutput', './output') # Use config_manager
@@ -57,6 +75,32 @@ class BiliVideoDownloader:
         os.makedirs(self.output_dir, exist_ok=True)
         self.video_page_url = None
         self.is_logged_in = True # Track login status
+        self.http = http or HttpPool()
+        # 分段并发下载器与其它请求共用连接池；视频流和音频流同时下载，
+        # 每个 CDN 主机最多占用两倍并发数的连接，受 httpPerHostLimit 约束
+        connections = config_manager.get('downloadConnections', DEFAULT_CONNECTIONS)
+        self.range_downloader = RangeDownloader(
+            session=self.http.session,
+            connections=connections,
+            segment_bytes=config_manager.get('downloadSegmentBytes', DEFAULT_SEGMENT_BYTES)
+        )
+        # x/web-interface/view 的结果按 bvid 缓存：搜索翻页、预览、合集判断和下载共用，并发请求合并
+        self.video_views = MetadataCache(
+            self._fetch_video_view,
+            ttl=config_manager.get('videoMetaTTL', DEFAULT_TTL),
+            max_entries=config_manager.get('videoMetaMaxEntries', DEFAULT_MAX_ENTRIES)
+        )
+        # 完整的合集列表按 (mid, season_id) 缓存（由 iter_collection_videos 取完后写入），再次打开同一合集时不再请求
+        self.collection_listings = MetadataCache(
+            ttl=config_manager.get('videoMetaTTL', DEFAULT_TTL),
+            max_entries=50
+        )
+        # 搜索结果页按 (关键词, 页码, 每页数量) 缓存，来回翻页时不重复请求
+        self.search_pages = MetadataCache(
+            self._fetch_search_page,
+            ttl=config_manager.get('videoMetaTTL', DEFAULT_TTL),
+            max_entries=100
+        )
 
     def _check_ffmpeg_available(self):
         """Checks if ffmpeg is available in the system's PATH."""
@@ -84,7 +128,7 @@ class BiliVideoDownloader:
             "page": page,
             "page_size": per_page  # 新增分页参数
         }
-        response = requests.get(api_url, headers=headers, params=params,cookies=cookies_dict)
+        response = self.http.get(api_url, headers=headers, params=params, cookies=cookies_dict)
         if response.status_code == 200:
             data = response.json()
             videos = data.get('data', {}).get('result', [])
@@ -99,6 +143,17 @@ class BiliVideoDownloader:
         else:
             print("API请求失败，状态码:", response.status_code)
             return [], [], 0
+    async def _fetch_search_page(self, key):
+        keyword, page, per_page = key
+        loop = asyncio.get_running_loop()
+        bvids, titles, total = await loop.run_in_executor(None, self.search_videos, keyword, page, per_page)
+        # 请求失败（空结果）不缓存
+        return (bvids, titles, total) if bvids else None
+
+    async def search_videos_cached(self, keyword, page=1, per_page=20):
+        """带缓存的 search_videos，返回 (bvids, titles, total)"""
+        return await self.search_pages.get((keyword, page, per_page)) or ([], [], 0)
+
     def get_video_page_url(self, titles, bvids):
         if titles and bvids:
             print("搜索到的视频有：")
@@ -115,7 +170,7 @@ class BiliVideoDownloader:
     def get_playinfo(self, url):
         try:
             headers['Referer'] = url
-            response = requests.get(url, headers=headers, cookies=cookies_dict, timeout=10)
+            response = self.http.get(url, headers=headers, cookies=cookies_dict, timeout=10)
             response.raise_for_status()  # 自动触发 HTTPError
             
             findUrl = re.compile(r'<script>window\.__playinfo__=(.*?)</script>', re.S)
@@ -136,7 +191,14 @@ class BiliVideoDownloader:
             print(f"解析视频信息JSON失败: {str(e)}")
             return None
 
-    def download_video(self, video_info, video_title):
+    def download_video(self, video_info, video_title, on_progress=None, should_stop=None, audio_only=False):
+        """
+        下载 DASH 视频流和音频流并合并；两个流同时下载，每个流再按字节范围多连接并发。
+        合并时探测流编码，容器支持的流直接复制（B 站的 AVC/HEVC 视频和 AAC 音频都无需重新编码）
+        :param on_progress: 可选回调 on_progress(已下载字节, 总字节)，统计两个流的合计
+        :param should_stop: 可选，返回 True 时中止下载并抛出 DownloadInterrupted，已下载的分段可续传
+        :param audio_only: 只下载音频流，按实际编码保存（AAC 为 .m4a），不下载视频流
+        """
         sanitized_video_title = self._sanitize_filename(video_title)
         os.makedirs(self.output_dir, exist_ok=True)
 
@@ -144,105 +206,157 @@ class BiliVideoDownloader:
             return {"success": False, "error": "视频信息不完整，缺少data或dash字段。"}
 
         dash_data = video_info['data']['dash']
-        video_filename = os.path.join(self.output_dir, f'{sanitized_video_title}.flv')
-        audio_filename = os.path.join(self.output_dir, f'{sanitized_video_title}.mp3')
+        # DASH 流是分片 MP4，下载时使用中性的 .m4s 扩展名，合并或整理后才得到最终文件
+        video_filename = os.path.join(self.output_dir, f'{sanitized_video_title}.video.m4s')
+        audio_filename = os.path.join(self.output_dir, f'{sanitized_video_title}.audio.m4s')
 
-        video_downloaded = False
-        audio_downloaded = False
-
-        # Download video
+        streams = {}
         video_data = dash_data.get('video')
-        if video_data and len(video_data) > 0:
-            videoURL = video_data[0]['baseUrl']
-            try:
-                video_response = requests.get(videoURL, headers=headers, cookies=cookies_dict, stream=True)
-                video_response.raise_for_status()
-                with open(video_filename, 'wb') as f:
-                    for chunk in video_response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                video_downloaded = True
-            except requests.exceptions.RequestException as e:
-                return {"success": False, "error": f"下载视频失败: {e}"}
-        
-        # Download audio
+        if video_data and len(video_data) > 0 and not audio_only:
+            streams['video'] = (video_data[0]['baseUrl'], video_filename)
         audio_data = dash_data.get('audio')
         if audio_data and len(audio_data) > 0:
-            audioURL = audio_data[0]['baseUrl']
-            try:
-                audio_response = requests.get(audioURL, headers=headers, cookies=cookies_dict, stream=True)
-                audio_response.raise_for_status()
-                with open(audio_filename, 'wb') as f:
-                    for chunk in audio_response.iter_content(chunk_size=8192):
-                        f.write(chunk)
-                audio_downloaded = True
-            except requests.exceptions.RequestException as e:
-                return {"success": False, "error": f"下载音频失败: {e}"}
+            streams['audio'] = (audio_data[0]['baseUrl'], audio_filename)
+        if audio_only and 'audio' not in streams:
+            return {"success": False, "error": "没有找到音频流信息，无法下载。"}
+
+        progress = {kind: (0, 0) for kind in streams}
+        progress_lock = threading.Lock()
+
+        def stream_progress(kind):
+            def callback(downloaded, total):
+                with progress_lock:
+                    progress[kind] = (downloaded, total or 0)
+                    downloaded_sum = sum(d for d, _ in progress.values())
+                    total_sum = sum(t for _, t in progress.values())
+                on_progress(downloaded_sum, total_sum)
+            return callback if on_progress else None
+
+        results = {}
+        errors = {}
+        if streams:
+            with ThreadPoolExecutor(max_workers=len(streams)) as pool:
+                futures = {
+                    kind: pool.submit(
+                        self.range_downloader.download, url, filename,
+                        headers=headers, cookies=cookies_dict, on_progress=stream_progress(kind),
+                        should_stop=should_stop
+                    )
+                    for kind, (url, filename) in streams.items()
+                }
+                for kind, future in futures.items():
+                    try:
+                        results[kind] = future.result()
+                    except (requests.exceptions.RequestException, IOError) as e:
+                        errors[kind] = e
+        if 'video' in errors:
+            return {"success": False, "error": f"下载视频失败: {errors['video']}"}
+        if 'audio' in errors:
+            return {"success": False, "error": f"下载音频失败: {errors['audio']}"}
+        for kind, result in results.items():
+            print(f"{kind} 下载完成: {result['size']} 字节 (续传 {result['resumed_bytes']} 字节), {result['elapsed']}s, "
+                  f"{result['speed'] / 1024 / 1024:.2f} MB/s ({result['segments']} 个分段)")
+
+        video_downloaded = 'video' in results
+        audio_downloaded = 'audio' in results
 
         if not video_downloaded and not audio_downloaded:
             return {"success": False, "error": "没有找到视频流和音频流信息，无法下载。"}
 
-        if video_downloaded and audio_downloaded:
-            if self._check_ffmpeg_available():
-                # Merge video and audio
+        audio_codec = self._dash_audio_codec(audio_data[0]) if audio_downloaded else None
+        if not self._check_ffmpeg_available():
+            # If ffmpeg is not available, save video and audio separately
+            print("FFmpeg is not available. Saving video and audio separately.")
+            if video_downloaded:
+                os.replace(video_filename, os.path.join(self.output_dir, f'{sanitized_video_title}_video.mp4'))
+            if audio_downloaded:
+                # DASH 音频本身就是 MP4 封装，按编码取扩展名（AAC 为 m4a）
+                audio_path = os.path.join(self.output_dir, f'{sanitized_video_title}_audio.{audio_extension(audio_codec)}')
+                os.replace(audio_filename, audio_path)
+            return {"success": True, "message": "FFmpeg未找到，视频和音频已单独下载。"}
+
+        try:
+            start_time = time.time()
+            if video_downloaded:
                 output_file = os.path.join(self.output_dir, f'{sanitized_video_title}.mp4')
-                command = [
-                    get_ffmpeg_path(), '-y', '-i', video_filename, '-i', audio_filename,
-                    '-c:v', 'copy', '-c:a', 'aac', '-strict', 'experimental', output_file
-                ]
-                try:
-                    # Add creationflags to prevent command prompt from appearing on Windows
-                    if sys.platform == "win32":
-                        subprocess.run(command, check=True, capture_output=True, encoding='utf-8', creationflags=subprocess.CREATE_NO_WINDOW)
-                    else:
-                        subprocess.run(command, check=True, capture_output=True, encoding='utf-8')
-                    os.remove(video_filename) # Clean up temp files
-                    os.remove(audio_filename)
-                    return {"success": True, "message": "视频和音频合并完成。"}
-                except subprocess.CalledProcessError as e:
-                    return {"success": False, "error": f"合并视频和音频时发生错误：{e.stderr}"}
+                inputs = [video_filename, audio_filename] if audio_downloaded else [video_filename]
+                remuxed = remux(inputs, output_file)
             else:
-                # If ffmpeg is not available, save video and audio separately
-                print("FFmpeg is not available. Saving video and audio separately.")
-                # Rename video file to .mp4 if it's .flv (assuming it's a video stream)
-                if video_filename.endswith('.flv'):
-                    final_video_path = os.path.join(self.output_dir, f'{sanitized_video_title}_video.mp4')
-                    os.rename(video_filename, final_video_path)
-                # Rename audio file to .mp3
-                if audio_filename.endswith('.mp3'):
-                    final_audio_path = os.path.join(self.output_dir, f'{sanitized_video_title}_audio.mp3')
-                    os.rename(audio_filename, final_audio_path)
-                return {"success": True, "message": "FFmpeg未找到，视频和音频已单独下载。"}
+                # 纯音频：整理为普通 MP4 封装（或该编码对应的容器），流复制不重新编码
+                audio_codec = audio_codec or self._probe_audio_codec(audio_filename)
+                output_file = os.path.join(self.output_dir, f'{sanitized_video_title}.{audio_extension(audio_codec)}')
+                remuxed = remux([audio_filename], output_file, stream_types=('audio',))
+        except (RuntimeError, ValueError) as e:
+            return {"success": False, "error": f"合并视频和音频时发生错误：{e}"}
+        for path in (video_filename, audio_filename):
+            if os.path.exists(path):
+                os.remove(path) # Clean up temp files
+        modes = ", ".join(f"{stream['codec_type']}={stream['codec_name']}:{stream['mode']}" for stream in remuxed['streams'])
+        print(f"封装完成 {os.path.basename(output_file)} ({modes}), {time.time() - start_time:.2f}s")
+
+        if video_downloaded and audio_downloaded:
+            message = "视频和音频合并完成。"
         elif video_downloaded:
-            final_video_path = os.path.join(self.output_dir, f'{sanitized_video_title}.mp4')
-            os.rename(video_filename, final_video_path)
-            return {"success": True, "message": "仅下载了视频。"}
-        elif audio_downloaded:
-            return {"success": True, "message": "仅下载了音频。"}
+            message = "仅下载了视频。"
+        else:
+            message = "仅下载了音频。"
+        return {"success": True, "message": message, "path": output_file, "streams": remuxed['streams']}
+
+    @staticmethod
+    def _dash_audio_codec(audio_stream):
+        """根据 DASH 清单中的 codecs 字段判断音频编码（mp4a -> aac，fLaC -> flac，ec-3 -> eac3）"""
+        codecs = (audio_stream.get('codecs') or '').lower()
+        if codecs.startswith('mp4a'):
+            return 'aac'
+        if codecs.startswith('flac'):
+            return 'flac'
+        if codecs.startswith('ec-3'):
+            return 'eac3'
+        if codecs.startswith('ac-3'):
+            return 'ac3'
+        return None
+
+    @staticmethod
+    def _probe_audio_codec(path):
+        for stream in probe(path)['streams']:
+            if stream['codec_type'] == 'audio':
+                return stream['codec_name']
+        return None
     async def get_api_data(self, url):
         try:
-            async with aiohttp.ClientSession(headers=headers, cookies=cookies_dict) as session:
-                async with session.get(url, timeout=10) as response:
-                    response.raise_for_status()
-                    return await response.json()
+            session = self.http.aio_session()
+            async with session.get(url, headers=headers, cookies=cookies_dict) as response:
+                response.raise_for_status()
+                return await response.json()
         except aiohttp.ClientError as e:
             print(f"API请求失败: {str(e)}")
             return None
         except asyncio.TimeoutError:
             print(f"API请求超时: {url}")
+    async def _fetch_video_view(self, bvid):
+        data = await self.get_api_data(f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}")
+        if data is None:
+            return None
+        if data.get('code') != 0 or not data.get('data'):
+            print(f"获取视频信息失败: {data.get('message', '未知错误')}")
+            return None
+        return data['data']
+
+    async def get_video_view(self, bvid):
+        """获取视频基础信息（view 接口的 data 字段），失败返回 None；结果有缓存"""
+        return await self.video_views.get(bvid)
+
+    async def get_video_views(self, bvids):
+        """按顺序批量获取多个视频的基础信息，只请求缓存中没有的 bvid"""
+        return await self.video_views.get_many(bvids)
+
     async def whether_collection(self, bvid):
         # 获取视频基础信息
         print('bvid:', bvid)
-        base_api = f"https://api.bilibili.com/x/web-interface/view?bvid={bvid}"
-        data = await self.get_api_data(base_api)
-        if data is None:
+        video_data = await self.get_video_view(bvid)
+        if video_data is None:
             return None
         try:
-            if data.get('code') != 0 or not data.get('data'):
-                print(f"获取视频信息失败: {data.get('message', '未知错误')}")
-                return None
-
-            video_data = data['data']
-
             # 直接检查 ugc_season 字段判断是否为合集
             ugc_season = video_data.get('ugc_season')
 
@@ -263,47 +377,63 @@ class BiliVideoDownloader:
             print(f"数据结构解析错误: {str(e)}")
             return None
 
-    def get_collection_videos(self, mid, season_id, page_num=1, page_size=50):
-        """
-        获取指定合集中的视频列表
-        """
-        api_url = "https://api.bilibili.com/x/polymer/web-space/seasons_archives_list"
+    async def _get_collection_page(self, mid, season_id, page_num, page_size=COLLECTION_PAGE_SIZE):
+        """异步获取合集的一页，返回接口的 data 字段（archives / meta / page）"""
         params = {
             "mid": mid,
             "season_id": season_id,
             "page_num": page_num,
             "page_size": page_size,
-            "sort_reverse": "false" 
+            "sort_reverse": "false"
         }
+        data = await self.get_api_data(
+            f"https://api.bilibili.com/x/polymer/web-space/seasons_archives_list?{urlencode(params)}"
+        )
+        if data is None:
+            raise IOError(f"获取合集第 {page_num} 页失败")
+        if data.get('code') != 0 or not data.get('data'):
+            raise IOError(f"获取合集第 {page_num} 页失败: {data.get('message', '未知错误')}")
+        return data['data']
 
+    async def iter_collection_videos(self, mid, season_id, page_size=COLLECTION_PAGE_SIZE):
+        """
+        逐页产出合集中的视频：先取第一页得到总数，其余页面以有限的并发同时请求，
+        哪一页先返回就先产出哪一页（页码可能乱序）。取完后整个列表按 (mid, season_id) 缓存
+        :return: 异步生成器，每次产出 {'page_num', 'items', 'meta', 'total', 'page_count'}
+        """
+        key = (mid, season_id)
+        cached = self.collection_listings.peek(key)
+        if cached is not None:
+            yield {"page_num": 1, "page_count": 1, **cached}
+            return
+
+        first = await self._get_collection_page(mid, season_id, 1, page_size)
+        meta = first.get('meta') or {}
+        items = first.get('archives') or []
+        total = (first.get('page') or {}).get('total') or meta.get('total') or len(items)
+        page_count = max(1, -(-total // page_size))
+        yield {"page_num": 1, "items": items, "meta": meta, "total": total, "page_count": page_count}
+
+        pages = {1: items}
+        semaphore = asyncio.Semaphore(max(1, int(config_manager.get('collectionPageConcurrency', DEFAULT_COLLECTION_CONCURRENCY))))
+
+        async def fetch(page_num):
+            async with semaphore:
+                return page_num, await self._get_collection_page(mid, season_id, page_num, page_size)
+
+        tasks = [asyncio.ensure_future(fetch(page_num)) for page_num in range(2, page_count + 1)]
         try:
-            # Add Referer header as required by the API
-            collection_headers = headers.copy()
-            collection_headers["Referer"] = "https://www.bilibili.com/"
-
-            print(f"get_collection_videos called with mid={mid}, season_id={season_id}")
-
-            response = requests.get(
-                api_url,
-                params=params,
-                headers=collection_headers,
-                cookies=cookies_dict
-            )
-            response.raise_for_status()
-            data = response.json()
-            # print(f"获取合集视频列表: {data}")
-            if data.get('code') == 0 and data.get('data'):
-                return {"success": True, "items": data.get('data').get('archives', []), "meta": data.get('data').get('meta', {})}
-            else:
-                return {"success": False, "error": data.get('message', '未知错误')}
-
-        except requests.exceptions.RequestException as e:
-            print(f"API请求失败: {str(e)}")
-            return {"success": False, "error": str(e)}
-        except (KeyError, TypeError) as e:
-            print(f"数据结构解析错误: {str(e)}")
-            return {"success": False, "error": str(e)}
-
+            for next_page in asyncio.as_completed(tasks):
+                page_num, data = await next_page
+                pages[page_num] = data.get('archives') or []
+                yield {"page_num": page_num, "items": pages[page_num], "meta": meta, "total": total, "page_count": page_count}
+        finally:
+            # 调用方提前结束迭代或出错时取消未完成的请求
+            for task in tasks:
+                task.cancel()
+
+        listing = [item for page_num in sorted(pages) for item in pages[page_num]]
+        self.collection_listings.put(key, {"items": listing, "meta": meta, "total": total})
 
     def _sanitize_filename(self, filename):  
         """清理文件名中的非法字符""" 
@@ -312,7 +442,10 @@ class BiliVideoDownloader:
         return filename[:200]  # 限制文件名长度
         
 class YoutubeDownloader:
-    def __init__(self):  
+    def __init__(self, search_extractor=None):  
+        """
+        :param search_extractor: 可选的搜索后端（提供 open(keyword)），默认使用 yt_dlp
+        """
         self.output_dir = config_manager.get('defaultOutput', './output') # Use config_manager
         # Ensure the output directory exists
         os.makedirs(self.output_dir, exist_ok=True)
@@ -342,6 +475,19 @@ class YoutubeDownloader:
             }  
         }
         self.is_logged_in = True # Track login status
+        # 为搜索创建优化的、轻量级的配置
+        search_opts = {
+            'proxy': self.proxy,
+            'quiet': True,
+            'extract_flat': True,  
+            'skip_download': True,
+            'http_headers': self.ydl_opts.get('http_headers', {}),
+            'extractor_args': self.ydl_opts.get('extractor_args', {})
+        }
+        self.search_cursors = YoutubeSearchCursors(
+            search_extractor or YtDlpSearchExtractor(search_opts),
+            ttl=config_manager.get('youtubeSearchTTL', YOUTUBE_SEARCH_TTL)
+        )
 
     def _get_system_proxy(self):
         """从环境变量获取代理配置（保留原有代码）"""
@@ -354,21 +500,7 @@ class YoutubeDownloader:
         return None
 
     def search_videos(self, keyword, page=1, per_page=20):
-        """使用yt_dlp内置搜索功能，并支持分页（优化版）"""
-        
-        num_results_to_fetch = page * per_page
-        search_query = f"ytsearch{num_results_to_fetch}:{keyword}"
-
-        # 为搜索创建优化的、轻量级的配置
-        search_opts = {
-            'proxy': self.proxy,
-            'quiet': True,
-            'extract_flat': True,  
-            'skip_download': True,
-            'http_headers': self.ydl_opts.get('http_headers', {}),
-            'extractor_args': self.ydl_opts.get('extractor_args', {})
-        }
-
+        """使用yt_dlp内置搜索功能，并支持分页：按关键词保留搜索游标，翻页时只提取新增的条目"""
         for attempt in range(3):  # 最多尝试3次
             try:
                 if attempt > 0:
@@ -376,36 +508,24 @@ class YoutubeDownloader:
                     print(f"等待 {delay:.1f} 秒后重试...")
                     time.sleep(delay)
 
-                with yt_dlp.YoutubeDL(search_opts) as ydl:
-                    info = ydl.extract_info(search_query, download=False)
-                    if not info:
-                        print("未找到相关视频")
-                        return [], 0
-
-                    entries = info.get('entries', [])
-                    if not entries:
-                        return [], 0
-                        
-                    total_results = len(entries)
-
-                    start_index = (page - 1) * per_page
-                    end_index = start_index + per_page
-                    
-                    paged_entries = entries[start_index:min(end_index, total_results)]
-
-                    videos = []
-                    for entry in paged_entries:
-                        if not entry:
-                            continue
-                        video = {
-                            'title': entry.get('title', '无标题'),
-                            'duration': entry.get('duration'),
-                            'url': entry.get('webpage_url'),
-                            'id': entry.get('id'),
-                            'author': entry.get('uploader', '未知'),
-                        }
-                        videos.append(video)
-                    return videos, total_results
+                paged_entries, total_results, _ = self.search_cursors.page(keyword, page, per_page)
+                if not total_results:
+                    print("未找到相关视频")
+                    return [], 0
+
+                videos = []
+                for entry in paged_entries:
+                    if not entry:
+                        continue
+                    video = {
+                        'title': entry.get('title', '无标题'),
+                        'duration': entry.get('duration'),
+                        'url': entry.get('webpage_url') or f"https://www.youtube.com/watch?v={entry.get('id')}",
+                        'id': entry.get('id'),
+                        'author': entry.get('uploader') or entry.get('channel') or '未知',
+                    }
+                    videos.append(video)
+                return videos, total_results
 
             except Exception as e:
                 error_msg = str(e).lower()
@@ -439,43 +559,85 @@ class YoutubeDownloader:
             print(f"检查URL时出错: {e}")
             return False, None, None
 
-    def download_playlist(self, playlist_url):
-        """下载整个播放列表的音频"""
+    @staticmethod
+    def _progress_hook(on_progress=None, should_stop=None):
+        """
+        yt_dlp 的进度回调：转发字节进度，并在 should_stop() 为 True 时中止下载
+        （yt_dlp 默认保留 .part 文件，再次下载时会续传）
+        """
+        def hook(status):
+            if should_stop and should_stop():
+                raise yt_dlp.utils.DownloadCancelled()
+            if on_progress and status.get('status') in ('downloading', 'finished'):
+                info = status.get('info_dict') or {}
+                on_progress({
+                    "downloaded": status.get('downloaded_bytes') or 0,
+                    "total": status.get('total_bytes') or status.get('total_bytes_estimate') or 0,
+                    "speed": status.get('speed'),
+                    "title": info.get('title'),
+                    "filename": status.get('filename'),
+                    "playlist_index": info.get('playlist_index'),
+                    "playlist_count": info.get('n_entries')
+                })
+        return hook
+
+    def _download_opts(self, on_progress, should_stop, **overrides):
+        opts = {**self.ydl_opts, **overrides}
+        if on_progress or should_stop:
+            opts['progress_hooks'] = [self._progress_hook(on_progress, should_stop)]
+        return opts
+
+    def download_playlist(self, playlist_url, on_progress=None, should_stop=None):
+        """
+        下载整个播放列表：先提取扁平的条目列表，再分发给有上限的工作线程池逐个下载。
+        已下载过（在下载记录中或同名文件已存在）的条目直接跳过，失败的条目单独重试
+        :param on_progress: 可选回调，参数为整个播放列表的汇总进度字典
+        :param should_stop: 可选，返回 True 时中止下载并抛出 DownloadInterrupted
+        """
         try:
-            # 获取播放列表标题用于创建文件夹
+            # 获取播放列表标题和条目列表
             with yt_dlp.YoutubeDL({'proxy': self.proxy, 'quiet': True, 'extract_flat': True}) as ydl:
                 info = ydl.extract_info(playlist_url, download=False)
                 playlist_title = self._sanitize_filename(info.get('title', 'youtube_playlist'))
+            entries = [entry for entry in (info.get('entries') or []) if entry and entry.get('id')]
 
             playlist_dir = os.path.join(self.output_dir, playlist_title)
             os.makedirs(playlist_dir, exist_ok=True)
             
             print(f"播放列表将保存到: {playlist_dir}")
 
-            playlist_opts = self.ydl_opts.copy()
-            playlist_opts['outtmpl'] = os.path.join(playlist_dir, '%(title)s.%(ext)s')
-            playlist_opts['quiet'] = False # 显示下载进度
-
-            with yt_dlp.YoutubeDL(playlist_opts) as ydl:
-                ydl.download([playlist_url])
-            
-            print(f"播放列表 '{playlist_title}' 下载完成！")
-            return {"success": True, "message": f"播放列表 '{playlist_title}' 下载完成！"}
-
+            result = PlaylistDownload(self, entries, playlist_dir, on_progress, should_stop).run()
+        except DownloadInterrupted:
+            raise
         except Exception as e:
+            if should_stop and should_stop():
+                raise DownloadInterrupted() from e
             print(f"下载播放列表时出错: {e}")
             return {"success": False, "error": f"下载播放列表时出错: {e}"}
 
-    def download_video(self, video_url):
-        """下载视频"""
+        summary = (f"播放列表 '{playlist_title}': 完成 {result['completed']}，跳过 {result['skipped']}，"
+                   f"失败 {len(result['failed'])}，{result['speed'] / 1024 / 1024:.2f} MB/s")
+        print(summary)
+        if result['failed']:
+            return {"success": False, "error": summary, **result}
+        return {"success": True, "message": f"播放列表 '{playlist_title}' 下载完成！", **result}
+
+    def download_video(self, video_url, on_progress=None, should_stop=None):
+        """
+        下载视频
+        :param on_progress: 可选回调，参数为进度字典（downloaded / total / speed）
+        :param should_stop: 可选，返回 True 时中止下载并抛出 DownloadInterrupted
+        """
         os.makedirs(self.output_dir, exist_ok=True)
         
         try:
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
+            with yt_dlp.YoutubeDL(self._download_opts(on_progress, should_stop)) as ydl:
                 ydl.download([video_url])
             print("下载完成！文件保存在:", os.path.abspath(self.output_dir))
             return {"success": True, "message": "下载完成！"}
         except Exception as e:
+            if should_stop and should_stop():
+                raise DownloadInterrupted() from e
             error_message = f"下载失败: {str(e)}"
             if "ProxyError" in str(e):
                 error_message += "\n>>> 请检查代理设置是否正确 <<<"
@@ -486,5 +648,145 @@ class YoutubeDownloader:
             return {"success": False, "error": error_message}
 
 
+class PlaylistDownload:
+    """
+    播放列表的并行下载：条目分发给 youtubePlaylistWorkers 个工作线程，每个条目独立下载、
+    失败后按退避时间重试 youtubePlaylistRetries 次；已完成的条目记录在目录下的下载记录中，
+    重新下载同一个播放列表时跳过。汇总进度包含整体吞吐量（字节/秒）
+    """
+
+    ARCHIVE_NAME = '.downloaded.txt'
+    PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp')
+
+    def __init__(self, downloader, entries, playlist_dir, on_progress=None, should_stop=None):
+        self.downloader = downloader
+        self.entries = entries
+        self.playlist_dir = playlist_dir
+        self.on_progress = on_progress
+        self.should_stop = should_stop
+        self.workers = max(1, int(config_manager.get('youtubePlaylistWorkers', DEFAULT_PLAYLIST_WORKERS)))
+        self.retries = max(0, int(config_manager.get('youtubePlaylistRetries', DEFAULT_PLAYLIST_RETRIES)))
+        self.archive_path = os.path.join(playlist_dir, self.ARCHIVE_NAME)
+        self._lock = threading.Lock()
+        self._bytes = {}  # (条目ID, 文件名) -> 已下载字节
+        self._active = {}  # 条目ID -> 标题
+        self.completed = 0
+        self.skipped = 0
+        self.failed = []
+        self.start_time = None
+
+    def _stopped(self):
+        return bool(self.should_stop and self.should_stop())
+
+    def _archived_ids(self):
+        try:
+            with open(self.archive_path, 'r', encoding='utf-8') as f:
+                return {line.split()[-1] for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def _file_exists(self, entry):
+        """目录中已有与条目标题同名的完整文件（下载记录出现之前下载的文件）"""
+        title = entry.get('title')
+        if not title:
+            return False
+        stem = yt_dlp.utils.sanitize_filename(title)
+        for name in os.listdir(self.playlist_dir):
+            base, ext = os.path.splitext(name)
+            if base == stem and ext not in self.PARTIAL_SUFFIXES:
+                return True
+        return False
+
+    def _item_opts(self, entry):
+        def on_item_progress(progress):
+            with self._lock:
+                self._bytes[(entry['id'], progress.get('filename'))] = progress['downloaded']
+            self._report()
+        return self.downloader._download_opts(
+            on_item_progress, self.should_stop,
+            outtmpl=os.path.join(self.playlist_dir, '%(title)s.%(ext)s'),
+            download_archive=self.archive_path,
+            # 并发数本身就是限速手段，条目之间不再额外等待
+            sleep_interval=0
+        )
+
+    def _download_item(self, entry):
+        url = entry.get('url') or f"https://www.youtube.com/watch?v={entry['id']}"
+        title = entry.get('title') or entry['id']
+        for attempt in range(self.retries + 1):
+            if self._stopped():
+                raise DownloadInterrupted()
+            with self._lock:
+                self._active[entry['id']] = title
+            try:
+                with yt_dlp.YoutubeDL(self._item_opts(entry)) as ydl:
+                    ydl.download([url])
+                with self._lock:
+                    self.completed += 1
+                return
+            except Exception as e:
+                if self._stopped():
+                    raise DownloadInterrupted() from e
+                with self._lock:
+                    # 重试时 yt_dlp 从 .part 文件续传，已计入的字节由新的进度覆盖
+                    for key in [key for key in self._bytes if key[0] == entry['id']]:
+                        self._bytes.pop(key)
+                if attempt == self.retries:
+                    print(f"条目下载失败 {title}: {e}")
+                    with self._lock:
+                        self.failed.append({"id": entry['id'], "title": title, "error": str(e)})
+                    return
+                delay = 2 ** attempt + random.uniform(0, 1)
+                print(f"条目下载失败 {title}，{delay:.1f} 秒后重试 ({attempt + 1}/{self.retries}): {e}")
+                time.sleep(delay)
+            finally:
+                with self._lock:
+                    self._active.pop(entry['id'], None)
+                self._report()
+
+    def _snapshot(self):
+        with self._lock:
+            downloaded = sum(self._bytes.values())
+            elapsed = max(time.time() - self.start_time, 1e-6)
+            return {
+                "total_items": len(self.entries),
+                "completed": self.completed,
+                "skipped": self.skipped,
+                "failed": list(self.failed),
+                "active": list(self._active.values()),
+                "downloaded": downloaded,
+                "elapsed": round(elapsed, 2),
+                "speed": round(downloaded / elapsed),
+                "workers": self.workers,
+            }
+
+    def _report(self):
+        if self.on_progress:
+            self.on_progress(self._snapshot())
+
+    def run(self):
+        self.start_time = time.time()
+        archived = self._archived_ids()
+        pending = []
+        for entry in self.entries:
+            if entry['id'] in archived or self._file_exists(entry):
+                self.skipped += 1
+            else:
+                pending.append(entry)
+        self._report()
+        if pending:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+                futures = [pool.submit(self._download_item, entry) for entry in pending]
+                interrupted = None
+                for future in futures:
+                    try:
+                        future.result()
+                    except DownloadInterrupted as e:
+                        interrupted = e
+                if interrupted:
+                    raise interrupted
+        return self._snapshot()
+
+
 if __name__ == "__main__":
     pass # No direct execution needed for research_videos.py anymore
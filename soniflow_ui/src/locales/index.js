@@ -53,6 +53,17 @@ const messages = {
       unknownError: '未知错误',
       conversionFailed: '转换失败: {error}',
       processing: '正在处理...',
+      batchTitle: '批量转换目录',
+      batchButton: '选择目录并转换',
+      batchComplete: '批量转换完成：转换 {done} 个，跳过 {skipped} 个（{filesPerSecond} 个/秒，{mbPerSecond} MB/秒）',
+      fileStatus: {
+        pending: '等待中',
+        running: '转换中',
+        done: '完成',
+        skipped: '已是最新，跳过',
+        failed: '失败',
+        cancelled: '已取消',
+      },
     },
     spleeter: {
       model2Stems: '2 stems (人声/伴奏)',
@@ -79,6 +90,12 @@ const messages = {
       serverConnectionFailed: '服务器连接失败',
       unknownSize: '未知大小',
       uploadSuccessAndProcessing: '上传成功，开始处理音频文件...',
+      phase_model_load: '加载模型',
+      phase_decode: '解码',
+      phase_inference: '分离推理',
+      phase_encode: '编码',
+      phase_cache: '读取缓存',
+      realtimeFactor: '实时倍率',
     },
     search: {
       searchLabel: '搜索{platform}视频',
@@ -90,6 +107,7 @@ const messages = {
       notAvailable: 'N/A',
       downloading: '下载中...',
       downloadVideo: '下载视频',
+      downloadAudioOnly: '仅下载音频',
       downloadPlaylist: '下载播放列表',
       videoCollection: '视频选集',
       duration: '时长',
@@ -241,6 +259,17 @@ const messages = {
       unknownError: 'Unknown error',
       conversionFailed: 'Conversion failed: {error}',
       processing: 'Processing...',
+      batchTitle: 'Convert a Folder',
+      batchButton: 'Choose Folder and Convert',
+      batchComplete: 'Batch conversion finished: {done} converted, {skipped} skipped ({filesPerSecond} files/s, {mbPerSecond} MB/s)',
+      fileStatus: {
+        pending: 'Pending',
+        running: 'Converting',
+        done: 'Done',
+        skipped: 'Up to date, skipped',
+        failed: 'Failed',
+        cancelled: 'Cancelled',
+      },
     },
     spleeter: {
       model2Stems: '2 stems (Vocals/Accompaniment)',
@@ -267,6 +296,12 @@ const messages = {
       serverConnectionFailed: 'Server connection failed',
       unknownSize: 'Unknown Size',
       uploadSuccessAndProcessing: 'Upload successful, starting audio file processing...',
+      phase_model_load: 'Loading model',
+      phase_decode: 'Decoding',
+      phase_inference: 'Separating',
+      phase_encode: 'Encoding',
+      phase_cache: 'Reading cache',
+      realtimeFactor: 'Realtime factor',
     },
     search: {
       searchLabel: 'Search {platform} videos',
@@ -278,6 +313,7 @@ const messages = {
       notAvailable: 'N/A',
       downloading: 'Downloading...',
       downloadVideo: 'Download Video',
+      downloadAudioOnly: 'Audio Only',
       downloadPlaylist: 'Download Playlist',
       videoCollection: 'Video Collection',
       duration: 'Duration',
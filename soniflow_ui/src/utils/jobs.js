@@ -0,0 +1,50 @@
+/**
+ * utils/jobs.js
+ *
+ * Long-running backend calls return a job handle ({ success, job_id }) instead of
+ * blocking the pywebview bridge. waitForJob polls get_job_status until the job
+ * finishes and resolves with the job's result, i.e. what the call used to return.
+ */
+
+const DEFAULT_POLL_INTERVAL = 500 // ms
+
+export async function waitForJob (jobId, { interval = DEFAULT_POLL_INTERVAL, onProgress, poll } = {}) {
+  const getStatus = poll || (id => window.pywebview.api.get_job_status(id))
+  while (true) {
+    const status = await getStatus(jobId)
+    if (!status.success) {
+      return { success: false, error: status.error }
+    }
+    if (onProgress && status.progress) {
+      onProgress(status.progress, status)
+    }
+    if (status.done) {
+      if (status.status === 'cancelled') {
+        return { success: false, cancelled: true, error: 'cancelled' }
+      }
+      return status.result || { success: status.status === 'succeeded', error: status.error }
+    }
+    await new Promise(resolve => setTimeout(resolve, interval))
+  }
+}
+
+// Submit a job-returning API call and wait for its result
+export async function runJob (handlePromise, options) {
+  const handle = await handlePromise
+  if (!handle || !handle.success || !handle.job_id) {
+    return handle
+  }
+  return waitForJob(handle.job_id, options)
+}
+
+// Downloads go through the persistent download queue and return a download_id
+export async function runDownload (handlePromise, options = {}) {
+  const handle = await handlePromise
+  if (!handle || !handle.success || !handle.download_id) {
+    return handle
+  }
+  return waitForJob(handle.download_id, {
+    ...options,
+    poll: id => window.pywebview.api.get_download_status(id),
+  })
+}
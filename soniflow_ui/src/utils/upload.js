@@ -0,0 +1,70 @@
+/**
+ * utils/upload.js
+ *
+ * Uploads a File/Blob to the backend in binary chunks through the Flask /upload/
+ * routes instead of sending the whole file as base64 over the pywebview bridge.
+ * Each chunk carries its SHA-256 so the backend can reject corrupted chunks, failed
+ * chunks are retried from the offset the backend reports, and calling uploadFile
+ * again for the same file resumes an interrupted upload.
+ * Resolves with { success, path, name, size, sha256 } like upload_file_stream.
+ */
+
+const UPLOAD_BASE = 'http://localhost:5000/upload'
+const MAX_RETRIES = 3
+const RETRY_DELAY = 1000 // ms, multiplied by the attempt number
+
+async function requestJson (url, options = {}) {
+  const response = await fetch(url, options)
+  try {
+    return await response.json()
+  } catch {
+    return { success: false, error: `HTTP ${response.status}` }
+  }
+}
+
+async function sha256Hex (buffer) {
+  // crypto.subtle is only available in secure contexts; the backend treats the header as optional
+  if (!window.crypto?.subtle) return null
+  const digest = await window.crypto.subtle.digest('SHA-256', buffer)
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('')
+}
+
+export async function uploadFile (file, { name = file.name, onProgress } = {}) {
+  const fingerprint = `${name}:${file.size}:${file.lastModified ?? ''}`
+  const begin = await requestJson(`${UPLOAD_BASE}/begin`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ name, size: file.size, fingerprint }),
+  })
+  if (!begin.success) return begin
+
+  const uploadId = begin.upload_id
+  let offset = begin.received
+  let attempt = 0
+  onProgress?.(offset, file.size)
+  while (offset < file.size) {
+    // Only the current chunk is held in memory
+    const chunk = await file.slice(offset, offset + begin.chunk_size).arrayBuffer()
+    const headers = { 'Content-Type': 'application/octet-stream' }
+    const digest = await sha256Hex(chunk)
+    if (digest) headers['X-Chunk-SHA256'] = digest
+    let result
+    try {
+      result = await requestJson(`${UPLOAD_BASE}/${uploadId}?offset=${offset}`, { method: 'PUT', headers, body: chunk })
+    } catch (error) {
+      result = { success: false, error: error.message }
+    }
+    if (result.success) {
+      offset = result.received
+      attempt = 0
+      onProgress?.(offset, file.size)
+      continue
+    }
+    if (++attempt > MAX_RETRIES) return result
+    // Continue from the position the backend has confirmed
+    if (Number.isInteger(result.received)) offset = result.received
+    await new Promise(resolve => setTimeout(resolve, RETRY_DELAY * attempt))
+  }
+
+  return requestJson(`${UPLOAD_BASE}/${uploadId}/finish`, { method: 'POST' })
+}
@@ -2,9 +2,22 @@
 import os
 import sys
 import json
+import subprocess
 import tempfile
+import threading
+import time
+from contextlib import contextmanager
 # 确保 utils.py 中的 resource_path 函数是正确的
-from utils import resource_path
+from utils import resource_path, find_ffmpeg
+from file_registry import clone_file
+
+# 输出文件命名格式：<输出目录>/<输入文件名>/<音轨>.<编码>
+FILENAME_FORMAT = '{filename}/{instrument}.{codec}'
+# 单个文件最多处理的时长（秒），与 Separator.separate_to_file 的默认值一致
+MAX_DURATION = 600.0
+# 分段分离的默认窗口长度与相邻窗口的重叠长度（秒）
+DEFAULT_WINDOW_SECONDS = 120.0
+DEFAULT_OVERLAP_SECONDS = 2.0
 
 def _get_spleeter_model_path_for_separator(stems: int):
     """
@@ -56,13 +69,141 @@ def _get_spleeter_model_path_for_separator(stems: int):
         return model_string
 
 
+class _StemWriter:
+    """通过 ffmpeg 管道增量编码一条音轨，内存中只保留当前写入的数据块"""
+
+    def __init__(self, path, sample_rate, channels, codec, bitrate, source='-'):
+        """
+        :param source: '-' 表示从 write() 写入的数据编码；也可以是已有的 f32le 原始音频文件
+        """
+        ffmpeg = find_ffmpeg()
+        if not ffmpeg:
+            raise FileNotFoundError("未找到 ffmpeg，无法写入分离结果")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        command = [
+            ffmpeg, '-y', '-v', 'error',
+            '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(channels), '-i', source
+        ]
+        if codec not in ('wav', 'flac'):
+            command += ['-b:a', bitrate]
+        command += ['-strict', '-2', path]
+        creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+        self.path = path
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE if source == '-' else subprocess.DEVNULL,
+            stderr=subprocess.PIPE, creationflags=creationflags
+        )
+        # stderr 在另一个线程中读取，避免管道写满后 ffmpeg 阻塞（同时阻塞 write()）
+        self._stderr_chunks = []
+        self._stderr_reader = threading.Thread(
+            target=lambda: self._stderr_chunks.append(self.process.stderr.read()), daemon=True
+        )
+        self._stderr_reader.start()
+
+    def write(self, data):
+        import numpy as np
+        if len(data):
+            self.process.stdin.write(np.ascontiguousarray(data, dtype='<f4').tobytes())
+
+    def close(self):
+        if self.process.stdin:
+            self.process.stdin.close()
+        self.process.wait()
+        self._stderr_reader.join(timeout=5)
+        stderr = b''.join(self._stderr_chunks).decode('utf-8', errors='replace')
+        if self.process.returncode != 0:
+            raise RuntimeError(f"编码 {self.path} 失败: {stderr.strip()}")
+
+
+class SeparationProgress:
+    """
+    记录一次分离任务各阶段（model_load / decode / inference / encode）的累计耗时与已处理的音频时长，
+    每次阶段切换或处理进度推进时以快照调用回调
+    """
+
+    def __init__(self, callback=None, duration=None):
+        self.callback = callback
+        self.duration = duration  # 输入音频总时长（秒），未知时为 None
+        self.start_time = time.time()
+        self.phase = None
+        self.timings = {}
+        self.audio_seconds = 0.0
+
+    @contextmanager
+    def track(self, phase):
+        """统计 with 块的耗时并计入 phase 阶段"""
+        previous = self.phase
+        self.phase = phase
+        self._emit()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0.0) + time.time() - start_time
+            self.phase = previous
+
+    def advance(self, audio_seconds):
+        """已处理的音频时长增加 audio_seconds 秒"""
+        self.audio_seconds += audio_seconds
+        self._emit()
+
+    def snapshot(self):
+        elapsed = time.time() - self.start_time
+        inference = self.timings.get('inference', 0.0)
+        return {
+            "phase": self.phase,
+            "elapsed": round(elapsed, 2),
+            "timings": {phase: round(seconds, 2) for phase, seconds in self.timings.items()},
+            "audio_seconds": round(self.audio_seconds, 2),
+            "duration": round(self.duration, 2) if self.duration else None,
+            "percent": round(min(self.audio_seconds / self.duration, 1.0) * 100, 1) if self.duration else None,
+            # 整体和纯推理的实时倍率（处理的音频秒数 / 耗时秒数）
+            "realtime_factor": round(self.audio_seconds / max(elapsed, 1e-6), 2),
+            "inference_realtime_factor": round(self.audio_seconds / inference, 2) if inference else None
+        }
+
+    def _emit(self):
+        if self.callback:
+            self.callback(self.snapshot())
+
+
+def _probe_duration(input_file):
+    """用 ffprobe 读取音频时长（秒），失败时返回 None"""
+    try:
+        import ffmpeg  # spleeter 的依赖 ffmpeg-python
+        return float(ffmpeg.probe(input_file)['format']['duration'])
+    except Exception:
+        return None
+
+
 class SpleeterPart:
-    def __init__(self):
-        self.separator = None
-        self.temp_config_path = None # 用于追踪临时文件，以便后续清理
+    def __init__(self, keep_loaded=False, stem_cache=None):
+        """
+        :param keep_loaded: 为 True 时处理完成后保留已加载的模型，供后续任务复用
+        :param stem_cache: 可选的 StemCache，命中时跳过推理
+        """
+        self.separators = {} # stems -> Separator，每种模型最多加载一次
+        self.temp_config_paths = {} # stems -> 临时配置文件，用于后续清理
+        self.last_used = {} # stems -> 最近一次使用的时间戳
+        self.keep_loaded = keep_loaded
+        self.stem_cache = stem_cache
+        self.last_cache_hit = None # 最近一次 separate() 的缓存命中情况：'encoded' / 'raw' / None
+        self.on_progress = None # 可选回调，接收 SeparationProgress.snapshot() 字典
+        self.progress = SeparationProgress() # 当前（或最近一次）任务的进度
+
+    @property
+    def separator(self):
+        """最近使用的 Separator（兼容旧代码）"""
+        if not self.last_used:
+            return None
+        return self.separators.get(max(self.last_used, key=self.last_used.get))
 
     def _get_separator(self, stems):
-        # 无论是否已有separator，都根据stems重新获取或确认
+        # 已加载的模型直接复用，跳过 TensorFlow 图构建和模型加载
+        if stems in self.separators:
+            self.last_used[stems] = time.time()
+            return self.separators[stems]
+
         from spleeter.separator import Separator
 
         # 获取模型路径或字符串
@@ -70,60 +211,366 @@ class SpleeterPart:
 
         # 如果返回的是一个临时文件路径（打包模式），我们就记录下来以便清理
         if os.path.exists(model_path_or_string) and model_path_or_string.endswith('.json'):
-            # 如果之前有旧的临时文件，先清理掉
-            if self.temp_config_path and self.temp_config_path != model_path_or_string:
-                self._cleanup_temp_config()
-            self.temp_config_path = model_path_or_string
+            self.temp_config_paths[stems] = model_path_or_string
         
         # 使用路径或字符串来初始化 Separator
         # 这里的 model_path_or_string 可能是 'spleeter:2stems' 或一个临时文件的路径
-        self.separator = Separator(model_path_or_string)
+        with self.progress.track('model_load'):
+            self.separators[stems] = Separator(model_path_or_string)
+        self.last_used[stems] = time.time()
         
-        print("[Spleeter Subprocess] Spleeter Separator initialized successfully.")
-        return self.separator
+        print(f"[Spleeter Subprocess] Spleeter Separator ({stems}stems) initialized successfully.")
+        return self.separators[stems]
         
-    def _cleanup_temp_config(self):
+    def _cleanup_temp_config(self, stems):
         """清理临时配置文件"""
-        if self.temp_config_path and os.path.exists(self.temp_config_path):
+        temp_config_path = self.temp_config_paths.pop(stems, None)
+        if temp_config_path and os.path.exists(temp_config_path):
             try:
-                os.remove(self.temp_config_path)
-                print(f"[Spleeter Subprocess] Cleaned up temporary config file: {self.temp_config_path}")
+                os.remove(temp_config_path)
+                print(f"[Spleeter Subprocess] Cleaned up temporary config file: {temp_config_path}")
             except Exception as e:
                 print(f"[Spleeter Subprocess] Warning: Failed to clean up temp config file: {e}")
-            finally:
-                self.temp_config_path = None # 清理后重置
 
     def _process(self, stems, input_file, output_dir, codec, bitrate):
-        """统一处理方法"""
+        """
+        统一处理方法
+        :return: 输出文件路径列表
+        """
+        from spleeter.audio.adapter import AudioAdapter
+
         try:
             separator = self._get_separator(stems)
-            separator.separate_to_file(
-                input_file,
-                output_dir,
-                codec=codec,
-                bitrate=bitrate,
-                filename_format='{filename}/{instrument}.{codec}'
-            )
+            # 与 separate_to_file 相同的流程，拆开以便分别统计解码、推理和编码耗时
+            audio_adapter = AudioAdapter.default()
+            sample_rate = separator._params['sample_rate']
+            with self.progress.track('decode'):
+                waveform, _ = audio_adapter.load(
+                    input_file, offset=0, duration=MAX_DURATION, sample_rate=sample_rate
+                )
+            with self.progress.track('inference'):
+                sources = separator.separate(waveform, input_file)
+            with self.progress.track('encode'):
+                separator.save_to_file(
+                    sources, input_file, output_dir, FILENAME_FORMAT,
+                    codec, audio_adapter, bitrate, True
+                )
+            self.progress.advance(waveform.shape[0] / sample_rate)
+            self.last_used[stems] = time.time()
             print("[Spleeter Subprocess] Separation completed.")
+            return self._output_files(separator._params['instrument_list'], input_file, output_dir, codec)
         finally:
-            # 每次处理完都清理资源，确保下次调用可以重新初始化
-            self.release()
+            # 未开启模型常驻时，每次处理完都清理资源
+            if not self.keep_loaded:
+                self.release()
+
+    @staticmethod
+    def _output_files(instruments, input_file, output_dir, codec):
+        filename = os.path.splitext(os.path.basename(input_file))[0]
+        return [
+            os.path.join(output_dir, FILENAME_FORMAT.format(filename=filename, instrument=instrument, codec=codec))
+            for instrument in instruments
+        ]
+
+    def separate_batch(self, stems, input_files, output_dir, codec, bitrate, on_result=None, prefetch=2):
+        """
+        批量分离：模型只加载一次，后台线程提前解码后续文件，与当前文件的推理重叠
+        :param input_files: 输入文件路径列表
+        :param on_result: 可选回调，每个文件完成后以结果字典调用
+        :param prefetch: 最多提前解码的文件数，同时也是解码线程数
+        :return: 汇总结果（文件数、耗时、吞吐量）
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from spleeter.audio.adapter import AudioAdapter
+
+        if stems not in (2, 4, 5):
+            raise ValueError("无效的分离模型类型")
+        prefetch = max(1, int(prefetch))
+        separator = self._get_separator(stems)
+        audio_adapter = AudioAdapter.default()
+        sample_rate = separator._params['sample_rate']
+
+        def decode(input_file):
+            start_time = time.time()
+            waveform, _ = audio_adapter.load(
+                input_file, offset=0, duration=MAX_DURATION, sample_rate=sample_rate
+            )
+            return waveform, time.time() - start_time
+
+        batch_start = time.time()
+        total_audio = 0.0
+        succeeded = 0
+        try:
+            with ThreadPoolExecutor(max_workers=prefetch) as pool:
+                futures = {}
+
+                def schedule(index):
+                    if index < len(input_files):
+                        futures[index] = pool.submit(decode, input_files[index])
+
+                for index in range(prefetch):
+                    schedule(index)
+
+                for index, input_file in enumerate(input_files):
+                    # 当前文件推理时，后续文件已在解码线程中加载
+                    schedule(index + prefetch)
+                    item = {"index": index, "input": input_file}
+                    try:
+                        waveform, decode_time = futures.pop(index).result()
+                        start_time = time.time()
+                        sources = separator.separate(waveform, input_file)
+                        inference_time = time.time() - start_time
+                        start_time = time.time()
+                        separator.save_to_file(
+                            sources, input_file, output_dir, FILENAME_FORMAT,
+                            codec, audio_adapter, bitrate, True
+                        )
+                        encode_time = time.time() - start_time
+                        audio_duration = waveform.shape[0] / sample_rate
+                        total_audio += audio_duration
+                        succeeded += 1
+                        item.update({
+                            "success": True,
+                            "output_files": self._output_files(
+                                separator._params['instrument_list'], input_file, output_dir, codec
+                            ),
+                            "audio_duration": round(audio_duration, 2),
+                            "decode_time": round(decode_time, 2),
+                            "inference_time": round(inference_time, 2),
+                            "encode_time": round(encode_time, 2),
+                            "realtime_factor": round(audio_duration / max(inference_time + encode_time, 1e-6), 1)
+                        })
+                    except Exception as e:
+                        item.update({"success": False, "error": str(e), "error_type": type(e).__name__})
+                    self.last_used[stems] = time.time()
+                    if on_result:
+                        on_result(item)
+        finally:
+            if not self.keep_loaded:
+                self.release()
+
+        elapsed = time.time() - batch_start
+        return {
+            "files": len(input_files),
+            "succeeded": succeeded,
+            "failed": len(input_files) - succeeded,
+            "elapsed": round(elapsed, 1),
+            "files_per_minute": round(len(input_files) * 60 / max(elapsed, 1e-6), 2),
+            "realtime_factor": round(total_audio / max(elapsed, 1e-6), 1)
+        }
+
+    def separate_windowed(self, stems, input_file, output_dir, codec, bitrate,
+                          window_seconds=DEFAULT_WINDOW_SECONDS, overlap_seconds=DEFAULT_OVERLAP_SECONDS,
+                          cache_entry=None, max_duration=None):
+        """
+        分段分离：按重叠窗口逐段解码、分离，在接缝处对各音轨做线性交叉淡化并增量写入，
+        内存占用只取决于窗口长度，默认不受 MAX_DURATION 限制
+        :param window_seconds: 窗口长度（秒），越大越快、内存越高
+        :param overlap_seconds: 相邻窗口的重叠长度（秒），小于窗口长度的一半，可以为 0
+        :param cache_entry: 可选，同时把原始浮点音轨写入 stem_cache 的该条目
+        :param max_duration: 可选，最多处理的时长（秒）
+        :return: 输出文件路径列表
+        """
+        import numpy as np
+        from spleeter.audio.adapter import AudioAdapter
+
+        if overlap_seconds * 2 >= window_seconds:
+            raise ValueError("重叠长度必须小于窗口长度的一半")
+        try:
+            separator = self._get_separator(stems)
+            audio_adapter = AudioAdapter.default()
+            sample_rate = separator._params['sample_rate']
+            overlap_frames = int(overlap_seconds * sample_rate)
+            instruments = separator._params['instrument_list']
+            output_files = self._output_files(instruments, input_file, output_dir, codec)
+            raw = None
+            if cache_entry is not None:
+                raw = self.stem_cache.raw_writer(cache_entry, sample_rate, instruments)
+
+            def emit(instrument, data):
+                writers[instrument].write(data)
+                if raw is not None:
+                    raw.write(instrument, data)
+
+            writers = {}
+            tails = {}  # instrument -> 上一窗口与当前窗口重叠部分的输出
+            offset = 0.0
+            try:
+                while True:
+                    duration = window_seconds
+                    if max_duration:
+                        duration = min(duration, max_duration - offset)
+                    with self.progress.track('decode'):
+                        waveform, _ = audio_adapter.load(
+                            input_file, offset=offset, duration=duration, sample_rate=sample_rate
+                        )
+                    if waveform.shape[0] == 0:
+                        break
+                    # 重采样后的解码长度可能比窗口少几个采样，不能据此判断结束；
+                    # 只有剩余部分不超过两段重叠（远短于窗口）或已读到 max_duration 时才是最后一段，
+                    # 其余情况读到 0 个采样才结束
+                    frames = waveform.shape[0]
+                    is_last = frames <= 2 * overlap_frames or bool(max_duration and offset + duration >= max_duration)
+                    with self.progress.track('inference'):
+                        sources = separator.separate(waveform, input_file)
+
+                    with self.progress.track('encode'):
+                        for instrument, path in zip(instruments, output_files):
+                            data = sources[instrument][:waveform.shape[0]]
+                            if instrument not in writers:
+                                writers[instrument] = _StemWriter(path, sample_rate, data.shape[1], codec, bitrate)
+                            tail = tails.pop(instrument, None)
+                            if tail is not None:
+                                n = min(len(tail), len(data))
+                                fade_in = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+                                emit(instrument, tail[:n] * (1.0 - fade_in) + data[:n] * fade_in)
+                                if len(tail) > n:
+                                    emit(instrument, tail[n:])
+                                data = data[n:]
+                            if is_last or not overlap_frames:
+                                emit(instrument, data)
+                            else:
+                                emit(instrument, data[:-overlap_frames])
+                                tails[instrument] = data[-overlap_frames:].copy()
+                    # 重叠部分只计一次
+                    self.progress.advance((frames - (0 if is_last else overlap_frames)) / sample_rate)
+                    print(f"[Spleeter Subprocess] Window at {offset:.1f}s separated.")
+                    if is_last:
+                        break
+                    # 按实际解码的长度前进，保证保留的重叠部分与下一窗口的开头对齐
+                    offset += (frames - overlap_frames) / sample_rate
+                # 最后一次读取为空时（输入在窗口边界结束），保留的重叠部分直接写出
+                for instrument, tail in tails.items():
+                    emit(instrument, tail)
+            except Exception:
+                if raw is not None:
+                    raw.abort()
+                    raw = None
+                raise
+            finally:
+                for writer in writers.values():
+                    writer.close()
+            if raw is not None:
+                raw.commit()
+            self.last_used[stems] = time.time()
+            print("[Spleeter Subprocess] Windowed separation completed.")
+            return output_files
+        finally:
+            if not self.keep_loaded:
+                self.release()
+
+    @staticmethod
+    def _window_settings(window_seconds):
+        """
+        缓存与非缓存路径共用的处理长度语义：
+        分段时按 (窗口, 重叠) 处理整个文件；不分段时以 MAX_DURATION 为单个窗口，与 separate_to_file 一致
+        :return: (window_seconds, overlap_seconds, max_duration, 缓存条目的处理方式)
+        """
+        if window_seconds:
+            overlap_seconds = min(DEFAULT_OVERLAP_SECONDS, window_seconds / 4)
+            return window_seconds, overlap_seconds, None, f"w{window_seconds:g}-o{overlap_seconds:g}"
+        return MAX_DURATION, 0, MAX_DURATION, 'whole'
+
+    def _separate_cached(self, stems, input_file, output_dir, codec, bitrate, window_seconds):
+        """
+        经过 stem_cache 的分离：已有相同编码参数的结果时直接复制；已有原始音轨时只重新编码；
+        否则分离并同时缓存原始音轨和编码结果
+        """
+        cache = self.stem_cache
+        window_seconds, overlap_seconds, max_duration, mode = self._window_settings(window_seconds)
+        entry = cache.entry(input_file, stems, mode)
+
+        cached = cache.get_encoded(entry, codec, bitrate)
+        if cached:
+            output_files = self._output_files(cached['instruments'], input_file, output_dir, codec)
+            with self.progress.track('cache'):
+                for instrument, path in zip(cached['instruments'], output_files):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    clone_file(cached['paths'][instrument], path)
+            self.progress.advance(self.progress.duration or 0.0)
+            self.last_cache_hit = 'encoded'
+            print(f"[Spleeter Subprocess] Stem cache hit ({entry}, {codec}).")
+            return output_files
+
+        raw = cache.get_raw(entry)
+        if raw:
+            instruments = raw['instruments']
+            output_files = self._output_files(instruments, input_file, output_dir, codec)
+            # 各音轨的编码互不依赖，同时启动 ffmpeg
+            with self.progress.track('encode'):
+                writers = [
+                    _StemWriter(path, raw['sample_rate'], raw['channels'], codec, bitrate, source=raw['paths'][instrument])
+                    for instrument, path in zip(instruments, output_files)
+                ]
+                for writer in writers:
+                    writer.close()
+            self.progress.advance(self.progress.duration or 0.0)
+            self.last_cache_hit = 'raw'
+            print(f"[Spleeter Subprocess] Raw stem cache hit ({entry}), re-encoded to {codec}.")
+        else:
+            output_files = self.separate_windowed(
+                stems, input_file, output_dir, codec, bitrate,
+                window_seconds=window_seconds, overlap_seconds=overlap_seconds,
+                cache_entry=entry, max_duration=max_duration
+            )
+            instruments = [
+                os.path.splitext(os.path.basename(path))[0] for path in output_files
+            ]
+            self.last_cache_hit = None
+        cache.put_encoded(entry, codec, bitrate, instruments, output_files)
+        return output_files
+
+    def separate(self, stems, input_file, output_dir, codec, bitrate, window_seconds=None):
+        """
+        :param window_seconds: 可选，指定时使用分段分离以限制内存占用
+        """
+        if stems not in (2, 4, 5):
+            raise ValueError("无效的分离模型类型")
+        self.last_cache_hit = None
+        self.progress = SeparationProgress(self.on_progress, _probe_duration(input_file))
+        if self.stem_cache is not None:
+            return self._separate_cached(stems, input_file, output_dir, codec, bitrate, window_seconds)
+        if window_seconds:
+            window_seconds, overlap_seconds, _, _ = self._window_settings(window_seconds)
+            return self.separate_windowed(stems, input_file, output_dir, codec, bitrate,
+                                          window_seconds=window_seconds, overlap_seconds=overlap_seconds)
+        return self._process(stems, input_file, output_dir, codec, bitrate)
 
     def spleeter_2stems(self, *args):
-        self._process(2, *args)
+        return self._process(2, *args)
 
     def spleeter_4stems(self, *args):
-        self._process(4, *args)
+        return self._process(4, *args)
 
     def spleeter_5stems(self, *args):
-        self._process(5, *args)
+        return self._process(5, *args)
+
+    def release_idle(self, idle_timeout):
+        """
+        释放超过 idle_timeout 秒未使用的模型
+        :return: 被释放的模型类型列表
+        """
+        now = time.time()
+        idle = [stems for stems, used in self.last_used.items() if now - used > idle_timeout]
+        for stems in idle:
+            self.release(stems)
+        return idle
 
-    def release(self):
-        """释放所有资源"""
-        self._cleanup_temp_config()
-        if self.separator:
-            self.separator = None
+    def release(self, stems=None):
+        """
+        释放资源
+        :param stems: 可选，只释放指定模型；默认释放所有模型
+        """
+        targets = list(self.separators) if stems is None else [stems]
+        for target in targets:
+            self._cleanup_temp_config(target)
+            self.separators.pop(target, None)
+            self.last_used.pop(target, None)
+        if stems is None:
+            for target in list(self.temp_config_paths):
+                self._cleanup_temp_config(target)
+        if targets:
             # 可选：建议Python进行垃圾回收
             import gc
             gc.collect()
-            print("[Spleeter Subprocess] Separator object and resources released.")
\ No newline at end of file
+            print(f"[Spleeter Subprocess] Separator objects released: {targets}")
@@ -0,0 +1,314 @@
+# spleeter_service.py
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from configs import config_manager
+from utils import resource_path
+from stem_cache import DEFAULT_CACHE_BYTES
+
+if sys.platform == 'darwin':
+    ctx = multiprocessing.get_context('spawn')
+    Process = ctx.Process
+    Queue = ctx.Queue
+else:
+    Process = multiprocessing.Process
+    Queue = multiprocessing.Queue
+
+# 模型空闲多少秒后被释放（可通过配置 spleeterIdleTimeout 修改）
+DEFAULT_IDLE_TIMEOUT = 300
+# 默认分段分离窗口长度（秒，可通过配置 spleeterWindowSeconds 开启，0 表示整段处理）
+DEFAULT_WINDOW_SECONDS = 0
+# 工作进程等待任务时检查空闲模型的间隔（秒）
+IDLE_CHECK_INTERVAL = 5
+
+
+def _prepend_bundled_ffmpeg():
+    """将打包的 FFmpeg 目录加入 PATH，供 Spleeter 的音频适配器使用"""
+    ffmpeg_dir = resource_path("ffmpeg")
+    if os.path.isdir(ffmpeg_dir):
+        print(f"[Spleeter Worker] Found bundled FFmpeg directory: {ffmpeg_dir}")
+        os.environ["PATH"] = ffmpeg_dir + os.pathsep + os.environ.get("PATH", "")
+    else:
+        print("[Spleeter Worker] WARNING! Bundled FFmpeg directory not found.")
+        print("                  Spleeter will rely on the system's global PATH.")
+
+
+def _run_batch_job(spl, job, results, warm):
+    """执行批量任务：每完成一个文件推送一次中间结果，最后推送汇总"""
+    def on_result(item):
+        results.put({"job_id": job['job_id'], "final": False, "item": item})
+
+    try:
+        summary = spl.separate_batch(
+            job['stems'], job['input_paths'], job['output_dir'], job['codec'], job['bitrate'],
+            on_result=on_result, prefetch=job.get('prefetch', 2)
+        )
+        results.put({"job_id": job['job_id'], "success": True, "warm": warm, "summary": summary})
+    except Exception as e:
+        results.put({
+            "job_id": job['job_id'],
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        })
+
+
+def _worker_main(jobs, results, idle_timeout, cache_dir=None, cache_bytes=0):
+    """
+    常驻工作进程：按模型类型缓存 Separator，依次处理任务队列中的分离任务，
+    模型空闲超过 idle_timeout 秒后释放
+    :param cache_dir: 可选，分离结果缓存目录；cache_bytes 为 0 时不启用
+    """
+    _prepend_bundled_ffmpeg()
+    from spleeter_part import SpleeterPart  # 在子进程内导入
+    from stem_cache import StemCache
+
+    stem_cache = StemCache(cache_dir, cache_bytes) if cache_dir and cache_bytes else None
+    spl = SpleeterPart(keep_loaded=True, stem_cache=stem_cache)
+    current = {}
+
+    def on_progress(snapshot):
+        results.put({"job_id": current['job_id'], "final": False, "progress": snapshot})
+
+    spl.on_progress = on_progress
+    while True:
+        try:
+            job = jobs.get(timeout=IDLE_CHECK_INTERVAL)
+        except queue.Empty:
+            spl.release_idle(idle_timeout)
+            continue
+        if job is None:
+            break
+
+        start_time = time.time()
+        current['job_id'] = job['job_id']
+        warm = job['stems'] in spl.separators
+        if job.get('type') == 'batch':
+            _run_batch_job(spl, job, results, warm)
+            spl.release_idle(idle_timeout)
+            continue
+        try:
+            output_files = spl.separate(
+                job['stems'], job['input_path'], job['output_dir'], job['codec'], job['bitrate'],
+                window_seconds=job.get('window_seconds')
+            )
+            results.put({
+                "job_id": job['job_id'],
+                "success": True,
+                "output_files": output_files,
+                "warm": warm,
+                "cache_hit": spl.last_cache_hit,
+                "progress": spl.progress.snapshot(),
+                "processing_time": round(time.time() - start_time, 1)
+            })
+        except Exception as e:
+            results.put({
+                "job_id": job['job_id'],
+                "success": False,
+                "error": str(e),
+                "error_type": type(e).__name__
+            })
+        spl.release_idle(idle_timeout)
+
+    spl.release()
+
+
+class SpleeterService:
+    """
+    常驻的人声分离服务：一个长期存活的工作进程保持已加载的模型（2/4/5 stems），
+    连续的分离任务不再重复导入 TensorFlow、构建计算图和加载模型
+    """
+
+    def __init__(self, idle_timeout=None, window_seconds=None, cache_dir=None, cache_bytes=None):
+        """
+        :param cache_dir: 可选，分离结果缓存目录（按音频内容、模型和编码参数寻址）
+        :param cache_bytes: 缓存上限（字节），默认读取配置 spleeterCacheBytes，0 表示关闭
+        """
+        if idle_timeout is None:
+            idle_timeout = config_manager.get('spleeterIdleTimeout', DEFAULT_IDLE_TIMEOUT)
+        if window_seconds is None:
+            window_seconds = config_manager.get('spleeterWindowSeconds', DEFAULT_WINDOW_SECONDS)
+        if cache_bytes is None:
+            cache_bytes = config_manager.get('spleeterCacheBytes', DEFAULT_CACHE_BYTES)
+        self.idle_timeout = idle_timeout
+        self.window_seconds = window_seconds
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self._lock = threading.Lock()
+        self._process = None
+        self._jobs = None
+        # job_id -> {'event': Event, 'result': dict, 'updates': list, 'progress': dict, 'process': 接收该任务的工作进程}
+        self._pending = {}
+
+    def _ensure_worker(self):
+        """按需启动工作进程；进程意外退出后下一次提交会重新启动。调用方须持有 self._lock"""
+        if self._process and self._process.is_alive():
+            return
+        self._jobs = Queue()
+        results = Queue()
+        # Separator 内部会创建进程池，因此工作进程不能是 daemon 进程，退出时由 shutdown() 负责回收
+        self._process = Process(
+            target=_worker_main,
+            args=(self._jobs, results, self.idle_timeout, self.cache_dir, self.cache_bytes)
+        )
+        self._process.start()
+        logging.info(f"Spleeter 工作进程已启动 (pid={self._process.pid})")
+        threading.Thread(
+            target=self._dispatch_results, args=(self._process, results), daemon=True
+        ).start()
+
+    def _dispatch_results(self, process, results):
+        """将工作进程返回的结果分发给等待中的任务"""
+        while True:
+            try:
+                result = results.get(timeout=1)
+            except queue.Empty:
+                if not process.is_alive():
+                    # 只让发给这个进程的任务失败，已发给新进程的任务不受影响
+                    self._fail_pending(f"分离进程意外退出 (exitcode={process.exitcode})", process)
+                    return
+                continue
+            if result.get('final') is False:
+                if 'progress' in result:
+                    self._set_progress(result['job_id'], result['progress'])
+                else:
+                    self._push_update(result['job_id'], result['item'])
+            else:
+                self._complete(result['job_id'], result)
+
+    def _push_update(self, job_id, item):
+        with self._lock:
+            pending = self._pending.get(job_id)
+            if pending:
+                pending['updates'].append(item)
+
+    def _set_progress(self, job_id, progress):
+        with self._lock:
+            pending = self._pending.get(job_id)
+            if pending:
+                pending['progress'] = progress
+
+    def _complete(self, job_id, result):
+        with self._lock:
+            pending = self._pending.get(job_id)
+        if pending:
+            pending['result'] = result
+            pending['event'].set()
+
+    def _fail_pending(self, error, process=None):
+        """使未完成的任务失败；指定 process 时只处理发给该进程的任务"""
+        with self._lock:
+            job_ids = [
+                job_id for job_id, pending in self._pending.items()
+                if not pending['event'].is_set() and (process is None or pending['process'] is process)
+            ]
+        for job_id in job_ids:
+            self._complete(job_id, {"job_id": job_id, "success": False, "error": error, "error_type": "RuntimeError"})
+
+    def submit(self, stems, input_path, output_dir, codec, bitrate, window_seconds=None):
+        """
+        提交分离任务，立即返回任务ID
+        :param window_seconds: 可选，分段分离的窗口长度（秒），默认使用服务配置，0 表示整段处理
+        :return: job_id
+        """
+        return self._enqueue({
+            "stems": stems,
+            "input_path": input_path,
+            "output_dir": output_dir,
+            "codec": codec,
+            "bitrate": bitrate,
+            "window_seconds": self.window_seconds if window_seconds is None else window_seconds
+        })
+
+    def submit_batch(self, stems, input_paths, output_dir, codec, bitrate, prefetch=2):
+        """
+        提交批量分离任务，立即返回任务ID；模型只加载一次，每个文件完成后可通过 poll() 获取结果
+        :param prefetch: 提前解码的文件数
+        :return: job_id
+        """
+        return self._enqueue({
+            "type": "batch",
+            "stems": stems,
+            "input_paths": list(input_paths),
+            "output_dir": output_dir,
+            "codec": codec,
+            "bitrate": bitrate,
+            "prefetch": prefetch
+        })
+
+    def _enqueue(self, job):
+        job_id = uuid.uuid4().hex
+        job['job_id'] = job_id
+        with self._lock:
+            # 启动（或复用）进程、登记和放入队列在同一把锁内完成，任务一定记在实际接收它的进程名下
+            self._ensure_worker()
+            self._pending[job_id] = {
+                'event': threading.Event(), 'result': None, 'updates': [], 'progress': None, 'process': self._process
+            }
+            self._jobs.put(job)
+        return job_id
+
+    def poll(self, job_id):
+        """
+        非阻塞获取任务进度
+        :return: {'updates': 自上次调用后新完成的条目, 'progress': 最新的阶段进度快照,
+                  'done': bool, 'result': 完成时的最终结果}
+        """
+        with self._lock:
+            pending = self._pending.get(job_id)
+            if pending is None:
+                raise KeyError(f"未知的分离任务: {job_id}")
+            updates, pending['updates'] = pending['updates'], []
+            done = pending['event'].is_set()
+            if done:
+                self._pending.pop(job_id, None)
+        return {
+            "updates": updates,
+            "progress": pending['progress'],
+            "done": done,
+            "result": pending['result'] if done else None
+        }
+
+    def discard(self, job_id):
+        """不再关心任务结果：工作进程中已开始的分离无法中途打断，完成后结果被丢弃"""
+        with self._lock:
+            self._pending.pop(job_id, None)
+
+    def result(self, job_id, timeout=None):
+        """
+        等待任务完成并返回结果字典；超时返回 None
+        """
+        with self._lock:
+            pending = self._pending.get(job_id)
+        if pending is None:
+            raise KeyError(f"未知的分离任务: {job_id}")
+        if not pending['event'].wait(timeout):
+            return None
+        with self._lock:
+            self._pending.pop(job_id, None)
+        return pending['result']
+
+    def separate(self, stems, input_path, output_dir, codec, bitrate, window_seconds=None):
+        """提交任务并阻塞等待结果"""
+        return self.result(self.submit(stems, input_path, output_dir, codec, bitrate, window_seconds))
+
+    def shutdown(self, timeout=5):
+        """通知工作进程退出并回收"""
+        with self._lock:
+            process, jobs = self._process, self._jobs
+            self._process = None
+        if not process:
+            return
+        if process.is_alive():
+            jobs.put(None)
+            process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout)
+        self._fail_pending("分离服务已关闭")
+        logging.info("Spleeter 工作进程已关闭")
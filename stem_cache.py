@@ -0,0 +1,179 @@
+# stem_cache.py
+import json
+import os
+import shutil
+import uuid
+from waveform_peaks import file_sha1
+from file_registry import clone_file
+
+# 磁盘缓存默认上限（字节，可通过配置 spleeterCacheBytes 修改，0 表示关闭缓存）
+DEFAULT_CACHE_BYTES = 4 * 1024 * 1024 * 1024
+# 原始浮点音轨所在的变体目录名
+RAW_VARIANT = 'raw'
+MANIFEST_NAME = 'manifest.json'
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class RawStemWriter:
+    """
+    增量写入原始浮点音轨（f32le 交错采样），先写入临时目录，commit() 后才对缓存可见
+    """
+
+    def __init__(self, cache, entry, sample_rate, instruments):
+        self.cache = cache
+        self.final_dir = os.path.join(cache.cache_dir, entry, RAW_VARIANT)
+        self.temp_dir = os.path.join(cache.cache_dir, entry, f".{RAW_VARIANT}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.temp_dir)
+        self.sample_rate = sample_rate
+        self.instruments = list(instruments)
+        self.channels = None
+        self.files = {}
+
+    def write(self, instrument, data):
+        import numpy as np
+        if instrument not in self.files:
+            self.files[instrument] = open(os.path.join(self.temp_dir, f"{instrument}.f32"), 'wb')
+            self.channels = data.shape[1]
+        if len(data):
+            self.files[instrument].write(np.ascontiguousarray(data, dtype='<f4').tobytes())
+
+    def _close_files(self):
+        for f in self.files.values():
+            f.close()
+
+    def commit(self):
+        self._close_files()
+        with open(os.path.join(self.temp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump({
+                "instruments": self.instruments,
+                "files": {instrument: f"{instrument}.f32" for instrument in self.files},
+                "sample_rate": self.sample_rate,
+                "channels": self.channels
+            }, f)
+        shutil.rmtree(self.final_dir, ignore_errors=True)
+        os.replace(self.temp_dir, self.final_dir)
+        self.cache.evict()
+
+    def abort(self):
+        self._close_files()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+
+class StemCache:
+    """
+    以内容寻址的分离结果缓存：<音频 SHA1>-<N>stems-<处理方式>/ 下保存原始浮点音轨（raw/）
+    和各编码参数的输出（<codec>-<bitrate>/），按变体目录的最近访问时间做 LRU 淘汰。
+    只换编码或码率时从原始音轨重新编码，无需重新推理
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._hashes = {}  # abs_path -> (size, mtime, sha1)，避免重复计算同一文件的哈希
+
+    def entry(self, input_file, stems, mode='whole'):
+        """
+        返回输入文件、模型与处理方式对应的缓存条目名
+        :param mode: 处理方式，例如 'whole'（整段）或包含窗口与重叠长度的分段参数，不同方式的结果分开缓存
+        """
+        abs_path = os.path.abspath(input_file)
+        stat = os.stat(abs_path)
+        cached = self._hashes.get(abs_path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            sha1 = cached[2]
+        else:
+            sha1 = file_sha1(abs_path)
+            self._hashes[abs_path] = (stat.st_size, stat.st_mtime, sha1)
+        return f"{sha1}-{stems}stems-{mode}"
+
+    @staticmethod
+    def _variant(codec, bitrate):
+        # 无损格式忽略码率
+        return codec if codec in ('wav', 'flac') else f"{codec}-{bitrate}"
+
+    def _load_variant(self, entry, variant):
+        variant_dir = os.path.join(self.cache_dir, entry, variant)
+        try:
+            with open(os.path.join(variant_dir, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        manifest['paths'] = {}
+        for instrument in manifest['instruments']:
+            path = os.path.join(variant_dir, manifest['files'][instrument])
+            if not os.path.exists(path):
+                return None
+            manifest['paths'][instrument] = path
+        # 更新目录时间戳作为 LRU 的访问记录
+        os.utime(variant_dir)
+        return manifest
+
+    def get_encoded(self, entry, codec, bitrate):
+        """
+        :return: {'instruments': [...], 'paths': {instrument: 缓存中的编码文件}}，未命中返回 None
+        """
+        return self._load_variant(entry, self._variant(codec, bitrate))
+
+    def get_raw(self, entry):
+        """
+        :return: {'instruments', 'sample_rate', 'channels', 'paths': {instrument: .f32 文件}}，未命中返回 None
+        """
+        return self._load_variant(entry, RAW_VARIANT)
+
+    def raw_writer(self, entry, sample_rate, instruments):
+        return RawStemWriter(self, entry, sample_rate, instruments)
+
+    def put_encoded(self, entry, codec, bitrate, instruments, output_files):
+        """将编码后的输出文件复制到缓存"""
+        variant_dir = os.path.join(self.cache_dir, entry, self._variant(codec, bitrate))
+        temp_dir = f"{variant_dir}.{uuid.uuid4().hex[:8]}.tmp"
+        os.makedirs(temp_dir)
+        try:
+            files = {}
+            for instrument, path in zip(instruments, output_files):
+                files[instrument] = os.path.basename(path)
+                clone_file(path, os.path.join(temp_dir, files[instrument]))
+            with open(os.path.join(temp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+                json.dump({"instruments": list(instruments), "files": files}, f)
+            shutil.rmtree(variant_dir, ignore_errors=True)
+            os.replace(temp_dir, variant_dir)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        self.evict()
+
+    def evict(self):
+        """按最近访问时间淘汰变体目录，直到总大小不超过上限"""
+        variants = []
+        total = 0
+        for entry in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, entry)
+            if not os.path.isdir(entry_dir):
+                continue
+            for variant in os.listdir(entry_dir):
+                variant_dir = os.path.join(entry_dir, variant)
+                if variant.startswith('.') or variant.endswith('.tmp'):
+                    continue  # 正在写入的临时目录
+                size = _dir_size(variant_dir)
+                variants.append((os.path.getmtime(variant_dir), size, variant_dir))
+                total += size
+
+        for _, size, variant_dir in sorted(variants):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(variant_dir, ignore_errors=True)
+            total -= size
+            entry_dir = os.path.dirname(variant_dir)
+            if not os.listdir(entry_dir):
+                os.rmdir(entry_dir)
@@ -0,0 +1,138 @@
+# thumbnail_cache.py
+import hashlib
+import io
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+# 磁盘缓存上限（字节，可通过配置 thumbnailCacheBytes 修改）
+DEFAULT_CACHE_BYTES = 200 * 1024 * 1024
+# 缩略图最大宽高，保持原始比例
+DEFAULT_MAX_SIZE = (480, 270)
+JPEG_QUALITY = 85
+# 最多记住的远端 URL 数，超过时淘汰最久未使用的登记（已缓存到磁盘的图片不受影响）
+DEFAULT_MAX_URLS = 2000
+
+
+class ThumbnailCache:
+    """
+    封面缩略图磁盘缓存：以远端 URL 的 SHA1 为键，缩放后存为 <key[:2]>/<key>.jpg。
+    register() 只登记 URL 并返回键，图片在首次被请求（Flask 路由调用 get_path）时才下载和缩放，
+    之后直接从磁盘读取；超过容量时按访问时间淘汰
+    :param fetch: fetch(url) -> 图片字节，失败时抛出异常
+    """
+
+    def __init__(self, cache_dir, fetch, max_bytes=DEFAULT_CACHE_BYTES, max_size=DEFAULT_MAX_SIZE,
+                 max_urls=DEFAULT_MAX_URLS):
+        self.cache_dir = cache_dir
+        self.fetch = fetch
+        self.max_bytes = max_bytes
+        self.max_size = tuple(max_size)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_urls = max(1, int(max_urls))
+        self._urls = OrderedDict()  # key -> 远端 URL
+        self._key_locks = {}  # key -> 正在下载时的锁，同一张图并发请求只下载一次
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.jpg")
+
+    def register(self, url):
+        """登记远端封面 URL，返回缓存键（不下载）"""
+        key = self.key(url)
+        with self._lock:
+            self._urls[key] = url
+            self._urls.move_to_end(key)
+            while len(self._urls) > self.max_urls:
+                self._urls.popitem(last=False)
+        return key
+
+    def get_path(self, key):
+        """
+        返回缓存文件路径，未缓存时下载并缩放；键未登记且没有缓存文件时返回 None
+        """
+        path = self._path(key)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+        with self._lock:
+            url = self._urls.get(key)
+            if url is None:
+                return None
+            self._urls.move_to_end(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            try:
+                if not os.path.exists(path):
+                    self._store(path, self.fetch(url))
+                return path
+            except Exception as e:
+                logging.warning(f"封面缓存失败 {url}: {e}")
+                return None
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def _store(self, path, content):
+        from PIL import Image
+        with Image.open(io.BytesIO(content)) as image:
+            image.thumbnail(self.max_size)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            image.save(temp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+        os.replace(temp_path, path)
+        self._add_bytes(os.path.getsize(path))
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _files(self):
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.jpg'):
+                    yield os.path.join(root, name)
+
+    def _add_bytes(self, size):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(os.path.getsize(path) for path in self._files())
+            else:
+                self._total_bytes += size
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """按最近访问时间删除缩略图，直到总大小不超过上限的 90%"""
+        files = []
+        for path in self._files():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        with self._lock:
+            self._total_bytes = total
@@ -1,5 +1,6 @@
 import sys
 import os
+import shutil
 
 def resource_path(relative_path):
     """
@@ -41,6 +42,28 @@ def get_ffprobe_path():
     return resource_path(os.path.join("ffmpeg", ffprobe_executable))
 
 
+def find_ffmpeg():
+    """
+    优先使用打包的 ffmpeg，其次使用系统 PATH 中的 ffmpeg。
+    均不可用时返回 None。
+    """
+    bundled = get_ffmpeg_path()
+    if os.path.exists(bundled):
+        return bundled
+    return shutil.which('ffmpeg')
+
+
+def find_ffprobe():
+    """
+    优先使用打包的 ffprobe，其次使用系统 PATH 中的 ffprobe。
+    均不可用时返回 None。
+    """
+    bundled = get_ffprobe_path()
+    if os.path.exists(bundled):
+        return bundled
+    return shutil.which('ffprobe')
+
+
 # --- 用于测试的示例 ---
 if __name__ == '__main__':
     print("--- Testing utils.py with './ffmpeg' directory structure ---")
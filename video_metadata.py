@@ -0,0 +1,110 @@
+# video_metadata.py
+import asyncio
+import time
+from collections import OrderedDict
+
+# 默认缓存有效期（秒）与条目上限（可通过配置 videoMetaTTL / videoMetaMaxEntries 修改）
+DEFAULT_TTL = 600
+DEFAULT_MAX_ENTRIES = 1000
+# 批量获取时同时进行的请求数
+DEFAULT_CONCURRENCY = 8
+
+
+class MetadataCache:
+    """
+    按键（如 bvid）缓存元数据的异步 TTL + LRU 缓存：命中时不发请求，
+    同一个键的并发请求合并为一次（后来者等待正在进行的请求）。
+    fetch 返回 None 表示失败，失败结果不缓存。所有方法须在同一个事件循环中使用
+    :param fetch: async fetch(key) -> 元数据或 None；为 None 时缓存只通过 put() 填充，未命中的 get() 返回 None
+    """
+
+    def __init__(self, fetch=None, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max(1, int(max_entries))
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> asyncio.Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def peek(self, key):
+        """返回未过期的缓存值，不存在时返回 None（不发请求）"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    async def get(self, key):
+        value = self.peek(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if self.fetch is None:
+            self.misses += 1
+            return None
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            # shield：某个等待者被取消时不影响其它等待者和请求本身
+            return await asyncio.shield(inflight)
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await self.fetch(key)
+        except Exception as e:
+            future.set_exception(e)
+            # 没有其它等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+            if not future.done():
+                future.cancel()
+
+    async def get_many(self, keys, concurrency=DEFAULT_CONCURRENCY):
+        """按顺序返回各键的元数据；未命中的键最多 concurrency 个同时请求，重复的键只请求一次"""
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def bounded(key):
+            if self.peek(key) is not None:
+                return await self.get(key)
+            async with semaphore:
+                return await self.get(key)
+
+        unique = list(dict.fromkeys(keys))
+        values = await asyncio.gather(*(bounded(key) for key in unique))
+        by_key = dict(zip(unique, values))
+        return [by_key[key] for key in keys]
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,334 @@
+import hashlib
+import io
+import logging
+import os
+import subprocess
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+from utils import find_ffmpeg
+
+# 金字塔第 0 层每个块包含的采样点数，以及相邻两层之间的缩放倍数
+BASE_BLOCK_SAMPLES = 256
+LEVEL_FACTOR = 4
+# 层级块数少于该值时不再继续向上合并
+MIN_LEVEL_BLOCKS = 16
+# 缓存格式版本，结构变化时递增使旧缓存失效
+CACHE_VERSION = 1
+# 内存中最多保留的金字塔数量
+MEMORY_CACHE_ENTRIES = 8
+# 流式解码参数：波形显示使用的采样率与每次从 ffmpeg 管道读取的采样数（float32，约 256 KB）
+STREAM_SAMPLE_RATE = 22050
+STREAM_CHUNK_SAMPLES = 64 * 1024
+
+
+def file_sha1(path, chunk_size=1024 * 1024):
+    """流式计算文件内容的 SHA1"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _block_stats(blocks):
+    """计算二维块数组每一行的 min/max/RMS"""
+    mins = blocks.min(axis=1)
+    maxs = blocks.max(axis=1)
+    rms = np.sqrt(np.einsum('ij,ij->i', blocks, blocks) / blocks.shape[1])
+    return mins, maxs, rms
+
+
+def _reduce_blocks(mins, maxs, rms, factor):
+    """将相邻 factor 个块合并为一个块（向量化）"""
+    n = len(mins)
+    pad = (-n) % factor
+    if pad:
+        # 用最后一个块填充，保证 min/max 不被 0 污染
+        mins = np.concatenate([mins, np.repeat(mins[-1:], pad)])
+        maxs = np.concatenate([maxs, np.repeat(maxs[-1:], pad)])
+        rms = np.concatenate([rms, np.repeat(rms[-1:], pad)])
+    mins = mins.reshape(-1, factor).min(axis=1)
+    maxs = maxs.reshape(-1, factor).max(axis=1)
+    rms = np.sqrt((rms.reshape(-1, factor) ** 2).mean(axis=1))
+    return mins, maxs, rms
+
+
+class PeakPyramid:
+    """
+    多分辨率波形峰值金字塔（类似 .pk/.reapeaks）
+    每一层保存每个块的 min/max/RMS，第 L 层一个块覆盖 BASE_BLOCK_SAMPLES * LEVEL_FACTOR**L 个采样点
+    """
+
+    def __init__(self, sample_rate, total_samples, levels):
+        self.sample_rate = sample_rate
+        self.total_samples = total_samples
+        self.levels = levels  # [(mins, maxs, rms), ...]，float32 数组
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    @classmethod
+    def from_base_blocks(cls, mins, maxs, rms, sample_rate, total_samples):
+        """由第 0 层的块数据逐层合并构建金字塔"""
+        levels = [(mins.astype(np.float32), maxs.astype(np.float32), rms.astype(np.float32))]
+        while len(levels[-1][0]) > MIN_LEVEL_BLOCKS:
+            levels.append(tuple(a.astype(np.float32) for a in _reduce_blocks(*levels[-1], LEVEL_FACTOR)))
+        return cls(sample_rate, total_samples, levels)
+
+    @classmethod
+    def from_samples(cls, y, sample_rate):
+        """
+        单次向量化计算构建金字塔
+        :param y: 标准化到 [-1.0, 1.0] 的单声道 float32 采样
+        """
+        builder = PeakBuilder(sample_rate)
+        builder.feed(np.asarray(y, dtype=np.float32))
+        return builder.snapshot()
+
+    def _block_samples(self, level):
+        return BASE_BLOCK_SAMPLES * LEVEL_FACTOR ** level
+
+    def query(self, width, start_ms=None, end_ms=None):
+        """
+        返回指定时间范围内 width 个点的 min/max/RMS，无需重新解码音频
+        :param width: 输出点数
+        :param start_ms: 可选，可见区域起点（毫秒）
+        :param end_ms: 可选，可见区域终点（毫秒）
+        """
+        width = max(1, int(width))
+        start = 0 if start_ms is None else int(start_ms * self.sample_rate / 1000)
+        end = self.total_samples if end_ms is None else int(end_ms * self.sample_rate / 1000)
+        start = min(max(start, 0), self.total_samples)
+        end = min(max(end, start), self.total_samples)
+        if end <= start or not len(self.levels[0][0]):
+            return {"min": [], "max": [], "rms": []}
+
+        # 选择块大小不超过每个输出点所覆盖采样数的最粗层级
+        samples_per_point = (end - start) / width
+        level = 0
+        while (level + 1 < len(self.levels)
+               and self._block_samples(level + 1) <= samples_per_point):
+            level += 1
+        mins, maxs, rms = self.levels[level]
+        block = self._block_samples(level)
+
+        first = start // block
+        last = min(-(-end // block), len(mins))
+        mins, maxs, rms = mins[first:last], maxs[first:last], rms[first:last]
+
+        edges = np.linspace(0, len(mins), width + 1).astype(np.int64)
+        starts = np.minimum(edges[:-1], len(mins) - 1)
+        counts = np.maximum(edges[1:] - edges[:-1], 1)
+        return {
+            "min": np.minimum.reduceat(mins, starts).tolist(),
+            "max": np.maximum.reduceat(maxs, starts).tolist(),
+            "rms": np.sqrt(np.add.reduceat(rms.astype(np.float64) ** 2, starts) / counts).tolist(),
+        }
+
+    def save(self, path, **meta):
+        """以 npz 格式原子写入缓存文件"""
+        arrays = {}
+        for i, (mins, maxs, rms) in enumerate(self.levels):
+            arrays[f"l{i}_min"] = mins
+            arrays[f"l{i}_max"] = maxs
+            arrays[f"l{i}_rms"] = rms
+        buffer = io.BytesIO()
+        np.savez(buffer,
+                 version=CACHE_VERSION,
+                 sample_rate=self.sample_rate,
+                 total_samples=self.total_samples,
+                 level_count=len(self.levels),
+                 **{k: np.asarray(v) for k, v in meta.items()},
+                 **arrays)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(buffer.getvalue())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取缓存文件，返回 (pyramid, meta)"""
+        with np.load(path) as data:
+            if int(data['version']) != CACHE_VERSION:
+                raise ValueError("峰值缓存版本不匹配")
+            levels = [
+                (data[f"l{i}_min"], data[f"l{i}_max"], data[f"l{i}_rms"])
+                for i in range(int(data['level_count']))
+            ]
+            meta = {k: data[k].item() for k in ('size', 'mtime', 'sha1') if k in data}
+            pyramid = cls(int(data['sample_rate']), int(data['total_samples']), levels)
+        return pyramid, meta
+
+
+class PeakBuilder:
+    """
+    增量构建峰值金字塔：逐块输入采样，只保留第 0 层的块统计和不足一个块的尾部采样，
+    内存占用与解码缓冲区大小无关。feed() 在解码线程中调用，snapshot() 可在其它线程中调用，
+    两者由同一把锁保护，快照中的三组块统计长度一致且与 total_samples 对应
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.total_samples = 0
+        self._carry = np.zeros(0, dtype=np.float32)
+        self._mins = []
+        self._maxs = []
+        self._rms = []
+        self._lock = threading.Lock()
+
+    @property
+    def decoded_duration(self):
+        return self.total_samples / self.sample_rate if self.sample_rate else 0.0
+
+    def feed(self, y):
+        """输入一段标准化的单声道 float32 采样"""
+        with self._lock:
+            self.total_samples += len(y)
+            if len(self._carry):
+                y = np.concatenate([self._carry, y])
+            full = len(y) // BASE_BLOCK_SAMPLES * BASE_BLOCK_SAMPLES
+            if full:
+                mins, maxs, rms = _block_stats(y[:full].reshape(-1, BASE_BLOCK_SAMPLES))
+                self._mins.append(mins.astype(np.float32))
+                self._maxs.append(maxs.astype(np.float32))
+                self._rms.append(rms.astype(np.float32))
+            self._carry = y[full:].copy()
+
+    def _compact(self):
+        """合并已有的分块数组，避免每次快照都重新拼接全部历史"""
+        if len(self._mins) > 1:
+            self._mins = [np.concatenate(self._mins)]
+            self._maxs = [np.concatenate(self._maxs)]
+            self._rms = [np.concatenate(self._rms)]
+
+    def _base_blocks(self):
+        """调用方须持有 self._lock"""
+        self._compact()
+        mins, maxs, rms = list(self._mins), list(self._maxs), list(self._rms)
+        if len(self._carry):
+            for target, values in zip((mins, maxs, rms), _block_stats(self._carry.reshape(1, -1))):
+                target.append(values.astype(np.float32))
+        if not mins:
+            empty = np.zeros(0, dtype=np.float32)
+            return empty, empty, empty
+        return np.concatenate(mins), np.concatenate(maxs), np.concatenate(rms)
+
+    def snapshot(self):
+        """以目前已解码的部分构建金字塔（用于向界面推送部分结果）"""
+        with self._lock:
+            mins, maxs, rms = self._base_blocks()
+            total_samples = self.total_samples
+        if not len(mins):
+            return PeakPyramid(self.sample_rate, 0, [(mins, maxs, rms)])
+        return PeakPyramid.from_base_blocks(mins, maxs, rms, self.sample_rate, total_samples)
+
+
+def stream_peak_pyramid(audio_path, on_progress=None, sample_rate=STREAM_SAMPLE_RATE,
+                        chunk_samples=STREAM_CHUNK_SAMPLES):
+    """
+    通过 ffmpeg 管道流式解码音频，逐块归约为峰值，峰值内存只取决于 chunk_samples
+    :param on_progress: 可选回调，每处理完一个块后以 PeakBuilder 调用
+    :return: PeakPyramid
+    """
+    ffmpeg = find_ffmpeg()
+    if not ffmpeg:
+        raise FileNotFoundError("未找到 ffmpeg，无法流式解码波形")
+
+    command = [
+        ffmpeg, '-v', 'error', '-nostdin', '-i', audio_path,
+        '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 'f32le', '-'
+    ]
+    creationflags = subprocess.CREATE_NO_WINDOW if sys.platform == "win32" else 0
+    builder = PeakBuilder(sample_rate)
+    chunk_bytes = chunk_samples * 4
+    with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          creationflags=creationflags) as process:
+        # stderr 在另一个线程中读取，避免管道写满后 ffmpeg 阻塞
+        stderr_chunks = []
+        stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+        while True:
+            data = process.stdout.read(chunk_bytes)
+            if not data:
+                break
+            usable = len(data) - len(data) % 4
+            builder.feed(np.frombuffer(data[:usable], dtype='<f4'))
+            if on_progress:
+                on_progress(builder)
+        process.wait()
+        stderr_reader.join(timeout=5)
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg 解码失败: {stderr.strip()}")
+    return builder.snapshot()
+
+
+class PeakCache:
+    """
+    峰值金字塔的磁盘缓存
+    以文件哈希校验内容，size/mtime 未变时直接命中，避免重复计算哈希
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self._memory = OrderedDict()  # cache_path -> (size, mtime, pyramid)
+        # 界面线程与流式生成波形的线程都会访问内存缓存
+        self._lock = threading.Lock()
+
+    def _cache_path(self, audio_path):
+        abs_path = os.path.normcase(os.path.abspath(audio_path))
+        key = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{os.path.basename(audio_path)}.{key}.peaks.npz")
+
+    def _remember(self, cache_path, stat, pyramid):
+        with self._lock:
+            self._memory[cache_path] = (stat.st_size, stat.st_mtime, pyramid)
+            self._memory.move_to_end(cache_path)
+            while len(self._memory) > MEMORY_CACHE_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def get_or_build(self, audio_path, build):
+        """
+        获取文件的峰值金字塔，缓存未命中时调用 build(audio_path) 构建并写入缓存
+        :param build: 接收音频路径并返回 PeakPyramid 的函数
+        """
+        stat = os.stat(audio_path)
+        cache_path = self._cache_path(audio_path)
+
+        with self._lock:
+            cached = self._memory.get(cache_path)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+                self._memory.move_to_end(cache_path)
+                return cached[2]
+
+        sha1 = None
+        if os.path.exists(cache_path):
+            try:
+                pyramid, meta = PeakPyramid.load(cache_path)
+                if meta.get('size') == stat.st_size and meta.get('mtime') == stat.st_mtime:
+                    self._remember(cache_path, stat, pyramid)
+                    return pyramid
+                # mtime 变化但内容可能未变（例如被重新复制），用哈希确认
+                sha1 = file_sha1(audio_path)
+                if meta.get('sha1') == sha1:
+                    pyramid.save(cache_path, size=stat.st_size, mtime=stat.st_mtime, sha1=sha1)
+                    self._remember(cache_path, stat, pyramid)
+                    return pyramid
+            except Exception as e:
+                logging.warning(f"读取峰值缓存失败，将重新生成: {cache_path} - {e}")
+
+        pyramid = build(audio_path)
+        try:
+            pyramid.save(cache_path, size=stat.st_size, mtime=stat.st_mtime,
+                         sha1=sha1 or file_sha1(audio_path))
+        except Exception as e:
+            logging.warning(f"写入峰值缓存失败: {cache_path} - {e}")
+        self._remember(cache_path, stat, pyramid)
+        return pyramid
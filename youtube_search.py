@@ -0,0 +1,121 @@
+# youtube_search.py
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# 搜索游标的有效期（秒，可通过配置 youtubeSearchTTL 修改）与最多保留的关键词数
+DEFAULT_TTL = 600
+MAX_CURSORS = 20
+
+
+class YtDlpSearchExtractor:
+    """
+    基于 yt_dlp 的搜索后端：以 process=False 解析 ytsearchall:<关键词>，
+    得到惰性的结果生成器，每次迭代到新的一页时才请求下一批结果（续传 continuation）
+    """
+
+    def __init__(self, ydl_opts):
+        self.ydl_opts = ydl_opts
+
+    def open(self, keyword):
+        """
+        :return: (条目迭代器, close 回调)
+        """
+        import yt_dlp
+        ydl = yt_dlp.YoutubeDL(self.ydl_opts)
+        try:
+            info = ydl.extract_info(f"ytsearchall:{keyword}", download=False, process=False)
+        except Exception:
+            ydl.close()
+            raise
+        entries = (info or {}).get('entries') or []
+        return iter(entries), ydl.close
+
+
+class SearchCursor:
+    """某个关键词的搜索游标：保存已取得的条目和尚未耗尽的结果迭代器"""
+
+    def __init__(self, iterator, close=None):
+        self.iterator = iterator
+        self.close = close or (lambda: None)
+        self.entries = []
+        self.exhausted = False
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def ensure(self, count):
+        """至少取得 count 个条目（结果不足时取到耗尽为止），只请求缺少的部分"""
+        self.last_used = time.monotonic()
+        missing = count - len(self.entries)
+        if missing > 0 and not self.exhausted:
+            fetched = list(itertools.islice(self.iterator, missing))
+            self.entries.extend(fetched)
+            if len(fetched) < missing:
+                self.exhausted = True
+        return self.entries[:count]
+
+
+class YoutubeSearchCursors:
+    """
+    按关键词缓存搜索游标：翻到第 N 页时只提取前面尚未取得的条目，而不是重新提取 N 页结果；
+    游标超过 ttl 未使用即失效。提取后端可替换（如测试用的假后端），只需提供 open(keyword)
+    """
+
+    def __init__(self, extractor, ttl=DEFAULT_TTL, max_cursors=MAX_CURSORS):
+        self.extractor = extractor
+        self.ttl = ttl
+        self.max_cursors = max_cursors
+        self._cursors = OrderedDict()  # keyword -> SearchCursor
+        self._lock = threading.Lock()
+
+    def _cursor(self, keyword):
+        with self._lock:
+            now = time.monotonic()
+            expired = [key for key, cursor in self._cursors.items() if now - cursor.last_used > self.ttl]
+            for key in expired:
+                self._drop_locked(key)
+            cursor = self._cursors.get(keyword)
+            if cursor is not None:
+                self._cursors.move_to_end(keyword)
+                return cursor
+        # 打开新游标需要网络请求，不持有全局锁
+        cursor = SearchCursor(*self.extractor.open(keyword))
+        with self._lock:
+            existing = self._cursors.get(keyword)
+            if existing is not None:
+                # 并发打开了同一个关键词，保留先放入的游标
+                cursor.close()
+                return existing
+            self._cursors[keyword] = cursor
+            while len(self._cursors) > self.max_cursors:
+                self._drop_locked(next(iter(self._cursors)))
+        return cursor
+
+    def _drop_locked(self, keyword):
+        cursor = self._cursors.pop(keyword, None)
+        if cursor is not None:
+            cursor.close()
+
+    def invalidate(self, keyword):
+        with self._lock:
+            self._drop_locked(keyword)
+
+    def page(self, keyword, page, per_page):
+        """
+        :return: (本页条目, 已取得的条目数, 是否已取尽)
+        迭代中出错时丢弃游标并抛出异常，下次请求重新打开
+        """
+        cursor = self._cursor(keyword)
+        with cursor.lock:
+            try:
+                entries = cursor.ensure(page * per_page)
+            except Exception:
+                self.invalidate(keyword)
+                raise
+            return entries[(page - 1) * per_page:], len(cursor.entries), cursor.exhausted
+
+    def close(self):
+        with self._lock:
+            for keyword in list(self._cursors):
+                self._drop_locked(keyword)